@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""bench_forms.py
+
+Measure the per-item cost of copying entities to forms with the compiled
+copiers of conference.py against the reflective all_fields() loops they
+replaced. The entities are built in memory, no datastore is needed.
+
+Run from the project root with the App Engine SDK on the python path:
+
+    python bench_forms.py           # copy 2000 entities of each kind
+    python bench_forms.py -n 10000
+
+"""
+
+import optparse
+import os
+import time
+from datetime import date
+
+os.environ.setdefault('APPLICATION_ID', 'bench')
+
+from google.appengine.ext import ndb
+from conference import ConferenceApi
+from models import Conference, ConferenceForm
+from models import Profile, ProfileForm, TeeShirtSize
+from models import Session, SessionFormOut
+from models import Speaker, SpeakerForm
+from rehome import websafeKey
+
+
+# the reflective copies, as they were before the copiers were compiled
+
+def reflectiveConference(conf, displayName):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, websafeKey(conf))
+    if displayName:
+        setattr(cf, 'organizerDisplayName', displayName)
+    cf.check_initialized()
+    return cf
+
+
+def reflectiveProfile(prof):
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name,
+                        getattr(TeeShirtSize, getattr(prof, field.name)))
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+def reflectiveSession(session, names):
+    sf = SessionFormOut()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name in ['start_time', 'date']:
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+    sk = websafeKey(session)
+    setattr(sf, 'sessionKey', sk)
+    setattr(sf, 'websafeConferenceKey',
+            ndb.Key(urlsafe=sk).parent().urlsafe())
+    setattr(sf, 'speaker', names)
+    sf.check_initialized()
+    return sf
+
+
+def reflectiveSpeaker(speaker):
+    sf = SpeakerForm()
+    for field in sf.all_fields():
+        if hasattr(speaker, field.name):
+            setattr(sf, field.name, getattr(speaker, field.name))
+        elif field.name == "speakerKey":
+            setattr(sf, field.name, speaker.key.urlsafe())
+    sf.check_initialized()
+    return sf
+
+
+def entities(n):
+    """Return n conferences, profiles, sessions and speakers."""
+    confs = [Conference(id=i + 1, name='Conference %d' % i, city='London',
+                        topics=['Web', 'Cloud'], startDate=date(2026, 11, 1),
+                        endDate=date(2026, 11, 3), month=11,
+                        maxAttendees=100, seatsAvailable=40,
+                        organizerUserId='org@example.com')
+             for i in range(n)]
+    profiles = [Profile(id='user%d@example.com' % i, displayName='User %d' % i,
+                        mainEmail='user%d@example.com' % i,
+                        teeShirtSize='M_M') for i in range(n)]
+    sessions = [Session(parent=confs[i].key, id=i + 1, name='Session %d' % i,
+                        highlights='Highlights', speakerKeys=[],
+                        start_time=900 + i % 9 * 100,
+                        date=date(2026, 11, 2), duration=45,
+                        session_type='Workshop', location='Room 1')
+                for i in range(n)]
+    speakers = [Speaker(id=i + 1, name='Speaker %d' % i,
+                        organisation=['Acme']) for i in range(n)]
+    return confs, profiles, sessions, speakers
+
+
+def timed(copy, items):
+    """Return the microseconds per item of copying items."""
+    started = time.time()
+    for item in items:
+        copy(item)
+    return (time.time() - started) * 1e6 / len(items)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', type='int', default=2000,
+                      help='entities of each kind to copy')
+    options, args = parser.parse_args()
+
+    api = ConferenceApi()
+    confs, profiles, sessions, speakers = entities(options.n)
+    cases = [
+        ('Conference', confs, lambda c: reflectiveConference(c, 'Org'),
+         lambda c: api._copyConferenceToForm(c, 'Org')),
+        ('Profile', profiles, reflectiveProfile, api._copyProfileToForm),
+        ('Session', sessions, lambda s: reflectiveSession(s, ['A', 'B']),
+         lambda s: api._copySessionToForm(s, ['A', 'B'])),
+        ('Speaker', speakers, reflectiveSpeaker, api._copySpeakerToForm),
+    ]
+    print '%-12s %14s %14s %8s' % ('kind', 'reflective us', 'compiled us',
+                                   'speedup')
+    for kind, items, reflective, compiled in cases:
+        # both copies must give the same form
+        assert reflective(items[0]) == compiled(items[0]), kind
+        before, after = timed(reflective, items), timed(compiled, items)
+        print '%-12s %14.1f %14.1f %7.1fx' % (kind, before, after,
+                                              before / after)
+
+
+if __name__ == '__main__':
+    main()
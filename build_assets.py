@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""build_assets.py
+
+Concatenate and minify the stylesheets and scripts of templates/index.html
+into bundles named by content hash, and point index.html at them. The
+bundles are served from /dist with a far-future expiration: a changed file
+gets a new name, so browsers never have to revalidate a bundle.
+
+Run from the project root before deploying:
+
+    python build_assets.py          # build the bundles, rewrite index.html
+    python build_assets.py --dev    # point index.html back at the sources
+
+index.html marks each bundle with <!-- bundle:NAME --> ... <!-- endbundle -->;
+the block is replaced on every run.
+
+"""
+
+import hashlib
+import optparse
+import os
+import re
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INDEX_HTML = os.path.join(ROOT, 'templates', 'index.html')
+DIST_DIR = os.path.join(ROOT, 'static', 'dist')
+DIST_URL = '/dist'
+
+# bundle name -> (source files, url of each source in development)
+BUNDLES = {
+    'app.css': [('static/bootstrap/css/bootstrap-cosmo.css', '/css/bootstrap-cosmo.css'),
+                ('static/bootstrap/css/main.css', '/css/main.css'),
+                ('static/bootstrap/css/offcanvas.css', '/css/offcanvas.css')],
+    'app.js': [('static/js/app.js', '/js/app.js'),
+               ('static/js/controllers.js', '/js/controllers.js')],
+}
+TAGS = {
+    '.css': '<link rel="stylesheet" href="%s">',
+    '.js': '<script src="%s"></script>',
+}
+BUNDLE_BLOCK = re.compile(
+    r'(?P<indent>[ \t]*)<!-- bundle:(?P<name>[\w.]+) -->.*?<!-- endbundle -->',
+    re.DOTALL)
+
+
+def _skipString(source, i):
+    """Return the index after the string literal starting at i."""
+    quote = source[i]
+    i += 1
+    while i < len(source) and source[i] != quote:
+        i += 2 if source[i] == '\\' else 1
+    return i + 1
+
+
+def minifyCss(source):
+    """Strip comments and whitespace from a stylesheet. Whitespace before
+    a colon is kept, since it matters in selectors ("a :hover")."""
+    out, i = [], 0
+    while i < len(source):
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = len(source) if end < 0 else end + 2
+        elif source[i] in '"\'':
+            end = _skipString(source, i)
+            out.append(source[i:end])
+            i = end
+        else:
+            end = i
+            while (end < len(source) and source[end] not in '"\'' and
+                   not source.startswith('/*', end)):
+                end += 1
+            chunk = re.sub(r'\s+', ' ', source[i:end])
+            chunk = re.sub(r' ?([{};,>]) ?', r'\1', chunk)
+            out.append(re.sub(r': ', ':', chunk))
+            i = end
+    return ''.join(out).replace(';}', '}').strip()
+
+
+def minifyJs(source):
+    """Strip comments, indentation and blank lines from a script. Line
+    breaks are kept, so automatic semicolon insertion is unchanged.
+    Regular expression literals aren't recognised, use RegExp in the
+    sources."""
+    out, i = [], 0
+    while i < len(source):
+        if source.startswith('//', i):
+            end = source.find('\n', i)
+            i = len(source) if end < 0 else end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = len(source) if end < 0 else end + 2
+        elif source[i] in '"\'':
+            end = _skipString(source, i)
+            out.append(source[i:end])
+            i = end
+        else:
+            out.append(source[i])
+            i += 1
+    lines = (line.strip() for line in ''.join(out).splitlines())
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+def _concatCss(sources):
+    """Concatenate stylesheets, moving their @import rules to the top."""
+    imports, rules = [], []
+    for source in sources:
+        for line in source.splitlines(True):
+            if line.startswith('@import'):
+                imports.append(line)
+            else:
+                rules.append(line)
+        rules.append('\n')
+    return ''.join(imports + rules)
+
+
+def buildBundle(name):
+    """Write a bundle to DIST_DIR, removing its older builds; return its
+    file name."""
+    sources = []
+    for path, url in BUNDLES[name]:
+        with open(os.path.join(ROOT, path)) as f:
+            sources.append(f.read())
+    base, ext = os.path.splitext(name)
+    if ext == '.css':
+        content = minifyCss(_concatCss(sources))
+    else:
+        # a statement per file can't run into the next one
+        content = minifyJs(';\n'.join(sources))
+    digest = hashlib.md5(content).hexdigest()[:12]
+    filename = '%s.%s%s' % (base, digest, ext)
+
+    if not os.path.isdir(DIST_DIR):
+        os.makedirs(DIST_DIR)
+    stale = re.compile(r'^%s\.[0-9a-f]{12}%s$' % (re.escape(base),
+                                                  re.escape(ext)))
+    for old in os.listdir(DIST_DIR):
+        if stale.match(old) and old != filename:
+            os.remove(os.path.join(DIST_DIR, old))
+    with open(os.path.join(DIST_DIR, filename), 'w') as f:
+        f.write(content)
+    return filename
+
+
+def rewriteIndex(urls, path=INDEX_HTML):
+    """Replace the bundle blocks of index.html with tags for urls, a dict
+    of bundle name -> list of urls."""
+    with open(path) as f:
+        html = f.read()
+
+    def block(match):
+        name, indent = match.group('name'), match.group('indent')
+        tag = TAGS[os.path.splitext(name)[1]]
+        lines = ['<!-- bundle:%s -->' % name]
+        lines.extend(tag % url for url in urls[name])
+        lines.append('<!-- endbundle -->')
+        return '\n'.join(indent + line for line in lines)
+
+    with open(path, 'w') as f:
+        f.write(BUNDLE_BLOCK.sub(block, html))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--dev', action='store_true',
+                      help='point index.html at the unbundled sources')
+    options, args = parser.parse_args()
+
+    if options.dev:
+        urls = dict((name, [url for path, url in files])
+                    for name, files in BUNDLES.items())
+    else:
+        urls = {}
+        for name in sorted(BUNDLES):
+            filename = buildBundle(name)
+            size = os.path.getsize(os.path.join(DIST_DIR, filename))
+            print 'Wrote %s/%s (%d bytes)' % (DIST_URL, filename, size)
+            urls[name] = ['%s/%s' % (DIST_URL, filename)]
+    rewriteIndex(urls)
+    print 'Rewrote %s' % INDEX_HTML
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Two tier cache of read-mostly derived values (announcement, featured
+speaker). Reads are served from an in-process dict for a few seconds, then
+from memcache. Memcache holds (value, freshUntil) pairs: a stale value is
+still served while the single request holding the memcache lock recomputes
+it, and a missing value is recomputed only by the lock holder, so an
+eviction never sets off a herd of recomputes. Freshness deadlines are
+jittered so values cached together don't go stale together.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from settings import CACHE_LOCAL_SECONDS
+from settings import CACHE_STALE_SECONDS
+
+
+MEMCACHE_LOCK_KEY = 'RECOMPUTE LOCK %s'
+# a recompute that dies holding the lock blocks others for this long
+LOCK_SECONDS = 10
+# fraction of a ttl taken off at random
+JITTER = 0.1
+# the in-process tier is dropped when it grows past this many keys
+LOCAL_MAX_KEYS = 1000
+
+# key -> (value, expires)
+_local = {}
+
+
+def _jittered(seconds):
+    return seconds * (1 - random.uniform(0, JITTER))
+
+
+def _setLocal(key, value):
+    if len(_local) >= LOCAL_MAX_KEYS:
+        _local.clear()
+    _local[key] = (value, time.time() + _jittered(CACHE_LOCAL_SECONDS))
+
+
+def refreshCached(key, compute, ttl):
+    """Compute the value of key and cache it for ttl seconds (plus
+    CACHE_STALE_SECONDS of staleness); return the value. Recompute tasks
+    call this directly to push a new value."""
+    value = compute()
+    memcache.set(key, (value, time.time() + _jittered(ttl)),
+                 time=ttl + CACHE_STALE_SECONDS)
+    _setLocal(key, value)
+    return value
+
+
+def invalidateCached(key):
+    """Drop a cached value; other instances keep it in process for up to
+    CACHE_LOCAL_SECONDS."""
+    memcache.delete(key)
+    _local.pop(key, None)
+
+
+@ndb.tasklet
+def getCachedAsync(key, compute, ttl):
+    """Return the cached value of key, computing it with compute() when it
+    is missing or stale and this request wins the recompute lock. A request
+    losing the lock gets the stale value, or None if there is none."""
+    local = _local.get(key)
+    if local and local[1] > time.time():
+        raise ndb.Return(local[0])
+
+    ctx = ndb.get_context()
+    cached = yield ctx.memcache_get(key)
+    if cached is not None and cached[1] > time.time():
+        _setLocal(key, cached[0])
+        raise ndb.Return(cached[0])
+
+    locked = yield ctx.memcache_add(MEMCACHE_LOCK_KEY % key, True,
+                                    time=LOCK_SECONDS)
+    if not locked:
+        raise ndb.Return(cached[0] if cached is not None else None)
+    try:
+        value = refreshCached(key, compute, ttl)
+    finally:
+        memcache.delete(MEMCACHE_LOCK_KEY % key)
+    raise ndb.Return(value)
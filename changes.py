@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""changes.py
+
+Delta sync of the public data (conferences, sessions, speakers). These
+kinds carry an auto-updated `modified` timestamp, and a deleted conference
+or session leaves a Tombstone. getChanges returns what changed after a
+timestamp, kind by kind in timestamp order, in pages linked by a cursor;
+the client keeps the data and applies the deltas.
+
+Entities written before `modified` existed are only synced after the
+resave mappers have run over their kind.
+
+"""
+
+from datetime import datetime, timedelta
+
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from models import Conference
+from models import Session
+from models import Speaker
+from models import Tombstone
+from rehome import websafeKey
+from settings import CHANGES_PAGE_SIZE
+from settings import CHANGES_SKEW_SECONDS
+from settings import CHANGES_TOMBSTONE_DAYS
+
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# synced kinds, in the order a sync returns them
+SYNCED = [(Conference, Conference.modified),
+          (Session, Session.modified),
+          (Speaker, Speaker.modified),
+          (Tombstone, Tombstone.deleted)]
+
+
+def formatTimestamp(dt):
+    return dt.strftime(TIMESTAMP_FORMAT)
+
+
+def parseTimestamp(value):
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def tombstone(entity):
+    """Return the Tombstone of a deleted conference or session, to put in
+    the deleting transaction."""
+    return Tombstone(id=websafeKey(entity), kind=entity.key.kind())
+
+
+def _tombstoneCutoff():
+    return datetime.utcnow() - timedelta(days=CHANGES_TOMBSTONE_DAYS)
+
+
+def _parseToken(token):
+    """Return the (index, until, since, cursor) of a page token; raise
+    ValueError if it is malformed."""
+    try:
+        index, until, since, cursor = token.split('|')
+        index = int(index)
+        parseTimestamp(until)
+        since = parseTimestamp(since) if since else None
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+    except (TypeError, datastore_errors.BadValueError) as e:
+        raise ValueError(str(e))
+    if not 0 <= index < len(SYNCED):
+        raise ValueError('No synced kind %d' % index)
+    return index, until, since, cursor
+
+
+def fetchChanges(since=None, token=None, limit=CHANGES_PAGE_SIZE):
+    """Return a page of the entities changed after since (a datetime, None
+    for everything; ignored after the first page) as (entities, token of
+    the next page or None, sync timestamp, reset). The sync timestamp is
+    the since of the next sync. reset is True when since is older than the
+    kept tombstones, the client must then drop its data, which is sent
+    again in full. Raise ValueError if token is malformed."""
+    reset = False
+    if token:
+        # the token carries the since of the first page
+        index, until, since, cursor = _parseToken(token)
+    else:
+        index, cursor = 0, None
+        # leave a margin for writes not yet visible to queries; a change in
+        # the margin is sent twice, never missed
+        until = formatTimestamp(
+            datetime.utcnow() - timedelta(seconds=CHANGES_SKEW_SECONDS))
+        if since is not None and since < _tombstoneCutoff():
+            since, reset = None, True
+
+    entities = []
+    while index < len(SYNCED) and len(entities) < limit:
+        model, prop = SYNCED[index]
+        q = model.query()
+        if since is not None:
+            q = q.filter(prop > since)
+        try:
+            page, cursor, more = q.order(prop).fetch_page(
+                limit - len(entities), start_cursor=cursor)
+        except datastore_errors.BadRequestError as e:
+            # a cursor of another query, from a tampered token
+            raise ValueError(str(e))
+        entities.extend(page)
+        if not (more and cursor):
+            index, cursor = index + 1, None
+
+    token = None
+    if index < len(SYNCED):
+        token = '|'.join([str(index), until,
+                          formatTimestamp(since) if since else '',
+                          cursor.urlsafe() if cursor else ''])
+    return entities, token, until, reset
+
+
+def purgeTombstones(batch=500):
+    """Delete the tombstones older than CHANGES_TOMBSTONE_DAYS; return the
+    number deleted."""
+    q = Tombstone.query(Tombstone.deleted < _tombstoneCutoff())
+    deleted = 0
+    while True:
+        keys = q.fetch(batch, keys_only=True)
+        ndb.delete_multi(keys)
+        deleted += len(keys)
+        if len(keys) < batch:
+            return deleted
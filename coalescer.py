@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""coalescer.py
+
+Debounced recomputation of derived data (featured speaker, announcement,
+pushed seats). Writes mark a (kind, scope) pair dirty; the first write in a
+burst schedules a named task with a short countdown and the following
+writes are absorbed by the dirty marker, so a burst triggers a single
+recompute per scope.
+
+"""
+
+import hashlib
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from settings import SEATS_PUSH_SECONDS
+
+
+COALESCE_WINDOW_SECONDS = 10
+# kinds coalesced over a window other than COALESCE_WINDOW_SECONDS
+COALESCE_WINDOWS = {
+    'seats': SEATS_PUSH_SECONDS,
+}
+# the marker outlives the window so a lost task can't block recomputes forever
+DIRTY_MARKER_SECONDS = 60
+MEMCACHE_DIRTY_KEY = 'DIRTY %s %s'
+MEMCACHE_GENERATION_KEY = 'DIRTY GENERATION %s %s'
+RECOMPUTE_URL = '/tasks/recompute/%s'
+
+
+def markDirty(kind, scope=''):
+    """Flag the derived data kind for scope (e.g. a websafe conference key)
+    as stale and schedule its recompute unless one is already pending.
+    Return True if a recompute task was added."""
+    window = COALESCE_WINDOWS.get(kind, COALESCE_WINDOW_SECONDS)
+    marker = MEMCACHE_DIRTY_KEY % (kind, scope)
+    generation = None
+    if memcache.add(marker, True, time=DIRTY_MARKER_SECONDS):
+        # name the task after the marker generation, so a concurrent writer
+        # that missed the marker can't add a second task for the same burst
+        generation = memcache.incr(MEMCACHE_GENERATION_KEY % (kind, scope),
+                                   initial_value=0)
+    elif memcache.get(marker) is not None:
+        return False
+    # memcache unavailable, name the task after the time slot instead
+    if generation is None:
+        generation = int(time.time()) // window
+    name = '%s-%s-%d' % (kind, hashlib.md5(scope).hexdigest(), generation)
+    try:
+        taskqueue.add(name=name, url=RECOMPUTE_URL % kind,
+                      params={'scope': scope},
+                      countdown=window)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        return False
+    return True
+
+
+def clearDirty(kind, scope=''):
+    """Clear the dirty marker before recomputing, so writes made during the
+    recompute schedule another one."""
+    memcache.delete(MEMCACHE_DIRTY_KEY % (kind, scope))
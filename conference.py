@@ -23,9 +23,8 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 from operator import lt, gt
-from google.appengine.api import urlfetch
+from google.appengine.api import app_identity
 from google.appengine.ext import ndb
-from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from models import Profile
 from models import ProfileMiniForm
@@ -49,8 +48,39 @@ from models import StringMessage
 from models import BooleanMessage
 from models import ConflictException
 from models import Speaker, SpeakerForm
+from models import SpeakerSession, SpeakerSessionForm, SpeakerProfileForm
+from models import RelatedSessions
+from models import WaitlistEntry
+from models import ConferenceSeat
+from models import RegistrationStatus, RegistrationTicketForm
+from models import ConferencePageForm
+from models import ConferenceStats, ConferenceStatsForm, TeeShirtCountForm
+from models import ChangesForm
+from models import ConferenceTrendsForm, DailyActivityForm
+from models import SuggestionForm, SuggestionsForm
+from models import RelatedSessionForm, RelatedSessionsForm
 from utils import getUserId
+from mailer import queueConfirmationEmail
+from coalescer import markDirty
+from related import queueRelatedUpdate
+from ical import invalidateConferenceFeed, invalidateUserFeed, userFeedToken
+from registration import recordIntent, intentKey, ticketKey
+from stats import statsKey, countAttendee, changeTeeShirtSize
+from cache import getCachedAsync, refreshCached
+from changes import fetchChanges, parseTimestamp, tombstone
+from idempotency import runOnce
+from rehome import conferenceKey, sessionKey, websafeKey, legacySessionKey
+from suggest import suggest, queueSuggestionUpdate, KINDS
+from copiers import compileCopier, formValues
+from metrics import timedApp
+from trends import recordActivity, getDailyActivity, ACTIVITY_KINDS
+from push import addSeatSubscription
 from settings import WEB_CLIENT_ID
+from settings import ANNOUNCEMENT_CACHE_SECONDS
+from settings import FEATURED_SPEAKER_CACHE_SECONDS
+from settings import SUGGEST_ENTRIES
+from settings import TRENDS_DEFAULT_DAYS
+from settings import TRENDS_MAX_DAYS
 
 
 
@@ -63,6 +93,7 @@ DEFAULTS = {
     "maxAttendees": 0,
     "seatsAvailable": 0,
     "topics": [ "Default", "Topic" ],
+    "asyncRegistration": False,
 }
 
 SESSION_DEFAULTS = {
@@ -87,6 +118,24 @@ FIELDS =    {
         'MAX_ATTENDEES': 'maxAttendees',
         }
 
+# model to form copiers, compiled at import time (see copiers.py)
+copyConference = compileCopier(Conference, ConferenceForm,
+                               {'startDate': str, 'endDate': str})
+copyProfile = compileCopier(Profile, ProfileForm, {
+    'teeShirtSize': dict((size.name, size) for size in TeeShirtSize).get})
+copySession = compileCopier(Session, SessionFormOut,
+                            {'start_time': str, 'date': str})
+copySpeaker = compileCopier(Speaker, SpeakerForm)
+copySpeakerSession = compileCopier(SpeakerSession, SpeakerSessionForm, {
+    'date': lambda value: None if value is None else str(value),
+    'start_time': lambda value: None if value is None else str(value)})
+
+# session properties accepted by querySessions and doubleQuerySessions;
+# inequality filters are only allowed on the ordered ones
+SESSION_FIELDS = ['name', 'speakerKeys', 'session_type', 'location',
+                  'date', 'start_time', 'duration']
+SESSION_INEQUALITY_FIELDS = ['date', 'start_time', 'duration']
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -126,7 +175,39 @@ SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     speakerKey=messages.StringField(1),
 )
 
+TICKET_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ticket=messages.StringField(1),
+)
+
+REGISTER_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    requestId=messages.StringField(2),
+)
+
+TRENDS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    startDate=messages.StringField(2),
+    endDate=messages.StringField(3),
+)
+
+CHANGES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    since=messages.StringField(1),
+    cursor=messages.StringField(2),
+)
+
+SUGGEST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    prefix=messages.StringField(1),
+    kind=messages.StringField(2),
+    limit=messages.IntegerField(3),
+)
+
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT ANNOUNCEMENTS"
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED SPEAKER %s"
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -141,20 +222,8 @@ class ConferenceApi(remote.Service):
 
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return copyConference(conf, websafeKey=websafeKey(conf),
+                              organizerDisplayName=displayName or None)
 
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
@@ -168,9 +237,10 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException("Conference 'name' field required")
 
         # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        data = formValues(request)
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['requestId']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -193,38 +263,42 @@ class ConferenceApi(remote.Service):
             data["seatsAvailable"] = data["maxAttendees"]
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
-        p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
+        # conferences are root entities, so registrations for one don't
+        # contend with the organizer's other conferences and profile
+        c_id = Conference.allocate_ids(size=1)[0]
+        c_key = ndb.Key(Conference, c_id)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        # create Conference & return (modified) ConferenceForm; the
+        # confirmation email job is queued while the put is in flight
+        conf_future = Conference(**data).put_async()
+        queueConfirmationEmail(user.email(), c_key.urlsafe())
+        queueSuggestionUpdate('conference', c_key.urlsafe(), data['name'])
+        conf_future.get_result()
         return request
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
     def createConference(self, request):
-        """Create new conference."""
-        return self._createConferenceObject(request)
+        """Create new conference; a retry with the same requestId returns
+        the conference created by the first request."""
+        return runOnce('createConference', request.requestId,
+                       ConferenceForm,
+                       lambda: self._createConferenceObject(request),
+                       lambda response: markDirty('announcement'))
     
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-
-        # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # update existing conference; fetch the organizer profile alongside
+        conf, prof = self._getConferenceAndProfile(
+            conferenceKey(request.websafeConferenceKey),
+            ndb.Key(Profile, user_id)).get_result()
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
@@ -235,21 +309,28 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        name = conf.name
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
-        for field in request.all_fields():
-            data = getattr(request, field.name)
+        for field, data in formValues(request).items():
             # only copy fields where we get data
             if data not in (None, []):
                 # special handling for dates (convert string to Date)
-                if field.name in ('startDate', 'endDate'):
+                if field in ('startDate', 'endDate'):
                     data = datetime.strptime(data, "%Y-%m-%d").date()
-                    if field.name == 'startDate':
+                    if field == 'startDate':
                         conf.month = data.month
                 # write to Conference object
-                setattr(conf, field.name, data)
+                setattr(conf, field, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
+        # the speaker profiles, the calendar feed and the name suggestions
+        # show the conference name
+        if conf.name != name:
+            taskqueue.add(url='/tasks/refresh_speakers',
+                          params={'wsck': request.websafeConferenceKey},
+                          transactional=True)
+            queueSuggestionUpdate('conference', websafeKey(conf), conf.name,
+                                  name, transactional=True)
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
     
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
@@ -257,22 +338,181 @@ class ConferenceApi(remote.Service):
             http_method='PUT', name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        conf = self._updateConferenceObject(request)
+        markDirty('announcement')
+        return conf
     
+    @ndb.transactional(xg=True)
+    def _deleteConferenceObject(self, request):
+        """Delete a conference and queue the cleanup of its sessions and
+        of the references to it."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        wsck = request.websafeConferenceKey
+        conf = conferenceKey(wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can delete the conference.')
+        conf.key.delete()
+        tombstone(conf).put()
+        taskqueue.add(url='/tasks/delete', transactional=True,
+                      params={'kind': 'conference', 'key': wsck,
+                              'stage': 'sessions'})
+        queueSuggestionUpdate('conference', websafeKey(conf),
+                              oldName=conf.name, transactional=True)
+
+    @endpoints.method(CONF_GET_REQUEST, ConferenceStatsForm,
+            path='conference/{websafeConferenceKey}/stats',
+            http_method='GET', name='getConferenceStats')
+    def getConferenceStats(self, request):
+        """Return the registration and t-shirt size counts of a conference
+        to its organizer."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        c_key = conferenceKey(request.websafeConferenceKey)
+        conf, stats = ndb.get_multi([c_key, statsKey(c_key)])
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can see the conference statistics.')
+        stats = stats or ConferenceStats()
+        return ConferenceStatsForm(
+            websafeConferenceKey=request.websafeConferenceKey,
+            registrations=stats.registrations,
+            teeShirtSizes=[TeeShirtCountForm(
+                teeShirtSize=getattr(TeeShirtSize, size), count=count)
+                for size, count in zip(stats.teeShirtSizes,
+                                       stats.teeShirtCounts) if count])
+
+    @endpoints.method(TRENDS_GET_REQUEST, ConferenceTrendsForm,
+            path='conference/{websafeConferenceKey}/trends',
+            http_method='GET', name='getConferenceTrends')
+    def getConferenceTrends(self, request):
+        """Return the daily registrations, cancellations, wishlist changes
+        and new sessions of a conference to its organizer."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        try:
+            end = datetime.strptime(request.endDate, "%Y-%m-%d").date() \
+                if request.endDate else datetime.utcnow().date()
+            start = datetime.strptime(request.startDate, "%Y-%m-%d").date() \
+                if request.startDate else \
+                end - timedelta(days=TRENDS_DEFAULT_DAYS - 1)
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'startDate' and 'endDate' must be YYYY-MM-DD dates.")
+        if not 0 <= (end - start).days < TRENDS_MAX_DAYS:
+            raise endpoints.BadRequestException(
+                'The range must be 1 to %d days.' % TRENDS_MAX_DAYS)
+        c_key = conferenceKey(request.websafeConferenceKey)
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can see the conference trends.')
+        days = []
+        for day, activity in getDailyActivity(c_key, start, end):
+            form = DailyActivityForm(date=str(day))
+            for kind in ACTIVITY_KINDS:
+                setattr(form, kind, getattr(activity, kind, 0))
+            days.append(form)
+        return ConferenceTrendsForm(
+            websafeConferenceKey=request.websafeConferenceKey, days=days)
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/delete/{websafeConferenceKey}',
+            http_method='DELETE', name='deleteConference')
+    def deleteConference(self, request):
+        """Delete a conference with its sessions (by websafeConferenceKey)."""
+        self._deleteConferenceObject(request)
+        return BooleanMessage(data=True)
+
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # get Conference object and its organizer; bail if not found
+        conf, prof = self._getConferenceAndOrganiserAsync(
+            conferenceKey(request.websafeConferenceKey)).get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
         # return ConferenceForm
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
+    @ndb.tasklet
+    def _getConferenceAndOrganiserAsync(self, c_key):
+        """Get a Conference and the Profile of its organizer."""
+        conf = yield c_key.get_async()
+        prof = None
+        if conf:
+            prof = yield ndb.Key(Profile, conf.organizerUserId).get_async()
+        raise ndb.Return((conf, prof))
+
+    @ndb.tasklet
+    def _getConferencePageAsync(self, wsck):
+        """Issue all the reads of the conference page together. The
+        caller's profile, waitlist entry and ticket are None when signed out.
+        """
+        c_key = conferenceKey(wsck)
+        futures = [self._getConferenceAndOrganiserAsync(c_key),
+                   Session.query(ancestor=c_key).order(
+                       Session.date, Session.start_time).fetch_async(),
+                   self._getFeaturedSpeakerAsync(wsck),
+                   self._getAnnouncementAsync()]
+        user = endpoints.get_current_user()
+        if user:
+            user_id = getUserId(user)
+            futures += [self._getProfileFromUserAsync(),
+                        self._waitlistEntryKey(wsck, user_id).get_async(),
+                        intentKey(wsck, user_id).get_async()]
+        results = yield futures
+        if not user:
+            results += [None, None, None]
+        raise ndb.Return(list(results[0]) + results[1:])
+
+    @endpoints.method(CONF_GET_REQUEST, ConferencePageForm,
+            path='conference/{websafeConferenceKey}/page',
+            http_method='GET', name='getConferencePage')
+    def getConferencePage(self, request):
+        """Return the conference, the caller's registration and wishlist
+        state, the schedule, the featured speaker and the announcement."""
+        (conf, organiser, sessions, featured, announcement,
+         prof, entry, intent) = self._getConferencePageAsync(
+            request.websafeConferenceKey).get_result()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+
+        wsck = request.websafeConferenceKey
+        page = ConferencePageForm(
+            conference=self._copyConferenceToForm(
+                conf, getattr(organiser, 'displayName')),
+            sessions=self._copySessionsToForms(sessions).items,
+            featuredSpeaker='%s - %s' % featured if featured else None,
+            announcement=announcement or None)
+        if prof:
+            page.isAttending = wsck in prof.conferenceKeysToAttend
+            page.onWaitlist = entry is not None
+            sessionKeys = set(websafeKey(s) for s in sessions)
+            page.wishlistSessionKeys = [sk for sk in prof.sessionWishlistKeys
+                                        if sk in sessionKeys]
+            if intent:
+                page.registrationStatus = getattr(RegistrationStatus,
+                                                  intent.status)
+        return page
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
@@ -284,14 +524,27 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        # run the organizer query for this user and the profile get together
+        confs, prof = self._getConferencesCreatedAsync(user_id).get_result()
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
             items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
         )
 
+    @ndb.tasklet
+    def _getConferenceAndProfile(self, c_key, p_key):
+        """Get a Conference and a Profile in a single round trip."""
+        conf, prof = yield c_key.get_async(), p_key.get_async()
+        raise ndb.Return((conf, prof))
+
+    @ndb.tasklet
+    def _getConferencesCreatedAsync(self, user_id):
+        """Run the organizer's conference query and profile get together."""
+        confs, prof = yield (Conference.query(
+            Conference.organizerUserId == user_id).fetch_async(),
+            ndb.Key(Profile, user_id).get_async())
+        raise ndb.Return((confs, prof))
+
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
@@ -342,7 +595,7 @@ class ConferenceApi(remote.Service):
         inequality_field = None
 
         for f in filters:
-            filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
+            filtr = formValues(f)
 
             try:
                 filtr["field"] = FIELDS[filtr["field"]]
@@ -369,110 +622,359 @@ class ConferenceApi(remote.Service):
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
     
     @ndb.transactional(xg=True)
-    def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
+    def _conferenceRegistration(self, request, reg=True, waitlisted=False):
+        """Register or unregister user for selected conference; waitlisted
+        tells an unregistration that the conference has a waitlist."""
         retval = None
-        prof = self._getProfileFromUser()  # get user Profile
+        # get user Profile, conference and its attendee stats in parallel
+        wsck = request.websafeConferenceKey
+        c_key = conferenceKey(wsck)
+        stats_future = statsKey(c_key).get_async()
+        prof, conf = self._getProfileAndEntity(c_key).get_result()
+        stats = stats_future.get_result() or ConferenceStats(
+            key=statsKey(c_key))
 
         # check if conf exists given websafeConfKey
-        # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
         # register
         if reg:
+            if conf.asyncRegistration:
+                raise endpoints.BadRequestException(
+                    "This conference registers through requestRegistration.")
+
             # check if user already registered otherwise add
             if wsck in prof.conferenceKeysToAttend:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # check if seats avail; freed seats are held for the waitlist
+            if conf.seatsAvailable <= 0 or conf.seatsReserved > 0:
                 raise ConflictException(
-                    "There are no seats available.")
+                    "There are no seats available, join the waitlist.")
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
             conf.seatsAvailable -= 1
+            countAttendee(stats, prof.teeShirtSize, 1)
             retval = True
 
         # unregister
         else:
+            # an async registration holds its seat before its profile
+            # update is applied
+            seat_key = ndb.Key(ConferenceSeat, prof.key.id(), parent=conf.key)
+            seated = conf.asyncRegistration and seat_key.get() is not None
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
+            if wsck in prof.conferenceKeysToAttend or seated:
+
+                # unregister user; if the conference was sold out or has a
+                # waitlist, hold the seat for it, so registrations retried
+                # meanwhile can't take it from the head of the waitlist;
+                # the promote task releases what the waitlist doesn't take
+                if wsck in prof.conferenceKeysToAttend:
+                    prof.conferenceKeysToAttend.remove(wsck)
+                if (conf.seatsAvailable <= 0 or conf.seatsReserved > 0 or
+                        waitlisted):
+                    conf.seatsReserved += 1
+                    taskqueue.add(url='/tasks/promote_waitlist',
+                                  params={'wsck': wsck}, transactional=True)
+                else:
+                    conf.seatsAvailable += 1
+                countAttendee(stats, prof.teeShirtSize, -1)
+                # free the seat taken by an async registration and cancel
+                # its ticket, so a pending profile update is dropped
+                if conf.asyncRegistration:
+                    seat_key.delete()
+                    intent = intentKey(wsck, prof.key.id()).get()
+                    if intent:
+                        intent.status = 'CANCELLED'
+                        intent.put()
                 retval = True
             else:
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
+        ndb.put_multi([prof, conf, stats])
         return BooleanMessage(data=retval)
 
 
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+    @endpoints.method(REGISTER_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
     def registerForConference(self, request):
-        """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        """Register user for selected conference; a retry with the same
+        requestId returns the first response."""
+        def registered(response):
+            recordActivity(request.websafeConferenceKey, 'registrations')
+            # seats changed, the announcement may be stale
+            markDirty('announcement')
+            markDirty('seats', request.websafeConferenceKey)
+        return runOnce('registerForConference', request.requestId,
+                       BooleanMessage,
+                       lambda: self._conferenceRegistration(request),
+                       registered)
     
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
-    
-    
+        # queries can't run in the registration transaction
+        waitlisted = WaitlistEntry.query(
+            WaitlistEntry.websafeConferenceKey ==
+            request.websafeConferenceKey).get(keys_only=True) is not None
+        retval = self._conferenceRegistration(request, reg=False,
+                                              waitlisted=waitlisted)
+        if retval.data:
+            recordActivity(request.websafeConferenceKey, 'cancellations')
+        markDirty('announcement')
+        markDirty('seats', request.websafeConferenceKey)
+        return retval
+
+    @endpoints.method(CONF_GET_REQUEST, StringMessage,
+            path='conference/{websafeConferenceKey}/seats/subscribe',
+            http_method='POST', name='subscribeSeats')
+    def subscribeSeats(self, request):
+        """Return a channel token pushing the seats available of a
+        conference as they change."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        wsck = request.websafeConferenceKey
+        if not conferenceKey(wsck).get():
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        token = addSeatSubscription(wsck, getUserId(user))
+        if not token:
+            raise ConflictException(
+                'Too many pages follow the seats, try again later')
+        return StringMessage(data=token)
+
+
+    def _copyTicketToForm(self, intent):
+        """Copy a RegistrationIntent to a RegistrationTicketForm."""
+        return RegistrationTicketForm(
+            ticket=intent.key.urlsafe(),
+            websafeConferenceKey=intent.websafeConferenceKey,
+            status=getattr(RegistrationStatus, intent.status))
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationTicketForm,
+            path='conference/{websafeConferenceKey}/registration',
+            http_method='POST', name='requestRegistration')
+    def requestRegistration(self, request):
+        """Request a seat at a conference in async registration mode and
+        return a ticket to poll with getRegistrationStatus."""
+        wsck = request.websafeConferenceKey
+        prof, conf = self._getProfileAndEntity(
+            conferenceKey(wsck)).get_result()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if not conf.asyncRegistration:
+            raise endpoints.BadRequestException(
+                "This conference registers through registerForConference.")
+        if wsck in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        if conf.seatsAvailable <= 0 or conf.seatsReserved > 0:
+            raise ConflictException(
+                "There are no seats available, join the waitlist.")
+
+        intent = recordIntent(wsck, prof.key.id())
+        # too many requests this second, the client retries later
+        if not intent:
+            return RegistrationTicketForm(
+                websafeConferenceKey=wsck,
+                status=RegistrationStatus.THROTTLED, retryAfter=1)
+        return self._copyTicketToForm(intent)
+
+    @endpoints.method(TICKET_GET_REQUEST, RegistrationTicketForm,
+            path='registration/{ticket}',
+            http_method='GET', name='getRegistrationStatus')
+    def getRegistrationStatus(self, request):
+        """Return the status of a registration ticket."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        key = ticketKey(request.ticket)
+        intent = key and key.get()
+        if getattr(intent, 'userId', None) != getUserId(user):
+            raise endpoints.NotFoundException(
+                'No registration found with ticket: %s' % request.ticket)
+        return self._copyTicketToForm(intent)
+
+
+    def _waitlistEntryKey(self, wsck, user_id):
+        """Return the key of a user's entry in a conference waitlist."""
+        return ndb.Key(WaitlistEntry, '%s:%s' % (wsck, user_id))
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='POST', name='joinWaitlist')
+    def joinWaitlist(self, request):
+        """Join the waitlist of a sold out conference."""
+        wsck = request.websafeConferenceKey
+        prof, conf = self._getProfileAndEntity(
+            conferenceKey(wsck)).get_result()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if wsck in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        # seats held for the waitlist go to those joining it too
+        if conf.seatsAvailable > 0 and not conf.seatsReserved:
+            raise ConflictException(
+                "There are seats available, register instead.")
+
+        # keyed by user, so joining again keeps the original place
+        key = self._waitlistEntryKey(wsck, prof.key.id())
+        WaitlistEntry.get_or_insert(key.id(), websafeConferenceKey=wsck,
+                                    userId=prof.key.id())
+        # a promote that ran before the entry showed up in its query may
+        # have left the seats to the registrations
+        if conf.seatsReserved > 0 or conf.seatsAvailable > 0:
+            taskqueue.add(url='/tasks/promote_waitlist',
+                          params={'wsck': wsck})
+        return BooleanMessage(data=True)
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='DELETE', name='leaveWaitlist')
+    def leaveWaitlist(self, request):
+        """Leave the waitlist of a conference."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        key = self._waitlistEntryKey(request.websafeConferenceKey,
+                                     getUserId(user))
+        if not key.get():
+            return BooleanMessage(data=False)
+        key.delete()
+        return BooleanMessage(data=True)
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _promoteWaitlistEntry(entry_key):
+        """Register the user of a waitlist entry if a seat is free. Return
+        True if they were registered, False if the entry was skipped and
+        None once the conference is full again."""
+        entry = entry_key.get()
+        # already promoted or left the waitlist
+        if not entry:
+            return False
+        wsck = entry.websafeConferenceKey
+        c_key = conferenceKey(wsck)
+        conf, prof, stats = ndb.get_multi([c_key,
+                                           ndb.Key(Profile, entry.userId),
+                                           statsKey(c_key)])
+        if not conf or conf.seatsAvailable + conf.seatsReserved <= 0:
+            return None
+
+        entry.key.delete()
+        if not prof or wsck in prof.conferenceKeysToAttend:
+            return False
+        prof.conferenceKeysToAttend.append(wsck)
+        # the seats held for the waitlist first
+        if conf.seatsReserved > 0:
+            conf.seatsReserved -= 1
+        else:
+            conf.seatsAvailable -= 1
+        stats = stats or ConferenceStats(key=statsKey(c_key))
+        countAttendee(stats, prof.teeShirtSize, 1)
+        ndb.put_multi([prof, conf, stats])
+        # notify the user once they are registered
+        taskqueue.add(url='/tasks/notify_waitlist',
+                      params={'email': prof.mainEmail, 'wsck': wsck},
+                      transactional=True)
+        return True
+
+    @staticmethod
+    @ndb.transactional
+    def _releaseReservedSeats(wsck):
+        """Make the seats held for an exhausted waitlist available; return
+        the number released."""
+        conf = conferenceKey(wsck).get()
+        if not conf or conf.seatsReserved <= 0:
+            return 0
+        released, conf.seatsReserved = conf.seatsReserved, 0
+        conf.seatsAvailable += released
+        conf.put()
+        return released
+
+    @staticmethod
+    def _promoteWaitlist(wsck):
+        """Give the free seats of a conference to the head of its waitlist,
+        then release the seats left once it is empty; used by the waitlist
+        promotion task.
+        """
+        entries = WaitlistEntry.query(
+            WaitlistEntry.websafeConferenceKey == wsck).order(
+            WaitlistEntry.joined)
+        changed = False
+        for entry_key in entries.iter(keys_only=True):
+            promoted = ConferenceApi._promoteWaitlistEntry(entry_key)
+            if promoted is None:
+                break
+            if promoted:
+                recordActivity(wsck, 'registrations')
+            changed = True
+        else:
+            if ConferenceApi._releaseReservedSeats(wsck):
+                changed = True
+                markDirty('announcement')
+        if changed:
+            markDirty('seats', wsck)
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser()  # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
+        conf_keys = [conferenceKey(wsck) for wsck in prof.conferenceKeysToAttend]
         conferences = ndb.get_multi(conf_keys)
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
+        # fetch the organizers in a single batch
+        organisers = list(set(ndb.Key(Profile, conf.organizerUserId)
+                              for conf in conferences if conf))
         profiles = ndb.get_multi(organisers)
 
         # put display names in a dict for easier fetching
         names = {}
         for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+            if profile:
+                names[profile.key.id()] = profile.displayName
 
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(items=[self._copyConferenceToForm(conf,
-                                    names[conf.organizerUserId]) for conf in conferences])
+                                    names.get(conf.organizerUserId)) for conf in conferences if conf])
     
     
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        # copy relevant fields from Profile to ProfileForm, converting the
+        # t-shirt string to Enum
+        return copyProfile(prof)
 
     def _getProfileFromUser(self):
         """Return user Profile from datastore, creating new one if non-existent."""
+        return self._getProfileFromUserAsync().get_result()
+
+    @ndb.tasklet
+    def _getProfileAndEntity(self, key):
+        """Get the user Profile and another entity in parallel."""
+        prof, entity = yield self._getProfileFromUserAsync(), key.get_async()
+        raise ndb.Return((prof, entity))
+
+    @ndb.tasklet
+    def _getProfileFromUserAsync(self):
+        """Tasklet version of _getProfileFromUser."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
@@ -480,7 +982,7 @@ class ConferenceApi(remote.Service):
         # create a new key of kind Profile from the id
         p_key = ndb.Key(Profile, user_id)
         # get the entity from datastore by using get() on the key
-        profile = p_key.get()
+        profile = yield p_key.get_async()
         if not profile:
             profile = Profile(
                 key = p_key,
@@ -489,8 +991,8 @@ class ConferenceApi(remote.Service):
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
             # save the profile to datastore
-            profile.put()
-        return profile      # return Profile
+            yield profile.put_async()
+        raise ndb.Return(profile)      # return Profile
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
@@ -502,7 +1004,12 @@ class ConferenceApi(remote.Service):
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
-                    if val:
+                    if field == 'teeShirtSize' and val and \
+                            str(val) != prof.teeShirtSize:
+                        # move the attendee between the size counters of
+                        # the conferences they attend
+                        changeTeeShirtSize(prof, str(val))
+                    elif val:
                         setattr(prof, field, str(val))
         # put the modified profile to the datastore
             prof.put()
@@ -527,10 +1034,8 @@ class ConferenceApi(remote.Service):
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
+    def _computeAnnouncement():
+        """Create Announcement of the nearly sold out conferences."""
         confs = Conference.query(ndb.AND(
             Conference.seatsAvailable <= 5,
             Conference.seatsAvailable > 0)
@@ -538,46 +1043,70 @@ class ConferenceApi(remote.Service):
 
         if confs:
             # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = '%s %s' % (
+            # format announcement
+            return '%s %s' % (
                 'Last chance to attend! The following conferences '
                 'are nearly sold out:',
                 ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        # an empty announcement is cached too, so it isn't recomputed
+        # on every read
+        return ""
 
-        return announcement
+    @staticmethod
+    def _cacheAnnouncement():
+        """Recompute Announcement & push it to the cache; used by the
+        announcement cron job & recompute task.
+        """
+        return refreshCached(MEMCACHE_ANNOUNCEMENTS_KEY,
+                             ConferenceApi._computeAnnouncement,
+                             ANNOUNCEMENT_CACHE_SECONDS)
+
+    @staticmethod
+    def _getAnnouncementAsync():
+        """Get Announcement from the cache, recomputing it on a miss."""
+        return getCachedAsync(MEMCACHE_ANNOUNCEMENTS_KEY,
+                              ConferenceApi._computeAnnouncement,
+                              ANNOUNCEMENT_CACHE_SECONDS)
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
+        """Return Announcement from the cache."""
         # TODO 1
-        # return an existing announcement from Memcache or an empty string.
-        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or ""
+        # return an existing announcement from the cache or an empty string.
+        announcement = self._getAnnouncementAsync().get_result() or ""
         return StringMessage(data=announcement)
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - -
 
-    def _copySessionToForm(self, session):
+    def _copySessionToForm(self, session, names=None):
         """Copy relevant fields from Session to SessionFormOut."""
-        sf = SessionFormOut()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                # convert Date to date string; just copy others
-                if field.name in ['start_time', 'date']:
-                    setattr(sf, field.name, str(getattr(session, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-        setattr(sf, 'sessionKey', session.key.urlsafe())
-        setattr(sf, 'speaker', self._getSpeakerNames(session.key.urlsafe()))
-        sf.check_initialized()
-        return sf
+        if names is None:
+            names = self._getSpeakerNames(session)
+        # a moved session is published under its legacy key, whose parent
+        # is the conference's legacy key
+        if session.legacyKey:
+            wsck = ndb.Key(urlsafe=session.legacyKey).parent().urlsafe()
+        else:
+            wsck = session.key.parent().urlsafe()
+        return copySession(session, sessionKey=websafeKey(session),
+                           speaker=names, websafeConferenceKey=wsck)
+
+    def _copySessionsToForms(self, sessions):
+        """Copy a list of Sessions to SessionForms, fetching the speakers of
+        all the sessions in a single batch."""
+        sessions = list(sessions)
+        speakerKeys = list(set(sk for session in sessions
+                               for sk in session.speakerKeys))
+        speakers = ndb.get_multi([ndb.Key(urlsafe=sk) for sk in speakerKeys])
+        names = dict((sk, speaker.name)
+                     for sk, speaker in zip(speakerKeys, speakers) if speaker)
+        return SessionForms(items=[
+            self._copySessionToForm(session, [names[sk]
+                                              for sk in session.speakerKeys
+                                              if sk in names])
+            for session in sessions])
 
     def _createSessionObject(self, request):
         """Create or update Session object, returning SessionForm/request."""
@@ -588,9 +1117,14 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
         
-        # get conference object
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        
+        # get conference object and allocate the session ID in parallel,
+        # the ID only depends on the conference key
+        c_key = conferenceKey(request.websafeConferenceKey)
+        conf, s_id = self._getConferenceAndSessionId(c_key).get_result()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+
         # check user is conference creator
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
@@ -603,8 +1137,9 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 "Session 'date' and 'start_time' fields required")
         # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        data = formValues(request)
         del data['websafeConferenceKey']
+        del data['requestId']
 
         # add default values for those missing (both data model & outbound Message)
         for df in SESSION_DEFAULTS:
@@ -629,48 +1164,105 @@ class ConferenceApi(remote.Service):
                     'The session time is outside the dates of the conference.'
                 )
         
-        # generate Session Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
-        c_key = conf.key
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
+        # generate Session Key from the allocated ID and Conference key
         s_key = ndb.Key(Session, s_id, parent=c_key)
         data['key'] = s_key
+        data['legacyKey'] = legacySessionKey(conf, s_key)
 
-        # create Conference & return (modified) ConferenceForm
+        # create Session, the follow-up steps run in _sessionCreated
         session = Session(**data)
         session.put()
-        # check if speaker is featured speaker to queue
-        taskqueue.add(params={'sk': request.speakerKeys, 'name': request.name,
-                              'wsck': request.websafeConferenceKey},
-                      url='/tasks/is_speaker_featured')
-        return self._copySessionToForm(session)
+        return session, conf
+
+    def _sessionCreated(self, request, session, conf):
+        """Update the data derived from the sessions of a conference after
+        a session was created."""
+        markDirty('featured_speaker', request.websafeConferenceKey)
+        # add the session to the profiles of its speakers
+        entry = self._speakerSession(session, conf)
+        for future in [self._updateSpeakerSessionsAsync(
+                ndb.Key(urlsafe=sk), [entry]) for sk in session.speakerKeys]:
+            future.get_result()
+        invalidateConferenceFeed(request.websafeConferenceKey)
+        recordActivity(request.websafeConferenceKey, 'sessions')
+
+    @ndb.tasklet
+    def _getConferenceAndSessionId(self, c_key):
+        """Get a Conference and allocate a child Session ID together."""
+        conf, ids = yield (c_key.get_async(),
+                           Session.allocate_ids_async(size=1, parent=c_key))
+        raise ndb.Return((conf, ids[0]))
 
     
     @endpoints.method(SESS_POST_REQUEST, SessionFormOut, path='session/add',
             http_method='POST', name='createSession')
     def createSession(self, request):
-        """Create new session in conference."""
-        
-        return self._createSessionObject(request)
+        """Create new session in conference; a retry with the same requestId
+        returns the session created by the first request."""
+        created = []
+
+        def create():
+            created.extend(self._createSessionObject(request))
+            return self._copySessionToForm(created[0])
+        return runOnce('createSession', request.requestId, SessionFormOut,
+                       create, lambda response: self._sessionCreated(
+                           request, *created))
     
+    @ndb.transactional(xg=True)
+    def _deleteSessionObject(self, request):
+        """Delete a session and queue the cleanup of the references to it."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        s_key = sessionKey(request.sessionKey)
+        # the conference is the parent, both are in the same entity group
+        session, conf = ndb.get_multi([s_key, s_key.parent()])
+        if not session:
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.sessionKey)
+        if not conf or getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can delete a session of this conference.')
+        s_key.delete()
+        tombstone(session).put()
+        taskqueue.add(url='/tasks/delete', transactional=True,
+                      params={'kind': 'session', 'key': request.sessionKey,
+                              'stage': 'wishlists',
+                              'speaker': session.speakerKeys})
+
+    @endpoints.method(WISHLIST_GET_REQUEST, BooleanMessage,
+            path='session/delete/{sessionKey}',
+            http_method='DELETE', name='deleteSession')
+    def deleteSession(self, request):
+        """Delete a session (by websafe session key)."""
+        self._deleteSessionObject(request)
+        markDirty('featured_speaker', ndb.Key(
+            urlsafe=request.sessionKey).parent().urlsafe())
+        return BooleanMessage(data=True)
+
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
             path='conference/{websafeConferenceKey}/sessions',
             http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Return requested conference (by websafeConferenceKey)."""
         
-        # get Conference object from request
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # get Conference object and its sessions in parallel
+        c_key = conferenceKey(request.websafeConferenceKey)
+        q = Session.query(ancestor=c_key).order(Session.date,
+                                                Session.start_time)
+        conf, sessions = self._getEntityAndQuery(c_key, q).get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        
-        # get the sessions for this conference
-        sessions = Session.query(ancestor=conf.key).order(Session.date,
-                                                          Session.start_time)
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions])
+
+        return self._copySessionsToForms(sessions)
     
+    @ndb.tasklet
+    def _getEntityAndQuery(self, key, q, **kwargs):
+        """Get an entity and fetch a query in a single round trip."""
+        entity, results = yield key.get_async(), q.fetch_async(**kwargs)
+        raise ndb.Return((entity, results))
+
     @endpoints.method(SESSION_TYPE_QUERY, SessionForms,
             path='conference/{websafeKey}/sessionstype',
             http_method='POST',
@@ -680,13 +1272,11 @@ class ConferenceApi(remote.Service):
         
         # all session for the conference filtered by sessionType
         all_sessions = Session.query(
-            ancestor=ndb.Key(urlsafe=request.websafeKey))
+            ancestor=conferenceKey(request.websafeKey))
         sessions = all_sessions.filter(
             Session.session_type == request.session_type)
 
-        return SessionForms(
-                items=[self._copySessionToForm(session) for session in
-                       sessions])
+        return self._copySessionsToForms(sessions)
     
     @endpoints.method(SessionSpeakerForm, SessionForms,
             path='sessionsspeaker',
@@ -698,10 +1288,7 @@ class ConferenceApi(remote.Service):
         sessions = all_sessions.filter(
             Session.speakerKeys == request.speakerKey)
 
-        return SessionForms(
-                items=[self._copySessionToForm(session) for session in
-                       sessions]
-                )
+        return self._copySessionsToForms(sessions)
 
 # - - - Wishlists - - - - - - - - - - - - - - - - - - - -
 
@@ -709,11 +1296,10 @@ class ConferenceApi(remote.Service):
         """Add or remove session from user wishlist"""
         
         retval = None  # return value
-        prof = self._getProfileFromUser()  # get user Profile
-
-        # get session; check that it exists
+        # get user Profile and session in parallel; check that it exists
         sk = request.sessionKey
-        session = ndb.Key(urlsafe=request.sessionKey).get()
+        prof, session = self._getProfileAndEntity(
+            sessionKey(sk)).get_result()
         if not session:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % sk)
@@ -742,8 +1328,19 @@ class ConferenceApi(remote.Service):
                 # retval is false if session wasn't in wishlist
                 retval = False
 
-        # write things back to the datastore & return
-        prof.put()
+        # write things back to the datastore & return; the related sessions
+        # update is queued while the put is in flight
+        future = prof.put_async()
+        if retval:
+            c_key = ndb.Key(urlsafe=sk).parent()
+            others = [k for k in prof.sessionWishlistKeys
+                      if k != sk and ndb.Key(urlsafe=k).parent() == c_key]
+            queueRelatedUpdate(sk, others, 1 if addition else -1)
+        future.get_result()
+        if retval:
+            recordActivity(c_key.urlsafe(),
+                           'wishlistAdds' if addition else 'wishlistRemovals')
+            invalidateUserFeed(prof)
         return BooleanMessage(data=retval)
 
     @endpoints.method(WISHLIST_GET_REQUEST, BooleanMessage,
@@ -769,17 +1366,49 @@ class ConferenceApi(remote.Service):
         prof = self._getProfileFromUser()  # get user Profile
         # test if session wishlist exists
         if hasattr(prof, 'sessionWishlistKeys'):
-            session_keys = [ndb.Key(urlsafe=sk) for sk in prof.sessionWishlistKeys]
-            sessions = ndb.get_multi(session_keys)
+            session_keys = [sessionKey(sk) for sk in prof.sessionWishlistKeys]
+            # skip the sessions deleted since they were wishlisted
+            sessions = [s for s in ndb.get_multi(session_keys) if s]
         else:
             sessions = []
         # return set of SessionForm objects per session
-        return SessionForms(items=[self._copySessionToForm(session)
-                                   for session in sessions]
-                            )
+        return self._copySessionsToForms(sessions)
+
+    @endpoints.method(message_types.VoidMessage, StringMessage,
+            path='sessions/wishlist/calendar',
+            http_method='GET', name='getWishlistCalendar')
+    def getWishlistCalendar(self, request):
+        """Return the URL of the user's wishlist iCalendar feed."""
+        prof = self._getProfileFromUser()  # get user Profile
+        return StringMessage(data='https://%s/calendar/user/%s.ics' % (
+            app_identity.get_default_version_hostname(), userFeedToken(prof)))
+
+    @endpoints.method(WISHLIST_GET_REQUEST, RelatedSessionsForm,
+            path='session/{sessionKey}/related',
+            http_method='GET', name='getRelatedSessions')
+    def getRelatedSessions(self, request):
+        """Return the sessions most often wishlisted with a session."""
+        related = ndb.Key(RelatedSessions, request.sessionKey).get()
+        if not related:
+            return RelatedSessionsForm(items=[])
+        return RelatedSessionsForm(items=[
+            RelatedSessionForm(sessionKey=sk, name=name, count=count)
+            for sk, name, count in zip(related.sessionKeys, related.names,
+                                       related.counts)])
 
 # - - - Additional Queries - - - - - - - - - - - - - - - - - - - -
 
+    def _checkSessionFilter(self, field, operator):
+        """Check a session filter is on a queryable field, with inequalities
+        only on the fields index.yaml has indexes for."""
+        if field not in SESSION_FIELDS or operator not in OPERATORS.values():
+            raise endpoints.BadRequestException(
+                "Filter contains invalid field or operator.")
+        if operator != '=' and field not in SESSION_INEQUALITY_FIELDS:
+            raise endpoints.BadRequestException(
+                "Inequality filter is allowed only on %s." %
+                ', '.join(SESSION_INEQUALITY_FIELDS))
+
     @endpoints.method(SessionQueryForm, SessionForms,
                       path='querySessions',
                       http_method='POST',
@@ -791,7 +1420,8 @@ class ConferenceApi(remote.Service):
         if not(request.field or request.operator or request.value):
             raise endpoints.BadRequestException(
                 "field, operator and value fields required")
-        
+        self._checkSessionFilter(request.field, request.operator)
+
         # convert date to a datetime object, duration and start_time to int
         if request.field == 'date':
             value = datetime.strptime(request.value, "%Y-%m-%d")
@@ -803,7 +1433,7 @@ class ConferenceApi(remote.Service):
         # if the request contains a websafeConferenceKey we query the sessions
         # for this conference
         if request.websafeConferenceKey:
-            ck = ndb.Key(urlsafe=request.websafeConferenceKey)
+            ck = conferenceKey(request.websafeConferenceKey)
             q = Session.query(ancestor=ck)
             sessions = q.filter(ndb.query.FilterNode(request.field,
                                                      request.operator,
@@ -814,17 +1444,16 @@ class ConferenceApi(remote.Service):
         else:
             prof = self._getProfileFromUser()
             conferenceKeys = prof.conferenceKeysToAttend
-            sessions = []
-            # query for each of the conferences to attend
-            for k in conferenceKeys:
-                q = Session.query(ancestor=ndb.Key(urlsafe=k))
-                sessions += q.filter(ndb.query.FilterNode(request.field,
-                                                          request.operator,
-                                                          value))
+            # query each of the conferences to attend, all queries in flight
+            # at the same time
+            futures = [Session.query(ancestor=conferenceKey(k)).filter(
+                           ndb.query.FilterNode(request.field,
+                                                request.operator,
+                                                value)).fetch_async()
+                       for k in conferenceKeys]
+            sessions = [session for f in futures for session in f.get_result()]
         # return individual SessionForm object per Conference
-        return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessions]
-                )
+        return self._copySessionsToForms(sessions)
 
     @endpoints.method(DoubleSessionQueryForm, SessionForms,
                       path='doubleQuerySessions',
@@ -839,7 +1468,9 @@ class ConferenceApi(remote.Service):
                request.field2 or request.operator2 or request.value2):
             raise endpoints.BadRequestException(
                 "field, operator and value fields required")
-        
+        self._checkSessionFilter(request.field1, request.operator1)
+        self._checkSessionFilter(request.field2, request.operator2)
+
         # convert date and start_time to datetime objects
         if request.field1 == 'date':
             value1 = datetime.strptime(request.value1, "%Y-%m-%d")
@@ -861,7 +1492,7 @@ class ConferenceApi(remote.Service):
             value2d = value2
             
         # get conference key, and the sessions for that conference
-        ck = ndb.Key(urlsafe=request.websafeConferenceKey)
+        ck = conferenceKey(request.websafeConferenceKey)
         q = Session.query(ancestor=ck)
         # apply the first query
         q1 = q.filter(ndb.query.FilterNode(request.field1,
@@ -887,21 +1518,20 @@ class ConferenceApi(remote.Service):
                                                       request.operator2,
                                                       value2))
         # return individual SessionForm object per Conference
-        return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessions]
-                )
+        return self._copySessionsToForms(sessions)
 
     @staticmethod
     def _getSpeakerKeys(wsck):
         """get speaker keys for all sessions of a conference"""
-        # get Conference object from request
-        conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
+        # get Conference object and the speakers of its sessions in parallel
+        c_key = conferenceKey(wsck)
+        conf_future = c_key.get_async()
+        sessions_future = Session.query(ancestor=c_key).fetch_async(
+            projection=[Session.speakerKeys])
+        if not conf_future.get_result():
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
-        
-        # get the speakers for this conference
-        sessions = Session.query(ancestor=conf.key).fetch(projection=[Session.speakerKeys])
+        sessions = sessions_future.get_result()
         # flattening the list of list of speakers
         speakers = [speaker for session in sessions for speaker in session.speakerKeys]
         return speakers
@@ -914,18 +1544,61 @@ class ConferenceApi(remote.Service):
         (by websafeConferenceKey)."""
         
         speakerKeys = self._getSpeakerKeys(request.websafeConferenceKey)
-        speakers = [self._getSpeakerName(sk) for sk in speakerKeys]
+        speakers = [speaker.name for speaker in
+                    ndb.get_multi([ndb.Key(urlsafe=sk) for sk in speakerKeys])]
         # copy the list to a form
         form = SpeakersForm(speaker=speakers)
         form.check_initialized()
         return form
 
+    @staticmethod
+    def _computeFeaturedSpeaker(wsck):
+        """Find the speaker with the most sessions in a conference; return
+        their name and session names, or None.
+        """
+        sessions = Session.query(ancestor=conferenceKey(wsck)).order(
+            Session.date, Session.start_time).fetch()
+
+        # group the session names by speaker
+        speakerSessions = {}
+        for session in sessions:
+            for sk in session.speakerKeys:
+                speakerSessions.setdefault(sk, []).append(session.name)
+
+        featured = max(speakerSessions.items(), key=lambda s: len(s[1])) \
+            if speakerSessions else None
+        if featured and len(featured[1]) > 1:
+            # a speaker in more than one session is featured
+            speaker = ndb.Key(urlsafe=featured[0]).get()
+            return (speaker.name, ', '.join(featured[1]))
+        return None
+
+    @staticmethod
+    def _cacheFeaturedSpeaker(wsck):
+        """Recompute the featured speaker of a conference & push it to the
+        cache; used by the featured speaker recompute task.
+        """
+        return refreshCached(
+            MEMCACHE_FEATURED_SPEAKER_KEY % wsck,
+            lambda: ConferenceApi._computeFeaturedSpeaker(wsck),
+            FEATURED_SPEAKER_CACHE_SECONDS)
+
+    @staticmethod
+    def _getFeaturedSpeakerAsync(wsck):
+        """Get the featured speaker of a conference from the cache,
+        recomputing it on a miss."""
+        return getCachedAsync(
+            MEMCACHE_FEATURED_SPEAKER_KEY % wsck,
+            lambda: ConferenceApi._computeFeaturedSpeaker(wsck),
+            FEATURED_SPEAKER_CACHE_SECONDS)
+
     @endpoints.method(CONF_GET_REQUEST, StringMessage,
             path='conference/{websafeConferenceKey}/featuredSpeaker',
             http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Returns the featured speaker stored in memcache"""
-        speaker, sessionName = memcache.get('featuredSpeaker') or ('','')
+        """Returns the featured speaker stored in the cache"""
+        speaker, sessionName = self._getFeaturedSpeakerAsync(
+            request.websafeConferenceKey).get_result() or ('','')
         # copy the list to a form
         form = StringMessage(data=speaker+' - '+sessionName)
         form.check_initialized()
@@ -933,29 +1606,16 @@ class ConferenceApi(remote.Service):
 
 # - - - Speaker Objects - - - - - - - - - - - - - - - - - - - -
 
-    def _getSpeakerNames(self, sessionKey):
+    def _getSpeakerNames(self, session):
         """Returns a list of names of the speakers for a session"""
-        session = ndb.Key(urlsafe=sessionKey).get()
-        speakerKeys = session.speakerKeys
-        names = [self._getSpeakerName(sk) for sk in speakerKeys]
+        speakers = ndb.get_multi([ndb.Key(urlsafe=sk)
+                                  for sk in session.speakerKeys])
+        names = [speaker.name for speaker in speakers]
         return names
 
-    @staticmethod
-    def _getSpeakerName(speakerKey):
-        """Returns the name of a speaker from the websafe speaker key"""
-        speaker = ndb.Key(urlsafe=speakerKey).get()
-        return speaker.name
-
     def _copySpeakerToForm(self, speaker):
         """Copy fields from Speaker to SpeakerForm."""
-        sf = SpeakerForm()
-        for field in sf.all_fields():
-            if hasattr(speaker, field.name):
-                setattr(sf, field.name, getattr(speaker, field.name))
-            elif field.name == "speakerKey":
-                setattr(sf, field.name, speaker.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return copySpeaker(speaker, speakerKey=speaker.key.urlsafe())
 
     def _createSpeakerObject(self, request):
         """Create or update a Speaker object, returning SpeakerForm/request.
@@ -969,6 +1629,7 @@ class ConferenceApi(remote.Service):
         # create Speaker & return SpeakerForm
         speaker = Speaker(name=request.name, organisation=request.organisation)
         speaker.put()
+        queueSuggestionUpdate('speaker', speaker.key.urlsafe(), speaker.name)
         return self._copySpeakerToForm(speaker)
 
     @endpoints.method(SpeakerForm, SpeakerForm, path='speaker',
@@ -977,6 +1638,84 @@ class ConferenceApi(remote.Service):
         """Create new speaker"""
         return self._createSpeakerObject(request)
 
+    @staticmethod
+    def _speakerSession(session, conf):
+        """Return the SpeakerSession entry of a session of conf."""
+        return SpeakerSession(
+            sessionKey=websafeKey(session), name=session.name,
+            date=session.date, start_time=session.start_time,
+            duration=session.duration,
+            websafeConferenceKey=websafeKey(conf),
+            conferenceName=conf.name)
+
+    @staticmethod
+    @ndb.transactional_tasklet
+    def _updateSpeakerSessionsAsync(speaker_key, entries=(), removed=()):
+        """Add or replace entries in the sessions of a speaker, and drop
+        the sessions whose websafe keys are in removed."""
+        speaker = yield speaker_key.get_async()
+        if not speaker:
+            return
+        dropped = set(removed) | set(e.sessionKey for e in entries)
+        sessions = [e for e in speaker.sessions
+                    if e.sessionKey not in dropped] + list(entries)
+        speaker.sessions = sorted(sessions, key=lambda e: (e.date,
+                                                           e.start_time))
+        yield speaker.put_async()
+
+    @staticmethod
+    def _refreshSpeakerSessions(wsck):
+        """Rewrite the speaker profile entries of the sessions of a
+        conference; used by the refresh task after the conference changed.
+        """
+        c_key = conferenceKey(wsck)
+        conf = c_key.get()
+        if not conf:
+            return
+        bySpeaker = {}
+        for session in Session.query(ancestor=c_key):
+            entry = ConferenceApi._speakerSession(session, conf)
+            for sk in session.speakerKeys:
+                bySpeaker.setdefault(sk, []).append(entry)
+        futures = [ConferenceApi._updateSpeakerSessionsAsync(
+            ndb.Key(urlsafe=sk), entries) for sk, entries in bySpeaker.items()]
+        for future in futures:
+            future.get_result()
+
+    @staticmethod
+    def _rebuildSpeakerSessions(speaker):
+        """Add the sessions of a speaker missing from their profile entries,
+        e.g. the ones created before Speaker.sessions was kept; a map
+        function."""
+        sessions = Session.query(
+            Session.speakerKeys == speaker.key.urlsafe()).fetch()
+        known = set(e.sessionKey for e in speaker.sessions)
+        sessions = [s for s in sessions if websafeKey(s) not in known]
+        if not sessions:
+            return False
+        confs = ndb.get_multi(list(set(s.key.parent() for s in sessions)))
+        confs = dict((conf.key, conf) for conf in confs if conf)
+        entries = [ConferenceApi._speakerSession(s, confs[s.key.parent()])
+                   for s in sessions if s.key.parent() in confs]
+        ConferenceApi._updateSpeakerSessionsAsync(
+            speaker.key, entries).get_result()
+        return False
+
+    @endpoints.method(SPEAKER_GET_REQUEST, SpeakerProfileForm,
+            path='speaker/{speakerKey}/profile',
+            http_method='GET', name='getSpeakerProfile')
+    def getSpeakerProfile(self, request):
+        """Return a speaker with their sessions and conferences."""
+        speaker = ndb.Key(urlsafe=request.speakerKey).get()
+        if not speaker:
+            raise endpoints.NotFoundException(
+                'No speaker found with key: %s' % request.speakerKey)
+        return SpeakerProfileForm(name=speaker.name,
+                                  organisation=speaker.organisation,
+                                  speakerKey=request.speakerKey,
+                                  sessions=[copySpeakerSession(entry)
+                                            for entry in speaker.sessions])
+
     @endpoints.method(SPEAKER_GET_REQUEST, SpeakerForm,
             path='speaker/{speakerKey}',
             http_method='GET', name='getSpeaker')
@@ -989,6 +1728,60 @@ class ConferenceApi(remote.Service):
                 'No speaker found with key: %s' % request.speakerKey)
         # return SpeakerForm
         return self._copySpeakerToForm(speaker)
-    
-# registers API
-api = endpoints.api_server([ConferenceApi]) 
+
+# - - - Suggestions - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(SUGGEST_GET_REQUEST, SuggestionsForm,
+            path='suggest', http_method='GET', name='suggest')
+    def suggest(self, request):
+        """Return the speakers and conferences, or those of one kind,
+        with a word of their name starting with a prefix."""
+        if request.kind and request.kind not in KINDS:
+            raise endpoints.BadRequestException(
+                "'kind' must be one of: %s" % ', '.join(KINDS))
+        limit = max(1, min(request.limit or 10, SUGGEST_ENTRIES))
+        found = suggest(request.prefix or '',
+                        [request.kind] if request.kind else KINDS, limit)
+        return SuggestionsForm(items=[
+            SuggestionForm(kind=kind, name=name, websafeKey=key)
+            for kind, name, key in found])
+
+# - - - Delta Sync - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(CHANGES_GET_REQUEST, ChangesForm,
+            path='changes', http_method='GET', name='getChanges')
+    def getChanges(self, request):
+        """Return the conferences, sessions and speakers changed and the
+        keys deleted since a sync timestamp, a page at a time."""
+        try:
+            since = parseTimestamp(request.since) if request.since else None
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'since' must be a timestamp returned by getChanges.")
+        try:
+            entities, cursor, timestamp, reset = fetchChanges(
+                since, request.cursor)
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'cursor' must be a cursor returned by getChanges.")
+
+        byKind = {}
+        for entity in entities:
+            byKind.setdefault(entity.key.kind(), []).append(entity)
+        # need to fetch organiser displayName from profiles
+        confs = byKind.get('Conference', [])
+        profiles = ndb.get_multi([ndb.Key(Profile, conf.organizerUserId)
+                                  for conf in confs])
+        return ChangesForm(
+            conferences=[self._copyConferenceToForm(
+                conf, getattr(prof, 'displayName', None))
+                for conf, prof in zip(confs, profiles)],
+            sessions=self._copySessionsToForms(
+                byKind.get('Session', [])).items,
+            speakers=[self._copySpeakerToForm(speaker)
+                      for speaker in byKind.get('Speaker', [])],
+            deletedKeys=[t.key.id() for t in byKind.get('Tombstone', [])],
+            cursor=cursor, timestamp=timestamp, reset=reset)
+
+# registers API; requests are recorded in the metrics per method
+api = timedApp(endpoints.api_server([ConferenceApi]))
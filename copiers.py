@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""copiers.py
+
+Model to form copiers. compileCopier works out once, at import time,
+which fields of a form are copied from a model and how each value is
+converted, and generates a function that builds the form with a single
+constructor call. Copying an entity then costs no all_fields() loop, no
+hasattr, getattr or setattr per field and no field name checks; see
+bench_forms.py for the per-item gain.
+
+"""
+
+from protorpc import messages
+
+
+_FIELD_NAMES = {}
+
+
+def fieldNames(form):
+    """Return the field names of a form class, in field number order."""
+    if form not in _FIELD_NAMES:
+        _FIELD_NAMES[form] = tuple(field.name for field in sorted(
+            form.all_fields(), key=lambda field: field.number))
+    return _FIELD_NAMES[form]
+
+
+def formValues(message):
+    """Return the fields of a form as a dict."""
+    return dict((name, getattr(message, name))
+                for name in fieldNames(type(message)))
+
+
+def compileCopier(model, form, convert=None):
+    """Return a function copying an entity of model to a new form.
+
+    The fields of the form that the model also has are copied, converted
+    by convert, a dict of field name -> function of the value. The other
+    fields are set from the keyword arguments of the copier, e.g.
+    copy(entity, websafeKey=...). The form is checked for missing required
+    fields if it has any.
+    """
+    convert = convert or {}
+    namespace = {'Form': form}
+    values = []
+    for name in fieldNames(form):
+        if not hasattr(model, name):
+            continue
+        if name in convert:
+            namespace['convert_' + name] = convert[name]
+            values.append('%s=convert_%s(entity.%s)' % (name, name, name))
+        else:
+            values.append('%s=entity.%s' % (name, name))
+    source = ('def copy(entity, **other):\n'
+              '    form = Form(%s)\n' % ', '.join(values + ['**other']))
+    # check_initialized is only needed for forms with required fields
+    if any(field.required or isinstance(field, messages.MessageField)
+           for field in form.all_fields()):
+        source += '    form.check_initialized()\n'
+    source += '    return form\n'
+    exec source in namespace
+    copy = namespace['copy']
+    copy.__name__ = 'copy%sTo%s' % (model.__name__, form.__name__)
+    return copy
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""deletion.py
+
+Cascading deletes of conferences and sessions. The endpoints delete the
+entity itself in a transaction, so it is gone at once for every get, and
+add the first task of a chained pipeline. Each task runs one bounded batch
+of a stage and queues the next one, carrying the query cursor.
+
+A conference deletion fans out a session deletion per session, strips the
+conference from its attendees' profiles, deletes the remaining children
+(sessions, seats) with keys-only queries and finally the waitlist entries
+and registration tickets. A session deletion strips it from the wishlists
+and removes it from its speakers and related sessions.
+
+"""
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from cache import invalidateCached
+from coalescer import markDirty
+from conference import ConferenceApi
+from conference import MEMCACHE_FEATURED_SPEAKER_KEY
+from ical import invalidateConferenceFeed, invalidateUserFeed
+from models import Profile
+from models import RegistrationIntent
+from models import RelatedSessions
+from models import Session
+from models import WaitlistEntry
+from rehome import conferenceKey, websafeKey
+from settings import DELETE_BATCH_SIZE
+
+
+DELETE_URL = '/tasks/delete'
+
+
+def queueStage(kind, key, stage, cursor=None, speakers=()):
+    """Add the task running the next batch of a deletion stage; the
+    deleting endpoints add the first one in their transaction."""
+    taskqueue.add(url=DELETE_URL,
+                  params={'kind': kind, 'key': key, 'stage': stage,
+                          'cursor': cursor.urlsafe() if cursor else '',
+                          'speaker': list(speakers)})
+
+
+@ndb.transactional_tasklet
+def _stripProfileAsync(p_key, wsck=None, sessionKeys=()):
+    """Remove a conference and sessions from a profile; return the profile
+    if it changed."""
+    prof = yield p_key.get_async()
+    if not prof:
+        raise ndb.Return(None)
+    attending = [k for k in prof.conferenceKeysToAttend if k != wsck]
+    wishlist = [k for k in prof.sessionWishlistKeys if k not in sessionKeys]
+    if (len(attending), len(wishlist)) == (len(prof.conferenceKeysToAttend),
+                                           len(prof.sessionWishlistKeys)):
+        raise ndb.Return(None)
+    prof.conferenceKeysToAttend = attending
+    prof.sessionWishlistKeys = wishlist
+    yield prof.put_async()
+    raise ndb.Return(prof)
+
+
+def _stripProfiles(query, cursor, **kwargs):
+    """Strip references from a batch of profiles matching a keys-only
+    query; return (more, cursor of the next batch)."""
+    p_keys, cursor, more = query.fetch_page(
+        DELETE_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    futures = [_stripProfileAsync(p_key, **kwargs) for p_key in p_keys]
+    for future in futures:
+        prof = future.get_result()
+        if prof and kwargs.get('sessionKeys'):
+            invalidateUserFeed(prof)
+    return more and cursor is not None, cursor
+
+
+# - - - conference stages - - - - - - - - - - - - - - - - - - -
+
+def _fanOutSessions(wsck, cursor, params):
+    """Start a session deletion for a batch of sessions."""
+    sessions, cursor, more = Session.query(
+        ancestor=conferenceKey(wsck)).fetch_page(
+        DELETE_BATCH_SIZE, start_cursor=cursor)
+    for session in sessions:
+        queueStage('session', websafeKey(session), 'wishlists',
+                   speakers=session.speakerKeys)
+    return more and cursor is not None, cursor
+
+
+def _stripAttendees(wsck, cursor, params):
+    """Remove the conference from a batch of attendees' profiles."""
+    return _stripProfiles(
+        Profile.query(Profile.conferenceKeysToAttend == wsck), cursor,
+        wsck=wsck)
+
+
+def _deleteChildren(wsck, cursor, params):
+    """Delete a batch of entities in the conference entity group."""
+    keys = ndb.Query(ancestor=conferenceKey(wsck)).fetch(
+        DELETE_BATCH_SIZE, keys_only=True)
+    ndb.delete_multi(keys)
+    # deleted keys don't come back, the same query gets the next batch
+    return len(keys) == DELETE_BATCH_SIZE, None
+
+
+def _deleteTickets(wsck, cursor, params):
+    """Delete a batch of the waitlist entries and registration tickets,
+    both keyed by conference and user."""
+    keys = []
+    for model in (WaitlistEntry, RegistrationIntent):
+        keys.extend(model.query(
+            model.key >= ndb.Key(model, wsck + ':'),
+            model.key < ndb.Key(model, wsck + ';')).fetch(
+            DELETE_BATCH_SIZE - len(keys), keys_only=True))
+        if len(keys) == DELETE_BATCH_SIZE:
+            ndb.delete_multi(keys)
+            return True, None
+    ndb.delete_multi(keys)
+    invalidateConferenceFeed(wsck)
+    invalidateCached(MEMCACHE_FEATURED_SPEAKER_KEY % wsck)
+    markDirty('announcement')
+    return False, None
+
+
+# - - - session stages - - - - - - - - - - - - - - - - - - - -
+
+def _stripWishlists(sk, cursor, params):
+    """Remove the session from a batch of wishlists."""
+    return _stripProfiles(
+        Profile.query(Profile.sessionWishlistKeys == sk), cursor,
+        sessionKeys=[sk])
+
+
+def _deleteSessionReferences(sk, cursor, params):
+    """Remove the session from its speakers and related sessions."""
+    futures = [ConferenceApi._updateSpeakerSessionsAsync(
+        ndb.Key(urlsafe=speaker), removed=[sk])
+        for speaker in params.get('speaker', [])]
+    ndb.Key(RelatedSessions, sk).delete()
+    for future in futures:
+        future.get_result()
+    invalidateConferenceFeed(ndb.Key(urlsafe=sk).parent().urlsafe())
+    return False, None
+
+
+STAGES = {
+    'conference': [('sessions', _fanOutSessions),
+                   ('attendees', _stripAttendees),
+                   ('children', _deleteChildren),
+                   ('tickets', _deleteTickets)],
+    'session': [('wishlists', _stripWishlists),
+                ('references', _deleteSessionReferences)],
+}
+
+
+def runStage(kind, key, stage, cursor, params):
+    """Run one batch of a deletion stage and queue the next task."""
+    stages = [name for name, run in STAGES[kind]]
+    run = dict(STAGES[kind])[stage]
+    more, cursor = run(key, Cursor(urlsafe=cursor) if cursor else None,
+                       params)
+    if more:
+        queueStage(kind, key, stage, cursor, params.get('speaker', []))
+    elif stage != stages[-1]:
+        queueStage(kind, key, stages[stages.index(stage) + 1],
+                   speakers=params.get('speaker', []))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""export.py
+
+Streaming JSONL export of conferences, sessions and speakers to Cloud
+Storage. Each task writes one chunk of EXPORT_BATCH_SIZE entities, read with
+a query cursor, then checkpoints the cursor on the ExportJob and chains the
+next task, so a retried task rewrites the same chunk and resumes where the
+last one stopped.
+
+"""
+
+import json
+import urllib
+from datetime import date
+
+from google.appengine.api import app_identity
+from google.appengine.api import taskqueue
+from google.appengine.api import urlfetch
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from models import Conference
+from models import ExportJob
+from models import Session
+from models import Speaker
+from settings import EXPORT_BUCKET
+from settings import EXPORT_BATCH_SIZE
+
+
+EXPORT_KINDS = [Conference, Session, Speaker]
+EXPORT_QUEUE = 'export'
+EXPORT_URL = '/tasks/export'
+GCS_SCOPE = 'https://www.googleapis.com/auth/devstorage.read_write'
+GCS_UPLOAD_URL = ('https://www.googleapis.com/upload/storage/v1/b/%s/o'
+                  '?uploadType=media&name=%s')
+
+
+class ExportError(Exception):
+    """ExportError -- a chunk could not be written to Cloud Storage"""
+
+
+def _toJson(entity):
+    """Serialize an entity to a single JSON line."""
+    data = entity.to_dict()
+    data['websafeKey'] = entity.key.urlsafe()
+    if entity.key.parent():
+        data['websafeParentKey'] = entity.key.parent().urlsafe()
+    return json.dumps(data, default=lambda d: d.isoformat()
+                      if isinstance(d, date) else str(d))
+
+
+def _writeObject(bucket, name, data):
+    """Upload data to a Cloud Storage object, replacing it if it exists."""
+    token, _ = app_identity.get_access_token(GCS_SCOPE)
+    resp = urlfetch.fetch(GCS_UPLOAD_URL % (bucket, urllib.quote(name, '')),
+                          payload=data, method=urlfetch.POST, deadline=60,
+                          headers={'Authorization': 'Bearer %s' % token,
+                                   'Content-Type': 'application/x-ndjson'})
+    if resp.status_code != 200:
+        raise ExportError('Failed to write %s: %s %s' % (
+            name, resp.status_code, resp.content))
+
+
+def _queueChunk(job, transactional=False):
+    """Add the task exporting the next chunk of job."""
+    taskqueue.add(queue_name=EXPORT_QUEUE, url=EXPORT_URL,
+                  params={'job': job.key.id(), 'kind': job.kindIndex,
+                          'chunk': job.chunk},
+                  transactional=transactional)
+
+
+def startExport():
+    """Create an ExportJob and queue its first chunk; return the job."""
+    job = ExportJob(bucket=EXPORT_BUCKET or
+                    app_identity.get_default_gcs_bucket_name())
+    job.put()
+    job.prefix = 'exports/%d' % job.key.id()
+    job.put()
+    _queueChunk(job)
+    return job
+
+
+@ndb.transactional
+def _checkpoint(job_id, kindIndex, chunk, next_cursor, more, count):
+    """Record a written chunk and chain the next task, unless a duplicate
+    task already did."""
+    job = ExportJob.get_by_id(job_id)
+    if job.done or (job.kindIndex, job.chunk) != (kindIndex, chunk):
+        return job
+    job.exported += count
+    if more:
+        job.chunk += 1
+        job.cursor = next_cursor.urlsafe()
+    else:
+        # move on to the next kind
+        job.kindIndex += 1
+        job.chunk = 0
+        job.cursor = None
+    job.done = job.kindIndex >= len(EXPORT_KINDS)
+    job.put()
+    if not job.done:
+        _queueChunk(job, transactional=True)
+    return job
+
+
+def exportChunk(job_id, kindIndex, chunk):
+    """Write one chunk of an export and checkpoint the job."""
+    job = ExportJob.get_by_id(job_id)
+    # stale or duplicate task, the chunk was already checkpointed
+    if not job or job.done or (job.kindIndex, job.chunk) != (kindIndex, chunk):
+        return job
+
+    model = EXPORT_KINDS[kindIndex]
+    cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+    entities, next_cursor, more = model.query().fetch_page(
+        EXPORT_BATCH_SIZE, start_cursor=cursor)
+    if entities:
+        # chunk names are deterministic, so a retry overwrites the same object
+        _writeObject(job.bucket, '%s/%s-%05d.jsonl' % (
+            job.prefix, model._get_kind(), chunk),
+            ''.join(_toJson(entity) + '\n' for entity in entities))
+    return _checkpoint(job_id, kindIndex, chunk, next_cursor,
+                       more and next_cursor is not None, len(entities))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""ical.py
+
+iCalendar feeds of conference schedules and user wishlists. Feeds are
+stored as CalendarFeed entities and cached in memcache; writes to the
+sessions or the wishlist only bump the feed generation, and the feed is
+rebuilt on the next poll. The generation it was built from is its ETag.
+
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+from google.appengine.api import app_identity
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
+from models import CalendarFeed
+from models import Conference
+from models import Profile
+from models import Session
+from rehome import conferenceKey, sessionKey, websafeKey
+
+
+MEMCACHE_FEED_KEY = 'CALENDAR FEED %s'
+FEED_CACHE_SECONDS = 3600
+# after an invalidation, polls can't cache a feed for this long, so a feed
+# built before the invalidation can't be cached after it
+INVALIDATION_LOCK_SECONDS = 10
+DEFAULT_DURATION = 60
+CONFERENCE_FEED = 'conference:%s'
+USER_FEED = 'user:%s'
+
+
+def _escape(text):
+    """Escape a TEXT value."""
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;') \
+        .replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Fold a content line to 75 octets."""
+    line = line.encode('utf-8')
+    folded = [line[:75]]
+    for i in range(75, len(line), 74):
+        folded.append(' ' + line[i:i + 74])
+    return '\r\n'.join(folded)
+
+
+def _sessionEvent(session, stamp, host):
+    """Return the VEVENT lines of a session, None if it isn't scheduled."""
+    if not session.date or session.start_time is None:
+        return None
+    start = datetime.combine(session.date, datetime.min.time()) + timedelta(
+        hours=session.start_time // 100, minutes=session.start_time % 100)
+    end = start + timedelta(minutes=session.duration or DEFAULT_DURATION)
+    return ['BEGIN:VEVENT',
+            'UID:%s@%s' % (websafeKey(session), host),
+            'DTSTAMP:%s' % stamp,
+            'DTSTART:%s' % start.strftime('%Y%m%dT%H%M%S'),
+            'DTEND:%s' % end.strftime('%Y%m%dT%H%M%S'),
+            'SUMMARY:%s' % _escape(session.name),
+            'LOCATION:%s' % _escape(session.location),
+            'DESCRIPTION:%s' % _escape(session.highlights),
+            'END:VEVENT']
+
+
+def renderCalendar(name, sessions):
+    """Render sessions as an iCalendar document."""
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    host = app_identity.get_default_version_hostname()
+    lines = ['BEGIN:VCALENDAR',
+             'VERSION:2.0',
+             'PRODID:-//scalable-conf//conference//EN',
+             'X-WR-CALNAME:%s' % _escape(name)]
+    for session in sessions:
+        lines.extend(_sessionEvent(session, stamp, host) or [])
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(_fold(line) for line in lines) + '\r\n'
+
+
+def _buildConferenceFeed(wsck):
+    """Render the schedule of a conference, None if it doesn't exist."""
+    try:
+        c_key = conferenceKey(wsck)
+    except (ProtocolBufferDecodeError, TypeError):
+        return None
+    if c_key.kind() != Conference._get_kind():
+        return None
+    conf_future = c_key.get_async()
+    sessions = Session.query(ancestor=c_key).order(
+        Session.date, Session.start_time).fetch()
+    conf = conf_future.get_result()
+    if not conf:
+        return None
+    return renderCalendar(conf.name, sessions)
+
+
+def _buildUserFeed(feed):
+    """Render the wishlist of the user owning a feed, None if their profile
+    is gone."""
+    prof = ndb.Key(Profile, feed.userId).get()
+    if not prof:
+        return None
+    sessions = ndb.get_multi([sessionKey(sk)
+                              for sk in prof.sessionWishlistKeys])
+    sessions = sorted((s for s in sessions if s),
+                      key=lambda s: (s.date, s.start_time))
+    return renderCalendar('%s wishlist' % prof.displayName, sessions)
+
+
+@ndb.transactional
+def _storeFeed(feed_id, ics, generation):
+    """Store a rebuilt feed unless a newer one was stored meanwhile."""
+    feed = CalendarFeed.get_by_id(feed_id) or CalendarFeed(id=feed_id)
+    if feed.builtGeneration < generation:
+        feed.ics = ics
+        feed.builtGeneration = generation
+        feed.put()
+
+
+def getFeed(feed_id):
+    """Return the (etag, ics) of a feed, rebuilding it if it is stale, or
+    None if it doesn't exist."""
+    cached = memcache.get(MEMCACHE_FEED_KEY % feed_id)
+    if cached:
+        return cached
+
+    feed = CalendarFeed.get_by_id(feed_id)
+    kind, key = feed_id.split(':', 1)
+    if kind == 'user' and not feed:
+        return None
+    generation = feed.generation if feed else 1
+    if feed and feed.builtGeneration == generation:
+        ics = feed.ics
+    else:
+        if kind == 'user':
+            ics = _buildUserFeed(feed)
+        else:
+            ics = _buildConferenceFeed(key)
+        if ics is None:
+            return None
+        _storeFeed(feed_id, ics, generation)
+
+    cached = ('"%d"' % generation, ics)
+    memcache.add(MEMCACHE_FEED_KEY % feed_id, cached, time=FEED_CACHE_SECONDS)
+    return cached
+
+
+@ndb.transactional
+def _bumpGeneration(feed_id):
+    feed = CalendarFeed.get_by_id(feed_id) or CalendarFeed(id=feed_id)
+    feed.generation += 1
+    feed.put()
+
+
+def invalidateFeed(feed_id):
+    """Mark a feed stale after its sessions or wishlist changed."""
+    _bumpGeneration(feed_id)
+    memcache.delete(MEMCACHE_FEED_KEY % feed_id,
+                    seconds=INVALIDATION_LOCK_SECONDS)
+
+
+def invalidateConferenceFeed(wsck):
+    """Mark the schedule feed of a conference stale."""
+    invalidateFeed(CONFERENCE_FEED % wsck)
+
+
+def invalidateUserFeed(prof):
+    """Mark the wishlist feed of a Profile stale, if it has one."""
+    if prof.calendarToken:
+        invalidateFeed(USER_FEED % prof.calendarToken)
+
+
+def userFeedToken(prof):
+    """Return the secret token of the wishlist feed of a Profile, creating
+    the feed on first use."""
+    if not prof.calendarToken:
+        prof.calendarToken = uuid.uuid4().hex
+        ndb.put_multi([prof, CalendarFeed(id=USER_FEED % prof.calendarToken,
+                                          userId=prof.key.id())])
+    return prof.calendarToken
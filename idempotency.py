@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""idempotency.py
+
+Client request IDs for the endpoints that create or register. The first
+request with an ID claims it in the datastore, runs and stores its
+response; a retry with the same ID gets the stored response from memcache,
+or from the datastore after an eviction, instead of running again. IDs are
+scoped by user and endpoint and kept for IDEMPOTENCY_WINDOW_HOURS.
+
+A request failing with an error before its write committed releases its
+claim, so the retry runs. The steps following the write run once its
+response is stored; an error in them keeps the claim, so a retry gets the
+stored response instead of writing again.
+
+"""
+
+from datetime import datetime, timedelta
+
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from protorpc import protojson
+from models import ConflictException
+from models import IdempotencyRecord
+from settings import IDEMPOTENCY_PENDING_SECONDS
+from settings import IDEMPOTENCY_WINDOW_HOURS
+from utils import getUserId
+
+
+MEMCACHE_RESPONSE_KEY = 'IDEMPOTENT %s'
+MAX_REQUEST_ID_LENGTH = 100
+
+
+@ndb.transactional
+def _claim(record_id):
+    """Claim a request ID; return the stored response if a request with
+    the same ID already ran, None if the caller may run."""
+    now = datetime.utcnow()
+    record = IdempotencyRecord.get_by_id(record_id)
+    if record and record.created > now - timedelta(
+            hours=IDEMPOTENCY_WINDOW_HOURS):
+        if record.response is not None:
+            return record.response
+        if record.created > now - timedelta(
+                seconds=IDEMPOTENCY_PENDING_SECONDS):
+            raise ConflictException(
+                'A request with this requestId is in progress.')
+    # a new ID, an expired one or a claim abandoned by a dead request
+    IdempotencyRecord(id=record_id, created=now).put()
+    return None
+
+
+def runOnce(endpoint, requestId, responseType, func, after=None):
+    """Return func(), or the response of the earlier call of endpoint by
+    the same user with the same requestId. func makes the write and must
+    return a message of responseType; after(response), if given, runs the
+    follow-up steps once the response is stored."""
+    user = endpoints.get_current_user()
+    if not requestId or not user:
+        response = func()
+        if after:
+            after(response)
+        return response
+    if len(requestId) > MAX_REQUEST_ID_LENGTH:
+        raise endpoints.BadRequestException(
+            'requestId is longer than %d characters.' % MAX_REQUEST_ID_LENGTH)
+    record_id = '%s:%s:%s' % (getUserId(user), endpoint, requestId)
+
+    stored = memcache.get(MEMCACHE_RESPONSE_KEY % record_id) or \
+        _claim(record_id)
+    if stored is not None:
+        return protojson.decode_message(responseType, stored)
+
+    try:
+        response = func()
+    except Exception:
+        ndb.Key(IdempotencyRecord, record_id).delete()
+        raise
+    stored = protojson.encode_message(response)
+    record = IdempotencyRecord(id=record_id, response=stored)
+    record.put()
+    memcache.set(MEMCACHE_RESPONSE_KEY % record_id, stored,
+                 time=IDEMPOTENCY_WINDOW_HOURS * 3600)
+    if after:
+        after(response)
+    return response
+
+
+def purgeRecords(batch=500):
+    """Delete the request IDs older than IDEMPOTENCY_WINDOW_HOURS; return
+    the number deleted."""
+    q = IdempotencyRecord.query(IdempotencyRecord.created < (
+        datetime.utcnow() - timedelta(hours=IDEMPOTENCY_WINDOW_HOURS)))
+    deleted = 0
+    while True:
+        keys = q.fetch(batch, keys_only=True)
+        ndb.delete_multi(keys)
+        deleted += len(keys)
+        if len(keys) < batch:
+            return deleted
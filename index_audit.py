@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""index_audit.py
+
+Derive the composite indexes the API needs from its query surface, compare
+them with index.yaml and estimate the index writes of an entity put.
+
+Run from the project root with the App Engine SDK on the python path:
+
+    python index_audit.py           # print the report
+    python index_audit.py --write   # also rewrite index.yaml
+
+Conference queries follow _getQuery: the inequality field (if any) is
+sorted first, then name. Equality filters are served by merging one index
+per filter (zigzag merge join) instead of one index per combination of
+filters, which keeps the number of Conference indexes linear in FIELDS.
+
+"""
+
+import itertools
+import optparse
+import os
+
+import yaml
+
+from conference import FIELDS, OPERATORS
+from conference import SESSION_FIELDS, SESSION_INEQUALITY_FIELDS
+from models import Conference, Profile, Session, Speaker
+from models import IdempotencyRecord, MetricsSnapshot, Tombstone, WaitlistEntry
+from models import ConferenceMove, RegistrationIntent, SeatSubscription
+
+
+INDEX_YAML = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'index.yaml')
+MODELS = [Conference, Profile, Session, Speaker, Tombstone, WaitlistEntry,
+          IdempotencyRecord, MetricsSnapshot, SeatSubscription,
+          ConferenceMove, RegistrationIntent]
+
+# properties used by equality-only filters (or a range filter and sort on
+# the same property); these are served by the built-in indexes but must
+# stay indexed
+EQUALITY_ONLY = {
+    # getConferenceSessionByType, querySessions; getChanges
+    'Session': set(SESSION_FIELDS) | set(['modified']),
+    # getConferencesCreated: the organizer's conferences; getChanges and
+    # warmup: the conferences changed last
+    'Conference': set(FIELDS.values()) | set(['modified', 'organizerUserId']),
+    # deletion: stripping a deleted conference or session from profiles
+    'Profile': set(['conferenceKeysToAttend', 'sessionWishlistKeys']),
+    # getChanges, purgeTombstones
+    'Speaker': set(['modified']),
+    'Tombstone': set(['deleted']),
+    # purgeRecords
+    'IdempotencyRecord': set(['created']),
+    # loadMetrics, purgeMetrics
+    'MetricsSnapshot': set(['created']),
+    # publishSeats: the subscribers of a conference
+    'SeatSubscription': set(['websafeConferenceKey']),
+    # the mapper admin page: the conference moves updated last
+    'ConferenceMove': set(['updated']),
+    # drainRegistrations: the conferences with pending intents
+    'RegistrationIntent': set(['status']),
+}
+
+
+def _index(kind, properties, ancestor=False):
+    """Return an index as a hashable (kind, ancestor, properties) tuple."""
+    return (kind, ancestor, tuple(properties))
+
+
+def conferenceIndexes():
+    """Indexes needed by queryConferences and _cacheAnnouncement."""
+    fields = sorted(set(FIELDS.values()))
+    inequality = [op for op in OPERATORS.values() if op != '=']
+    indexes = set()
+    # equality filter or inequality filter on one field, sorted by name
+    for field in fields:
+        indexes.add(_index('Conference', [field, 'name']))
+    # equality filter merged with an inequality on another field
+    if inequality:
+        for eq, ineq in itertools.permutations(fields, 2):
+            indexes.add(_index('Conference', [eq, ineq, 'name']))
+    # _cacheAnnouncement: seatsAvailable range, projected on name
+    indexes.add(_index('Conference', ['seatsAvailable', 'name']))
+    return indexes
+
+
+def sessionIndexes():
+    """Indexes needed by the session query endpoints."""
+    indexes = set()
+    # getConferenceSessions and _cacheFeaturedSpeaker ordering
+    indexes.add(_index('Session', ['date', 'start_time'], ancestor=True))
+    # _getSpeakerKeys projection
+    indexes.add(_index('Session', ['speakerKeys'], ancestor=True))
+    # querySessions, and doubleQuerySessions with two inequalities (the
+    # second one is applied in memory)
+    for ineq in SESSION_INEQUALITY_FIELDS:
+        indexes.add(_index('Session', [ineq], ancestor=True))
+    # doubleQuerySessions with an equality and an inequality
+    for eq in SESSION_FIELDS:
+        for ineq in SESSION_INEQUALITY_FIELDS:
+            if eq != ineq:
+                indexes.add(_index('Session', [eq, ineq], ancestor=True))
+    return indexes
+
+
+def taskIndexes():
+    """Indexes needed by the task handlers."""
+    # _promoteWaitlist: a conference waitlist in joining order
+    return set([_index('WaitlistEntry', ['websafeConferenceKey', 'joined'])])
+
+
+def requiredIndexes():
+    """Return all the composite indexes the query surface needs."""
+    return conferenceIndexes() | sessionIndexes() | taskIndexes()
+
+
+def loadIndexes(path=INDEX_YAML):
+    """Return the composite indexes listed in index.yaml."""
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    indexes = set()
+    for index in data.get('indexes') or []:
+        indexes.add(_index(index['kind'],
+                           [p['name'] for p in index.get('properties', [])],
+                           ancestor=index.get('ancestor') in (True, 'yes')))
+    return indexes
+
+
+def queriedProperties(indexes):
+    """Return the properties used by a query, per kind."""
+    queried = dict((kind, set(props)) for kind, props in EQUALITY_ONLY.items())
+    for kind, ancestor, properties in indexes:
+        queried.setdefault(kind, set()).update(properties)
+    return queried
+
+
+def unqueriedProperties(indexes):
+    """Return the indexed model properties no query uses, per kind."""
+    queried = queriedProperties(indexes)
+    unqueried = {}
+    for model in MODELS:
+        kind = model._get_kind()
+        props = [name for name, prop in model._properties.items()
+                 if prop._indexed and name not in queried.get(kind, ())]
+        if props:
+            unqueried[kind] = sorted(props)
+    return unqueried
+
+
+def indexWrites(model, indexes, repeated=2):
+    """Estimate the index writes of putting a new entity of model: two per
+    indexed property value (ascending and descending built-in indexes) and
+    one per composite index row. Repeated properties are assumed to hold
+    `repeated` values."""
+    values = {}
+    for name, prop in model._properties.items():
+        if prop._indexed:
+            values[name] = repeated if prop._repeated else 1
+    writes = 2 * sum(values.values())
+    for kind, ancestor, properties in indexes:
+        if kind != model._get_kind():
+            continue
+        rows = 1
+        for name in properties:
+            rows *= values.get(name, 1)
+        writes += rows
+    return writes
+
+
+def _formatIndex(index):
+    kind, ancestor, properties = index
+    return '%s%s(%s)' % (kind, ' [ancestor] ' if ancestor else ' ',
+                         ', '.join(properties))
+
+
+def writeIndexYaml(indexes, path=INDEX_YAML):
+    """Write indexes to index.yaml, managed by hand from now on."""
+    lines = ['indexes:', '',
+             '# Generated by index_audit.py from the API query surface,',
+             '# regenerate it with: python index_audit.py --write', '']
+    for kind, ancestor, properties in sorted(indexes):
+        lines.append('- kind: %s' % kind)
+        if ancestor:
+            lines.append('  ancestor: yes')
+        lines.append('  properties:')
+        lines.extend('  - name: %s' % name for name in properties)
+        lines.append('')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--write', action='store_true',
+                      help='rewrite index.yaml with the required indexes')
+    parser.add_option('--repeated', type='int', default=2,
+                      help='values assumed per repeated property')
+    options, args = parser.parse_args()
+
+    required = requiredIndexes()
+    existing = loadIndexes()
+
+    print 'Unused indexes in index.yaml:'
+    for index in sorted(existing - required):
+        print '  ' + _formatIndex(index)
+    print 'Missing indexes:'
+    for index in sorted(required - existing):
+        print '  ' + _formatIndex(index)
+
+    print 'Index writes per new entity put (index.yaml -> required):'
+    for model in MODELS:
+        print '  %-10s %4d -> %4d' % (
+            model._get_kind(),
+            indexWrites(model, existing, options.repeated),
+            indexWrites(model, required, options.repeated))
+
+    print 'Indexed properties never queried (candidates for indexed=False):'
+    for kind, props in sorted(unqueriedProperties(required).items()):
+        print '  %s: %s' % (kind, ', '.join(props))
+
+    if options.write:
+        writeIndexYaml(required)
+        print 'Wrote %d indexes to %s' % (len(required), INDEX_YAML)
+
+
+if __name__ == '__main__':
+    main()
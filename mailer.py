@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""mailer.py
+
+Batched, rate-limited conference confirmation emails. Confirmation jobs are
+added to a pull queue when a conference is created and sent by a cron job
+that leases them in batches.
+
+"""
+
+import json
+import logging
+import os
+import time
+from string import Template
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from rehome import conferenceKey, websafeKey
+from settings import MAIL_RATE_PER_MINUTE
+from settings import MAIL_MAX_RETRIES
+
+
+CONFIRMATION_QUEUE = 'confirmation-email'
+LEASE_SECONDS = 60
+BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 3600
+MEMCACHE_MAIL_RATE_KEY = 'MAIL SENT %d'
+
+def _loadTemplate(name):
+    with open(os.path.join(os.path.dirname(__file__), 'templates', name)) as f:
+        return Template(f.read())
+
+CONFIRMATION_TEMPLATE = _loadTemplate('confirmation_email.txt')
+WAITLIST_TEMPLATE = _loadTemplate('waitlist_email.txt')
+
+
+def _confirmationTask(email, websafeConferenceKey, failures=0,
+                      countdown=None):
+    """Return the pull task of a confirmation email job. failures counts
+    the sends that failed, not the leases given back over the rate limit,
+    which also raise the retry_count of a task."""
+    return taskqueue.Task(
+        payload=json.dumps({'email': email, 'wsck': websafeConferenceKey,
+                            'failures': failures}),
+        method='PULL', countdown=countdown)
+
+
+def queueConfirmationEmail(email, websafeConferenceKey):
+    """Add a confirmation email job to the pull queue."""
+    return taskqueue.Queue(CONFIRMATION_QUEUE).add(
+        _confirmationTask(email, websafeConferenceKey))
+
+
+def _acquireSendSlots(count):
+    """Reserve up to count sends in the current minute, return the number
+    of sends granted."""
+    key = MEMCACHE_MAIL_RATE_KEY % (int(time.time()) // 60)
+    memcache.add(key, 0, time=120)
+    sent = memcache.incr(key, delta=count)
+    if sent is None:
+        # memcache unavailable, fall back to a single send per run
+        return min(count, 1)
+    return max(0, min(count, MAIL_RATE_PER_MINUTE - (sent - count)))
+
+
+def _renderConfirmation(conf, template=CONFIRMATION_TEMPLATE):
+    """Render the compact confirmation email body for a conference."""
+    return template.safe_substitute(
+        name=conf.name,
+        city=conf.city,
+        startDate=conf.startDate or '',
+        endDate=conf.endDate or '',
+        topics=', '.join(conf.topics),
+        maxAttendees=conf.maxAttendees,
+        host=app_identity.get_default_version_hostname(),
+        websafeKey=websafeKey(conf))
+
+
+def sendWaitlistEmail(email, websafeConferenceKey):
+    """Tell a user they were registered from the waitlist of a conference."""
+    conf = conferenceKey(websafeConferenceKey).get()
+    if not conf:
+        return
+    mail.send_mail(
+        'noreply@%s.appspotmail.com' % app_identity.get_application_id(),
+        email, 'You are registered for %s!' % conf.name,
+        _renderConfirmation(conf, WAITLIST_TEMPLATE))
+
+
+def _backoff(queue, failed):
+    """Add the jobs whose email failed again after an exponential backoff
+    in their number of failures, dropping the ones that ran out of
+    retries, and delete their tasks. failed maps the websafe key of a
+    conference to the email, failures and leased tasks of its job."""
+    retry, dropped = [], 0
+    for wsck, (email, failures, tasks) in failed.items():
+        if failures >= MAIL_MAX_RETRIES:
+            dropped += 1
+            continue
+        retry.append(_confirmationTask(
+            email, wsck, failures + 1,
+            min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** failures)))
+    # add the retries first: a failure in between sends an email twice
+    # instead of losing it
+    if retry:
+        queue.add(retry)
+    if failed:
+        queue.delete_tasks([task for _, _, tasks in failed.values()
+                            for task in tasks])
+    if dropped:
+        logging.error('Dropping %d confirmation emails after %d retries',
+                      dropped, MAIL_MAX_RETRIES)
+
+
+def sendConfirmationEmails():
+    """Lease a batch of confirmation jobs and send one email per conference,
+    within the configured rate limit. Return the number of emails sent."""
+    queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+    tasks = queue.lease_tasks(LEASE_SECONDS, MAIL_RATE_PER_MINUTE)
+    if not tasks:
+        return 0
+
+    # deduplicate by conference key, keeping the tasks to delete once sent
+    jobs, failures = {}, {}
+    for task in tasks:
+        payload = json.loads(task.payload)
+        wsck = payload['wsck']
+        email, tasks_for_conf = jobs.setdefault(wsck,
+                                                (payload['email'], []))
+        tasks_for_conf.append(task)
+        failures[wsck] = max(failures.get(wsck, 0),
+                             payload.get('failures', 0))
+
+    # give back the leases of the jobs over the rate limit, without
+    # counting them as failures
+    wscks = jobs.keys()
+    granted = _acquireSendSlots(len(wscks))
+    for wsck in wscks[granted:]:
+        for task in jobs[wsck][1]:
+            queue.modify_task_lease(task, 0)
+    wscks = wscks[:granted]
+
+    confs = ndb.get_multi([conferenceKey(wsck) for wsck in wscks])
+    sender = 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+    done, failed = [], {}
+    sent = 0
+    for wsck, conf in zip(wscks, confs):
+        email, tasks_for_conf = jobs[wsck]
+        # conference is gone, nothing to confirm
+        if not conf:
+            done.extend(tasks_for_conf)
+            continue
+        try:
+            mail.send_mail(sender, email, 'You created a new Conference!',
+                           _renderConfirmation(conf))
+            done.extend(tasks_for_conf)
+            sent += 1
+        except Exception:
+            logging.exception('Failed to send confirmation for %s', wsck)
+            failed[wsck] = (email, failures[wsck], tasks_for_conf)
+
+    if done:
+        queue.delete_tasks(done)
+    _backoff(queue, failed)
+    return sent
@@ -1,10 +1,39 @@
 #!/usr/bin/env python
+import time
+STARTED = time.time()
+
+import cgi
+import json
+import os
 import webapp2
 import logging
-from google.appengine.api import app_identity
-from google.appengine.api import mail
-from google.appengine.api import memcache
+from string import Template
 from conference import ConferenceApi
+from mailer import sendConfirmationEmails, sendWaitlistEmail
+from coalescer import clearDirty, markDirty
+from models import ExportJob
+from related import rebuildRelatedSessions, updateRelatedSessions
+from ical import getFeed, invalidateConferenceFeed, CONFERENCE_FEED, USER_FEED
+from registration import settleRegistrations, applyRegistrations
+from registration import drainRegistrations
+from models import MapperJob
+from models import ConferenceMove
+from changes import purgeTombstones
+from idempotency import purgeRecords
+from settings import MAPPER_SHARDS
+from settings import METRICS_RETENTION_DAYS
+from suggest import refillPrefix, updateSuggestions
+from metrics import loadMetrics, purgeMetrics, timedDispatcher
+from trends import rollupActivity
+from rehome import runMove
+from push import publishSeats, sendSeats
+from warmup import warmup
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Load the API and fill the caches of a new instance."""
+        warmup()
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
@@ -13,37 +42,318 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         ConferenceApi._cacheAnnouncement()
 
 
-class SendConfirmationEmailHandler(webapp2.RequestHandler):
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send a batch of queued conference confirmation emails."""
+        sent = sendConfirmationEmails()
+        logging.info('Sent %d confirmation emails', sent)
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
-        )
+        """Register the head of a conference waitlist after a seat freed up."""
+        ConferenceApi._promoteWaitlist(self.request.get('wsck'))
 
 
-class IsSpeakerFeaturedHandler(webapp2.RequestHandler):
+class NotifyWaitlistHandler(webapp2.RequestHandler):
     def post(self):
-        """Check if speaker should be featured speaker and if so update the
-        featuredSpeaker in memcache"""
-        # check if any speaker appear in more than one session for this conference
-        conferenceSpeakerKeys = ConferenceApi._getSpeakerKeys(self.request.get('wsck'))
-        speakerKeys = self.request.get_all('sk')
-        for speakerKey in speakerKeys:
-            if conferenceSpeakerKeys.count(speakerKey) > 1:
-                memcache.set('featuredSpeaker',
-                             (ConferenceApi._getSpeakerName(speakerKey),
-                              self.request.get('name')))
+        """Email a user registered from a conference waitlist."""
+        sendWaitlistEmail(self.request.get('email'), self.request.get('wsck'))
+
+
+class SettleRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Settle a batch of async registrations for a conference."""
+        wsck = self.request.get('wsck')
+        if settleRegistrations(wsck):
+            markDirty('announcement')
+            markDirty('seats', wsck)
+
+
+class ApplyRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the profiles and tickets of a settled batch."""
+        applyRegistrations(self.request.get('wsck'),
+                           self.request.get_all('registered'),
+                           self.request.get_all('sold_out'))
+
+
+class DrainRegistrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Schedule the settle of the conferences with pending intents."""
+        drained = drainRegistrations()
+        logging.info('Scheduled the settle of %d conferences', drained)
+
+
+class RefreshSpeakersHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rewrite the speaker profiles and the calendar feed of a
+        conference after it was renamed."""
+        wsck = self.request.get('wsck')
+        ConferenceApi._refreshSpeakerSessions(wsck)
+        invalidateConferenceFeed(wsck)
+
+
+class DeleteHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run the next batch of a conference or session deletion."""
+        from deletion import runStage
+        runStage(self.request.get('kind'), self.request.get('key'),
+                 self.request.get('stage'), self.request.get('cursor'),
+                 {'speaker': self.request.get_all('speaker')})
+
+
+class RecomputeHandler(webapp2.RequestHandler):
+    # derived data kinds and the functions recomputing them for a scope
+    RECOMPUTE = {
+        'announcement': lambda scope: ConferenceApi._cacheAnnouncement(),
+        'featured_speaker': ConferenceApi._cacheFeaturedSpeaker,
+        'seats': publishSeats,
+    }
+
+    def post(self, kind):
+        """Recompute derived data marked dirty by the coalescer."""
+        if kind not in self.RECOMPUTE:
+            self.abort(404)
+        scope = self.request.get('scope')
+        clearDirty(kind, scope)
+        self.RECOMPUTE[kind](scope)
+
+
+class PushSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Send the seats of a conference to a batch of subscribers."""
+        sendSeats(self.request.get_all('client'), self.request.get('message'))
+
+
+class RelatedSessionsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the related sessions after a wishlist change."""
+        updateRelatedSessions(self.request.get('sk'),
+                              self.request.get_all('other'),
+                              int(self.request.get('delta')))
+
+
+class BuildRelatedSessionsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start the rebuild of the related sessions, a task per
+        conference."""
+        from mapper import startJob
+        startJob('rebuild_related_sessions')
+
+
+class RebuildRelatedSessionsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild the related sessions of a conference."""
+        rebuildRelatedSessions(self.request.get('wsck'))
+
+
+class SuggestionsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the name prefixes of a speaker or conference, or refill
+        a prefix."""
+        if self.request.get('refill'):
+            refillPrefix(self.request.get('kind'), self.request.get('refill'))
+            return
+        updateSuggestions(self.request.get('kind'), self.request.get('key'),
+                          self.request.get('name') or None,
+                          self.request.get('old_name') or None)
+
+
+class RollupActivityHandler(webapp2.RequestHandler):
+    def get(self):
+        """Roll the activity events up into the daily buckets."""
+        logging.info('Rolled up %d activity events', rollupActivity())
+
+
+class PurgeTombstonesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete the deletion records older than the delta sync keeps."""
+        logging.info('Purged %d tombstones', purgeTombstones())
+
+
+class PurgeRequestIdsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete the client request IDs older than the retry window."""
+        logging.info('Purged %d request IDs', purgeRecords())
+
+
+class CalendarHandler(webapp2.RequestHandler):
+    FEEDS = {'conference': CONFERENCE_FEED, 'user': USER_FEED}
+
+    def get(self, kind, key):
+        """Serve an iCalendar feed, or 304 if the client has it already."""
+        feed = getFeed(self.FEEDS[kind] % key)
+        if not feed:
+            self.abort(404)
+        etag, ics = feed
+        self.response.headers['ETag'] = etag
+        self.response.headers['Cache-Control'] = 'private, max-age=300'
+        if etag in self.request.headers.get('If-None-Match', ''):
+            self.response.status = 304
+            return
+        self.response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+        self.response.write(ics)
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def _writeJob(self, job):
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'job': job.key.id(),
+            'bucket': job.bucket,
+            'prefix': job.prefix,
+            'exported': job.exported,
+            'done': job.done,
+        }))
+
+    def get(self):
+        """Return the progress of an export job."""
+        job = ExportJob.get_by_id(int(self.request.get('job') or 0))
+        if not job:
+            self.abort(404)
+        self._writeJob(job)
+
+    def post(self):
+        """Start exporting conferences, sessions and speakers as JSONL."""
+        from export import startExport
+        self._writeJob(startExport())
+
+
+class MapperHandler(webapp2.RequestHandler):
+    with open(os.path.join(os.path.dirname(__file__), 'templates',
+                           'mapper_admin.html')) as f:
+        TEMPLATE = Template(f.read())
+    ROW = ('<tr><td>%d</td><td>%s</td><td>%s</td><td>%d / %d</td><td>%d</td>'
+           '<td>%d</td><td>%d</td><td><pre>%s</pre></td></tr>')
+    MOVE_ROW = ('<tr><td>%s</td><td>%s</td><td>%s</td><td>%d</td><td>%d</td>'
+                '<td><pre>%s</pre></td></tr>')
+
+    def get(self):
+        """Show the progress and errors of the latest mapper jobs."""
+        from mapper import MAPPERS, getShards
+        rows = []
+        for job in MapperJob.query().order(-MapperJob.created).fetch(20):
+            shards = [shard for shard in getShards(job) if shard]
+            errors = [shard.lastError for shard in shards if shard.lastError]
+            rows.append(self.ROW % (
+                job.key.id(), cgi.escape(job.mapper),
+                job.created.strftime('%Y-%m-%d %H:%M'),
+                sum(shard.done for shard in shards), job.shardCount,
+                sum(shard.processed for shard in shards),
+                sum(shard.updated for shard in shards),
+                sum(shard.errors for shard in shards),
+                cgi.escape(errors[-1] if errors else '')))
+        # the conference moves of rehome_conferences, failing ones included
+        moves = [self.MOVE_ROW % (
+            cgi.escape(move.key.id()), move.status,
+            move.updated.strftime('%Y-%m-%d %H:%M'), move.copied,
+            move.errors, cgi.escape(move.lastError or ''))
+            for move in ConferenceMove.query().order(
+                -ConferenceMove.updated).fetch(20)]
+        options = ''.join('<option>%s</option>' % cgi.escape(name)
+                          for name in sorted(MAPPERS))
+        self.response.write(self.TEMPLATE.substitute(
+            options=options, shards=MAPPER_SHARDS, rows='\n'.join(rows),
+            moves='\n'.join(moves)))
+
+    def post(self):
+        """Start a mapper job."""
+        from mapper import MAPPERS, startJob
+        mapper = self.request.get('mapper')
+        if mapper not in MAPPERS:
+            self.abort(400)
+        startJob(mapper, int(self.request.get('shards') or MAPPER_SHARDS))
+        self.redirect('/admin/mapper')
+
+
+class RehomeHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run the next steps of a conference move."""
+        runMove(self.request.get('wsck'))
+
+
+class MetricsHandler(webapp2.RequestHandler):
+    with open(os.path.join(os.path.dirname(__file__), 'templates',
+                           'metrics_admin.html')) as f:
+        TEMPLATE = Template(f.read())
+    ROW = ('<tr><td>%(version)s</td><td>%(endpoint)s</td><td>%(count)d</td>'
+           '<td>%(clientErrors)d</td><td>%(errors)d</td><td>%(p50Ms)d</td>'
+           '<td>%(p90Ms)d</td><td>%(p99Ms)d</td><td>%(maxMs)d</td>'
+           '<td>%(p50Bytes)d</td><td>%(p99Bytes)d</td></tr>')
+
+    def get(self):
+        """Show the request metrics of all instances over the last hours,
+        as a table or as JSON."""
+        try:
+            hours = int(self.request.get('hours') or 24)
+        except ValueError:
+            self.abort(400)
+        hours = max(1, min(hours, METRICS_RETENTION_DAYS * 24))
+        rows = loadMetrics(hours)
+        if self.request.get('format') == 'json':
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(json.dumps({'hours': hours, 'metrics': rows}))
+            return
+        for row in rows:
+            row['version'] = cgi.escape(row['version'] or '')
+            row['endpoint'] = cgi.escape(row['endpoint'])
+        self.response.write(self.TEMPLATE.substitute(
+            hours=hours, rows='\n'.join(self.ROW % row for row in rows)))
+
+
+class PurgeMetricsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Delete the request metrics older than the retention."""
+        logging.info('Purged %d metrics snapshots', purgeMetrics())
+
+
+class MapperShardHandler(webapp2.RequestHandler):
+    def post(self):
+        """Map the next batches of a mapper shard."""
+        from mapper import runShard
+        runShard(self.request.get('shard'))
+
+
+class ExportChunkHandler(webapp2.RequestHandler):
+    def post(self):
+        """Export the next chunk of an export job."""
+        from export import exportChunk
+        exportChunk(int(self.request.get('job')),
+                    int(self.request.get('kind')),
+                    int(self.request.get('chunk')))
+
 
 logging.getLogger().setLevel(logging.DEBUG)
+logging.info('main.py loaded in %d ms', (time.time() - STARTED) * 1000)
 
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
-    ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/is_speaker_featured', IsSpeakerFeaturedHandler)
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
+    ('/tasks/recompute/(\w+)', RecomputeHandler),
+    ('/tasks/push_seats', PushSeatsHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    ('/tasks/notify_waitlist', NotifyWaitlistHandler),
+    ('/tasks/settle_registrations', SettleRegistrationsHandler),
+    ('/tasks/apply_registrations', ApplyRegistrationsHandler),
+    ('/crons/drain_registrations', DrainRegistrationsHandler),
+    ('/admin/export', ExportHandler),
+    ('/tasks/export', ExportChunkHandler),
+    ('/admin/mapper', MapperHandler),
+    ('/tasks/mapper', MapperShardHandler),
+    ('/tasks/rehome', RehomeHandler),
+    ('/tasks/related_sessions', RelatedSessionsHandler),
+    ('/tasks/rebuild_related_sessions', RebuildRelatedSessionsHandler),
+    ('/tasks/refresh_speakers', RefreshSpeakersHandler),
+    ('/tasks/delete', DeleteHandler),
+    ('/tasks/suggest', SuggestionsHandler),
+    ('/crons/build_related_sessions', BuildRelatedSessionsHandler),
+    ('/crons/rollup_activity', RollupActivityHandler),
+    ('/crons/purge_tombstones', PurgeTombstonesHandler),
+    ('/crons/purge_request_ids', PurgeRequestIdsHandler),
+    ('/admin/metrics', MetricsHandler),
+    ('/crons/purge_metrics', PurgeMetricsHandler),
+    ('/calendar/(conference|user)/([\w-]+)\.ics', CalendarHandler)
 ], debug=True)
+app.router.set_dispatcher(timedDispatcher)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""mapper.py
+
+A small mapper framework for data migrations. A job runs a registered
+map function over every entity of a kind. The kind is split into key
+range shards from a sample of __scatter__ keys. Each shard runs in a chain
+of tasks that map batches of entities, put the changed ones with put_multi
+and checkpoint the shard's cursor after every batch. A retried or
+duplicate task resumes from the last checkpoint, and memory stays bounded
+by the batch size.
+
+Map functions take an entity and return True when it changed and must be
+saved. Register them in MAPPERS.
+
+"""
+
+import logging
+import time
+import traceback
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from conference import ConferenceApi
+from models import Conference
+from models import MapperJob
+from models import MapperShard
+from models import Profile
+from models import Session
+from models import Speaker
+from settings import MAPPER_SHARDS
+from settings import MAPPER_BATCH_SIZE
+from settings import MAPPER_TASK_SECONDS
+from rehome import rehomeConference
+from related import queueRelatedRebuild
+from stats import rebuildStats
+from suggest import indexName
+
+
+MAPPER_QUEUE = 'mapper'
+MAPPER_URL = '/tasks/mapper'
+# scatter keys sampled per shard, more give evener shards
+OVERSAMPLING = 32
+
+
+def _resave(entity):
+    """Put the entity again, e.g. to drop the index rows of a property
+    that was declared indexed=False after it was written."""
+    return True
+
+
+def _normalizeSpeakerName(speaker):
+    """Collapse the whitespace in a speaker name."""
+    name = ' '.join(speaker.name.split())
+    if name == speaker.name:
+        return False
+    speaker.name = name
+    return True
+
+
+MAPPERS = {
+    'resave_conferences': (Conference, _resave),
+    'resave_profiles': (Profile, _resave),
+    'resave_sessions': (Session, _resave),
+    'resave_speakers': (Speaker, _resave),
+    'normalize_speaker_names': (Speaker, _normalizeSpeakerName),
+    'rebuild_conference_stats': (Conference, rebuildStats),
+    'rehome_conferences': (Conference, rehomeConference),
+    'rebuild_related_sessions': (Conference, queueRelatedRebuild),
+    'index_conference_names': (Conference, indexName),
+    'index_speaker_names': (Speaker, indexName),
+    'rebuild_speaker_sessions': (Speaker,
+                                 ConferenceApi._rebuildSpeakerSessions),
+}
+
+
+def shardKey(job_id, number):
+    """Return the key of a shard of a job."""
+    return ndb.Key(MapperShard, '%d-%d' % (job_id, number))
+
+
+def splitKeyRanges(model, shards):
+    """Split a kind into at most shards key ranges, as (start, end) key
+    pairs where None is unbounded."""
+    sample = model.query().order(ndb.GenericProperty('__scatter__')).fetch(
+        shards * OVERSAMPLING, keys_only=True)
+    sample.sort()
+    step = len(sample) / float(shards)
+    splits = sorted(set(sample[int(step * i)] for i in range(1, shards)
+                        if int(step * i) < len(sample)))
+    bounds = [None] + splits + [None]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def _queueShard(shard, transactional=False):
+    taskqueue.add(queue_name=MAPPER_QUEUE, url=MAPPER_URL,
+                  params={'shard': shard.key.id()},
+                  transactional=transactional)
+
+
+def startJob(mapper, shards=MAPPER_SHARDS):
+    """Create a MapperJob for a registered mapper, split its kind into
+    shards and queue them; return the job."""
+    model, func = MAPPERS[mapper]
+    job = MapperJob(mapper=mapper)
+    job.put()
+    ranges = splitKeyRanges(model, shards)
+    entities = [MapperShard(
+        key=shardKey(job.key.id(), number), jobId=job.key.id(),
+        keyStart=start.urlsafe() if start else None,
+        keyEnd=end.urlsafe() if end else None)
+        for number, (start, end) in enumerate(ranges)]
+    job.shardCount = len(entities)
+    ndb.put_multi(entities + [job])
+    for shard in entities:
+        _queueShard(shard)
+    return job
+
+
+def getShards(job):
+    """Return the shards of a job."""
+    return ndb.get_multi([shardKey(job.key.id(), number)
+                          for number in range(job.shardCount)])
+
+
+def _shardQuery(model, shard):
+    q = model.query()
+    if shard.keyStart:
+        q = q.filter(model.key >= ndb.Key(urlsafe=shard.keyStart))
+    if shard.keyEnd:
+        q = q.filter(model.key < ndb.Key(urlsafe=shard.keyEnd))
+    return q.order(model.key)
+
+
+@ndb.transactional
+def _checkpoint(shard_id, batch, cursor, more, processed, updated, errors,
+                lastError, chain):
+    """Record a mapped batch of a shard, and chain the next task if the
+    current one is out of time. Return the shard, or None if a duplicate
+    task already recorded the batch."""
+    shard = MapperShard.get_by_id(shard_id)
+    if shard.done or shard.batch != batch:
+        return None
+    shard.batch += 1
+    shard.cursor = cursor.urlsafe() if cursor else None
+    shard.done = not more
+    shard.processed += processed
+    shard.updated += updated
+    shard.errors += errors
+    if lastError:
+        shard.lastError = lastError
+    shard.put()
+    if chain and not shard.done:
+        _queueShard(shard, transactional=True)
+    return shard
+
+
+def _mapBatch(func, entities):
+    """Map a batch of entities and save the changed ones; return the
+    number of changed entities, the number of errors and the last error."""
+    changed, errors, lastError = [], 0, None
+    for entity in entities:
+        try:
+            if func(entity):
+                changed.append(entity)
+        except Exception:
+            # a bad entity is counted and skipped, not retried forever
+            errors += 1
+            lastError = '%s: %s' % (entity.key.urlsafe(),
+                                    traceback.format_exc()[-2000:])
+            logging.warning('Mapper failed on %s', entity.key)
+    ndb.put_multi(changed)
+    return len(changed), errors, lastError
+
+
+def runShard(shard_id):
+    """Map batches of a shard for up to MAPPER_TASK_SECONDS, then chain
+    the next task. A retried task resumes from the last checkpoint; if
+    two tasks run the same shard, the first checkpoint wins and the other
+    task stops."""
+    shard = MapperShard.get_by_id(shard_id)
+    if not shard or shard.done:
+        return
+    job = MapperJob.get_by_id(shard.jobId)
+    model, func = MAPPERS[job.mapper]
+    query = _shardQuery(model, shard)
+
+    deadline = time.time() + MAPPER_TASK_SECONDS
+    while True:
+        cursor = Cursor(urlsafe=shard.cursor) if shard.cursor else None
+        entities, cursor, more = query.fetch_page(
+            MAPPER_BATCH_SIZE, start_cursor=cursor)
+        updated, errors, lastError = _mapBatch(func, entities)
+        chain = time.time() > deadline
+        shard = _checkpoint(shard_id, shard.batch, cursor,
+                            more and cursor is not None, len(entities),
+                            updated, errors, lastError, chain)
+        if not shard or shard.done or chain:
+            return
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+"""metrics.py
+
+Latency, error and response size metrics per API method and main.py
+handler. Each instance records its requests into in-process histograms
+with log-linear buckets, HDR style: a bucket keeps SIGNIFICANT_BITS
+significant bits of its values, so percentiles are within about 6% for
+any magnitude and a histogram stays small. Every METRICS_FLUSH_SECONDS
+the instance writes its histograms to a MetricsSnapshot and starts
+afresh. The admin metrics page merges the snapshots of a time window per
+app version and endpoint.
+
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from google.appengine.ext import ndb
+from models import MetricsSnapshot
+from settings import METRICS_FLUSH_SECONDS
+from settings import METRICS_RETENTION_DAYS
+
+
+SIGNIFICANT_BITS = 5
+# endpoints recorded per instance and flush, the others are counted as
+# OTHER so that unknown paths can't grow the histograms
+MAX_ENDPOINTS = 200
+OTHER = 'other'
+PERCENTILES = (50, 90, 99)
+
+_lock = threading.Lock()
+# endpoint -> histograms and counters recorded since the last flush
+_stats = {}
+_nextFlush = time.time() + METRICS_FLUSH_SECONDS
+
+
+def bucket(value):
+    """Return the lower bound of the bucket of a non-negative value."""
+    value = max(0, int(value))
+    shift = max(0, value.bit_length() - SIGNIFICANT_BITS)
+    return (value >> shift) << shift
+
+
+def bucketTop(lower):
+    """Return the upper bound of the bucket starting at lower."""
+    shift = max(0, lower.bit_length() - SIGNIFICANT_BITS)
+    return lower + (1 << shift) - 1
+
+
+def _newStats():
+    return {'count': 0, 'errors': 0, 'clientErrors': 0,
+            'latency': {}, 'bytes': {}}
+
+
+def _addCounts(histogram, counts):
+    for lower, count in counts.items():
+        lower = int(lower)
+        histogram[lower] = histogram.get(lower, 0) + count
+
+
+def record(endpoint, ms, status, size):
+    """Record a request to endpoint that took ms milliseconds and returned
+    status with a size byte body; flush the instance's histograms when
+    they are due."""
+    global _stats, _nextFlush
+    flushed = None
+    with _lock:
+        if endpoint not in _stats and len(_stats) >= MAX_ENDPOINTS:
+            endpoint = OTHER
+        stats = _stats.setdefault(endpoint, _newStats())
+        stats['count'] += 1
+        if status >= 500:
+            stats['errors'] += 1
+        elif status >= 400:
+            stats['clientErrors'] += 1
+        _addCounts(stats['latency'], {bucket(ms): 1})
+        _addCounts(stats['bytes'], {bucket(size): 1})
+        if time.time() >= _nextFlush:
+            flushed, _stats = _stats, {}
+            _nextFlush = time.time() + METRICS_FLUSH_SECONDS
+    if flushed:
+        _flush(flushed)
+
+
+def _flush(stats):
+    """Write the histograms of an instance to a snapshot; metrics are
+    best effort, a failed write is logged and dropped."""
+    try:
+        MetricsSnapshot(
+            version=os.environ.get('CURRENT_VERSION_ID', '').split('.')[0],
+            instance=os.environ.get('INSTANCE_ID', ''),
+            stats=stats).put()
+    except Exception:
+        logging.exception('Could not flush the metrics')
+
+
+def timedApp(app):
+    """Wrap a WSGI app, e.g. the endpoints API server, to record its
+    requests by the last segment of the path (the API method)."""
+    def timed(environ, start_response):
+        started = time.time()
+        status = [500]
+
+        def start(line, headers, exc_info=None):
+            status[0] = int(line.split(' ', 1)[0])
+            return start_response(line, headers, exc_info)
+
+        body = []
+        try:
+            result = app(environ, start)
+            try:
+                body = list(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            return body
+        finally:
+            record(environ.get('PATH_INFO', '').rsplit('/', 1)[-1],
+                   (time.time() - started) * 1000, status[0],
+                   sum(len(chunk) for chunk in body))
+    return timed
+
+
+def timedDispatcher(router, request, response):
+    """A webapp2 dispatcher recording the requests of each handler."""
+    started = time.time()
+    status, size = 500, 0
+    try:
+        rv = router.default_dispatcher(request, response)
+        result = rv if rv is not None else response
+        status, size = result.status_int, len(result.body)
+        return rv
+    except Exception as e:
+        # webapp2.abort raises exceptions carrying the status
+        status = getattr(e, 'code', 500)
+        raise
+    finally:
+        route = getattr(request, 'route', None)
+        handler = getattr(route, 'handler', None)
+        record(getattr(handler, '__name__', 'unmatched'),
+               (time.time() - started) * 1000, status, size)
+
+
+def percentile(histogram, p):
+    """Return the upper bound of the bucket holding the p-th percentile
+    of a histogram."""
+    total = sum(histogram.values())
+    seen = 0
+    for lower in sorted(histogram):
+        seen += histogram[lower]
+        if seen * 100 >= total * p:
+            return bucketTop(lower)
+    return 0
+
+
+def loadMetrics(hours):
+    """Merge the snapshots of the last hours; return a summary per
+    version, newest first, and endpoint, as a list of dicts."""
+    merged, latest = {}, {}
+    q = MetricsSnapshot.query(MetricsSnapshot.created >= (
+        datetime.utcnow() - timedelta(hours=hours)))
+    for snapshot in q.iter(batch_size=500):
+        latest[snapshot.version] = max(latest.get(snapshot.version,
+                                                  snapshot.created),
+                                       snapshot.created)
+        for endpoint, stats in snapshot.stats.items():
+            total = merged.setdefault((snapshot.version, endpoint),
+                                      _newStats())
+            for counter in ('count', 'errors', 'clientErrors'):
+                total[counter] += stats[counter]
+            _addCounts(total['latency'], stats['latency'])
+            _addCounts(total['bytes'], stats['bytes'])
+
+    versions = sorted(latest, key=latest.get, reverse=True)
+    rows = []
+    for (version, endpoint), stats in sorted(
+            merged.items(),
+            key=lambda m: (versions.index(m[0][0]), m[0][1])):
+        row = {'version': version, 'endpoint': endpoint,
+               'count': stats['count'], 'errors': stats['errors'],
+               'clientErrors': stats['clientErrors'],
+               'maxMs': bucketTop(max(stats['latency'] or [0])),
+               'maxBytes': bucketTop(max(stats['bytes'] or [0]))}
+        for p in PERCENTILES:
+            row['p%dMs' % p] = percentile(stats['latency'], p)
+            row['p%dBytes' % p] = percentile(stats['bytes'], p)
+        rows.append(row)
+    return rows
+
+
+def purgeMetrics(batch=500):
+    """Delete the snapshots older than METRICS_RETENTION_DAYS; return the
+    number deleted."""
+    q = MetricsSnapshot.query(MetricsSnapshot.created < (
+        datetime.utcnow() - timedelta(days=METRICS_RETENTION_DAYS)))
+    deleted = 0
+    while True:
+        keys = q.fetch(batch, keys_only=True)
+        ndb.delete_multi(keys)
+        deleted += len(keys)
+        if len(keys) < batch:
+            return deleted
@@ -20,11 +20,12 @@ from google.appengine.ext import ndb
 
 class Profile(ndb.Model):
     """Profile -- User profile object"""
-    displayName = ndb.StringProperty()
+    displayName = ndb.StringProperty(indexed=False)
     mainEmail = ndb.StringProperty()
-    teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED', indexed=False)
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionWishlistKeys = ndb.StringProperty(repeated=True)
+    calendarToken = ndb.StringProperty(indexed=False)
 
 # needed for conference registration
 class BooleanMessage(messages.Message):
@@ -72,15 +73,19 @@ class TeeShirtSize(messages.Enum):
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
-    description     = ndb.StringProperty()
+    description     = ndb.StringProperty(indexed=False)
     organizerUserId = ndb.StringProperty()
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
-    startDate       = ndb.DateProperty()
+    startDate       = ndb.DateProperty(indexed=False)
     month           = ndb.IntegerProperty()
-    endDate         = ndb.DateProperty()
+    endDate         = ndb.DateProperty(indexed=False)
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatsReserved   = ndb.IntegerProperty(default=0, indexed=False)
+    asyncRegistration = ndb.BooleanProperty(default=False, indexed=False)
+    modified        = ndb.DateTimeProperty(auto_now=True)
+    legacyKey       = ndb.StringProperty(indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -97,6 +102,8 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10)
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    asyncRegistration = messages.BooleanField(13)
+    requestId       = messages.StringField(14)
     
     
 class ConferenceForms(messages.Message):
@@ -129,6 +136,8 @@ class Session(ndb.Model):
     duration = ndb.IntegerProperty()
     session_type = ndb.StringProperty()
     location = ndb.StringProperty()
+    modified = ndb.DateTimeProperty(auto_now=True)
+    legacyKey = ndb.StringProperty(indexed=False)
     
 class SessionFormIn(messages.Message):
     """SessionFormIn -- Session inbound form message"""
@@ -140,6 +149,7 @@ class SessionFormIn(messages.Message):
     duration = messages.IntegerField(6)
     session_type = messages.StringField(7)
     location = messages.StringField(8)
+    requestId = messages.StringField(9)
     
 class SessionFormOut(messages.Message):
     """SessionFormOut -- Session outbound form message"""
@@ -152,6 +162,7 @@ class SessionFormOut(messages.Message):
     session_type = messages.StringField(7)
     location = messages.StringField(8)
     sessionKey = messages.StringField(9)
+    websafeConferenceKey = messages.StringField(10)
     
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
@@ -186,13 +197,273 @@ class SpeakersForm(messages.Message):
     """Session speaker list outbound message"""
     speaker = messages.StringField(1, repeated=True)
     
+class SpeakerSession(ndb.Model):
+    """SpeakerSession -- session of a speaker, copied on the Speaker with
+    the name of its conference"""
+    sessionKey = ndb.StringProperty()
+    name = ndb.StringProperty()
+    date = ndb.DateProperty()
+    start_time = ndb.IntegerProperty()
+    duration = ndb.IntegerProperty()
+    websafeConferenceKey = ndb.StringProperty()
+    conferenceName = ndb.StringProperty()
+
 class Speaker(ndb.Model):
     """Session speaker object"""
     name = ndb.StringProperty(required=True)
-    organisation = ndb.StringProperty(repeated=True)
+    organisation = ndb.StringProperty(repeated=True, indexed=False)
+    sessions = ndb.LocalStructuredProperty(SpeakerSession, repeated=True)
+    modified = ndb.DateTimeProperty(auto_now=True)
     
 class SpeakerForm(messages.Message):
     """Speaker form message"""
     name = messages.StringField(1, required=True)
     organisation = messages.StringField(2, repeated=True)
     speakerKey = messages.StringField(3)
+
+class SpeakerSessionForm(messages.Message):
+    """SpeakerSessionForm -- session of a speaker outbound form message"""
+    sessionKey = messages.StringField(1)
+    name = messages.StringField(2)
+    date = messages.StringField(3)
+    start_time = messages.StringField(4)
+    duration = messages.IntegerField(5)
+    websafeConferenceKey = messages.StringField(6)
+    conferenceName = messages.StringField(7)
+
+class SpeakerProfileForm(messages.Message):
+    """SpeakerProfileForm -- speaker with their sessions outbound message"""
+    name = messages.StringField(1)
+    organisation = messages.StringField(2, repeated=True)
+    speakerKey = messages.StringField(3)
+    sessions = messages.MessageField(SpeakerSessionForm, 4, repeated=True)
+
+class ExportJob(ndb.Model):
+    """ExportJob -- JSONL export state, checkpointed after each chunk"""
+    bucket = ndb.StringProperty(indexed=False)
+    prefix = ndb.StringProperty(indexed=False)
+    kindIndex = ndb.IntegerProperty(default=0, indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    chunk = ndb.IntegerProperty(default=0, indexed=False)
+    exported = ndb.IntegerProperty(default=0, indexed=False)
+    done = ndb.BooleanProperty(default=False, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+class RelatedSessions(ndb.Model):
+    """RelatedSessions -- top sessions wishlisted together with a session,
+    keyed by the session's websafe key"""
+    sessionKeys = ndb.StringProperty(repeated=True, indexed=False)
+    names = ndb.StringProperty(repeated=True, indexed=False)
+    counts = ndb.IntegerProperty(repeated=True, indexed=False)
+
+class RelatedSessionForm(messages.Message):
+    """RelatedSessionForm -- session wishlisted together with another one"""
+    sessionKey = messages.StringField(1)
+    name = messages.StringField(2)
+    count = messages.IntegerField(3)
+
+class RelatedSessionsForm(messages.Message):
+    """RelatedSessionsForm -- multiple RelatedSessionForm outbound message"""
+    items = messages.MessageField(RelatedSessionForm, 1, repeated=True)
+
+class CalendarFeed(ndb.Model):
+    """CalendarFeed -- cached iCalendar feed, rebuilt when its generation
+    moves past the generation it was built from"""
+    userId = ndb.StringProperty(indexed=False)
+    ics = ndb.TextProperty(compressed=True)
+    generation = ndb.IntegerProperty(default=1, indexed=False)
+    builtGeneration = ndb.IntegerProperty(default=0, indexed=False)
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- user waiting for a seat at a sold out conference,
+    keyed by conference and user so joining twice keeps the first place"""
+    websafeConferenceKey = ndb.StringProperty()
+    userId = ndb.StringProperty(indexed=False)
+    joined = ndb.DateTimeProperty(auto_now_add=True)
+
+class SeatSubscription(ndb.Model):
+    """SeatSubscription -- detail page pushed the seats of a conference,
+    keyed by its channel client id"""
+    websafeConferenceKey = ndb.StringProperty()
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class RegistrationIntent(ndb.Model):
+    """RegistrationIntent -- pending registration of a user for a conference
+    in async registration mode, keyed by conference and user"""
+    websafeConferenceKey = ndb.StringProperty(indexed=False)
+    userId = ndb.StringProperty(indexed=False)
+    status = ndb.StringProperty(default='PENDING')
+    requested = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class ConferenceSeat(ndb.Model):
+    """ConferenceSeat -- seat settled from a RegistrationIntent, child of
+    the conference and keyed by user, so a batch settled twice doesn't take
+    two seats per user"""
+
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- registration ticket status enumeration value"""
+    PENDING = 1
+    REGISTERED = 2
+    SOLD_OUT = 3
+    THROTTLED = 4
+    CANCELLED = 5
+
+class RegistrationTicketForm(messages.Message):
+    """RegistrationTicketForm -- registration ticket outbound form message"""
+    ticket = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    status = messages.EnumField('RegistrationStatus', 3)
+    retryAfter = messages.IntegerField(4)
+
+class ConferencePageForm(messages.Message):
+    """ConferencePageForm -- everything the conference page renders, in one
+    outbound message"""
+    conference = messages.MessageField(ConferenceForm, 1)
+    isAttending = messages.BooleanField(2)
+    registrationStatus = messages.EnumField('RegistrationStatus', 3)
+    onWaitlist = messages.BooleanField(4)
+    wishlistSessionKeys = messages.StringField(5, repeated=True)
+    sessions = messages.MessageField(SessionFormOut, 6, repeated=True)
+    featuredSpeaker = messages.StringField(7)
+    announcement = messages.StringField(8)
+
+class MapperJob(ndb.Model):
+    """MapperJob -- run of a registered mapper over all entities of a kind"""
+    mapper = ndb.StringProperty(indexed=False)
+    shardCount = ndb.IntegerProperty(default=0, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+class MapperShard(ndb.Model):
+    """MapperShard -- key range of a MapperJob, checkpointed after each
+    batch; a root entity, so shards don't contend on their checkpoints"""
+    jobId = ndb.IntegerProperty(indexed=False)
+    keyStart = ndb.StringProperty(indexed=False)
+    keyEnd = ndb.StringProperty(indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    batch = ndb.IntegerProperty(default=0, indexed=False)
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    updated = ndb.IntegerProperty(default=0, indexed=False)
+    errors = ndb.IntegerProperty(default=0, indexed=False)
+    lastError = ndb.TextProperty()
+    done = ndb.BooleanProperty(default=False, indexed=False)
+
+class ConferenceStats(ndb.Model):
+    """ConferenceStats -- attendee counters of a conference, a child of it
+    so registrations update it in their transaction"""
+    registrations = ndb.IntegerProperty(default=0, indexed=False)
+    teeShirtSizes = ndb.StringProperty(repeated=True, indexed=False)
+    teeShirtCounts = ndb.IntegerProperty(repeated=True, indexed=False)
+
+class TeeShirtCountForm(messages.Message):
+    """TeeShirtCountForm -- attendees of a t-shirt size outbound message"""
+    teeShirtSize = messages.EnumField('TeeShirtSize', 1)
+    count = messages.IntegerField(2)
+
+class ConferenceStatsForm(messages.Message):
+    """ConferenceStatsForm -- conference attendee statistics outbound form
+    message"""
+    websafeConferenceKey = messages.StringField(1)
+    registrations = messages.IntegerField(2)
+    teeShirtSizes = messages.MessageField(TeeShirtCountForm, 3, repeated=True)
+
+class Tombstone(ndb.Model):
+    """Tombstone -- a deleted conference or session, keyed by its websafe
+    key, so delta syncs can remove it"""
+    kind = ndb.StringProperty(indexed=False)
+    deleted = ndb.DateTimeProperty(auto_now_add=True)
+
+class ChangesForm(messages.Message):
+    """ChangesForm -- a page of the changes since a sync outbound form
+    message"""
+    conferences = messages.MessageField(ConferenceForm, 1, repeated=True)
+    sessions = messages.MessageField(SessionFormOut, 2, repeated=True)
+    speakers = messages.MessageField(SpeakerForm, 3, repeated=True)
+    deletedKeys = messages.StringField(4, repeated=True)
+    cursor = messages.StringField(5)
+    timestamp = messages.StringField(6)
+    reset = messages.BooleanField(7)
+
+class IdempotencyRecord(ndb.Model):
+    """IdempotencyRecord -- a client request ID and the response of the
+    request, None while it runs"""
+    response = ndb.TextProperty()
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+class ConferenceAlias(ndb.Model):
+    """ConferenceAlias -- the new key of a conference moved out of its
+    organizer's entity group, keyed by its old websafe key"""
+    newKey = ndb.StringProperty(indexed=False)
+    moved = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class ConferenceMove(ndb.Model):
+    """ConferenceMove -- progress of a conference being moved out of its
+    organizer's entity group, keyed by its old websafe key; a move copying
+    or deleting children, or failing, shows on the mapper admin page"""
+    newKey = ndb.StringProperty(indexed=False)
+    status = ndb.StringProperty(default='COPYING', indexed=False)
+    cleanupKey = ndb.StringProperty(indexed=False)
+    cursor = ndb.StringProperty(indexed=False)
+    batch = ndb.IntegerProperty(default=0, indexed=False)
+    copied = ndb.IntegerProperty(default=0, indexed=False)
+    errors = ndb.IntegerProperty(default=0, indexed=False)
+    lastError = ndb.TextProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+class NamePrefix(ndb.Model):
+    """NamePrefix -- the first speakers or conferences, in name order,
+    whose normalized name has a word starting with a prefix; keyed by
+    kind:prefix, truncated if more names have one"""
+    names = ndb.StringProperty(repeated=True, indexed=False)
+    keys = ndb.StringProperty(repeated=True, indexed=False)
+    truncated = ndb.BooleanProperty(default=False, indexed=False)
+
+class SuggestionForm(messages.Message):
+    """SuggestionForm -- speaker or conference matching a prefix outbound
+    form message"""
+    name = messages.StringField(1)
+    websafeKey = messages.StringField(2)
+    kind = messages.StringField(3)
+
+class SuggestionsForm(messages.Message):
+    """SuggestionsForm -- multiple SuggestionForm outbound form message"""
+    items = messages.MessageField(SuggestionForm, 1, repeated=True)
+
+class MetricsSnapshot(ndb.Model):
+    """MetricsSnapshot -- the latency and size histograms and error counts
+    per endpoint recorded by an instance between two flushes"""
+    version = ndb.StringProperty(indexed=False)
+    instance = ndb.StringProperty(indexed=False)
+    stats = ndb.JsonProperty(compressed=True)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+class ActivityEvent(ndb.Model):
+    """ActivityEvent -- activities of a kind in a conference, appended by
+    the write making them until the rollup adds them to a DailyActivity"""
+    kind = ndb.StringProperty(indexed=False)
+    count = ndb.IntegerProperty(default=1, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class DailyActivity(ndb.Model):
+    """DailyActivity -- activity counters of a conference for a day, a
+    child of it keyed by the ISO date"""
+    registrations = ndb.IntegerProperty(default=0, indexed=False)
+    cancellations = ndb.IntegerProperty(default=0, indexed=False)
+    wishlistAdds = ndb.IntegerProperty(default=0, indexed=False)
+    wishlistRemovals = ndb.IntegerProperty(default=0, indexed=False)
+    sessions = ndb.IntegerProperty(default=0, indexed=False)
+
+class DailyActivityForm(messages.Message):
+    """DailyActivityForm -- activity of a conference for a day outbound
+    form message"""
+    date = messages.StringField(1)
+    registrations = messages.IntegerField(2)
+    cancellations = messages.IntegerField(3)
+    wishlistAdds = messages.IntegerField(4)
+    wishlistRemovals = messages.IntegerField(5)
+    sessions = messages.IntegerField(6)
+
+class ConferenceTrendsForm(messages.Message):
+    """ConferenceTrendsForm -- daily activity of a conference outbound form
+    message"""
+    websafeConferenceKey = messages.StringField(1)
+    days = messages.MessageField(DailyActivityForm, 2, repeated=True)
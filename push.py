@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""push.py
+
+Live seat availability. A signed in user's conference detail page
+subscribes to the seats of its conference and gets a channel token; a
+SeatSubscription entity, keyed by the channel client id, records the
+subscription. Registrations, cancellations, waitlist promotions and
+settled async registrations mark the seats of the conference dirty
+through the coalescer, whose 'seats' window is SEATS_PUSH_SECONDS, so a
+burst of seat changes sends the subscribers a single message per window
+instead of one per change.
+
+The 'seats' recompute only pages through the subscription keys and queues
+one send task per PUSH_SEND_BATCH subscribers on the push queue, so a
+publish stays short however many pages are open. A user takes at most
+PUSH_USER_SUBSCRIPTIONS and a conference PUSH_MAX_SUBSCRIBERS
+subscriptions per token lifetime, counted in memcache; further pages keep
+the seats they loaded. A subscription expires after PUSH_TOKEN_MINUTES,
+its page gets EXPIRED_MESSAGE on the next send and subscribes again.
+
+The transport is pluggable: PUSH_CHANNEL names one of CHANNELS, the
+Firebase Realtime Database in production or LocalChannel, an in-process
+stand-in keeping the sent messages, for tests and scripts. setChannel
+installs another one.
+
+"""
+
+import base64
+import json
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from google.appengine.api import app_identity
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
+from models import SeatSubscription
+from rehome import conferenceKey
+from settings import FIREBASE_URL
+from settings import PUSH_CHANNEL
+from settings import PUSH_MAX_SUBSCRIBERS
+from settings import PUSH_SEND_BATCH
+from settings import PUSH_TOKEN_MINUTES
+from settings import PUSH_USER_SUBSCRIPTIONS
+
+PUSH_QUEUE = 'push'
+PUSH_SEND_URL = '/tasks/push_seats'
+MEMCACHE_SUBSCRIPTIONS_KEY = 'SEAT SUBSCRIPTIONS %s %d'
+EXPIRED_MESSAGE = json.dumps({'expired': True})
+FIREBASE_SCOPES = ['https://www.googleapis.com/auth/firebase.database',
+                   'https://www.googleapis.com/auth/userinfo.email']
+FIREBASE_TOKEN_AUDIENCE = ('https://identitytoolkit.googleapis.com/'
+                           'google.identity.identitytoolkit.v1'
+                           '.IdentityToolkit')
+# Firebase refuses custom tokens valid for longer; the sign-in they grant
+# lasts until the page closes
+FIREBASE_TOKEN_SECONDS = 3600
+# tasks added to a queue per call
+TASK_BATCH_SIZE = 100
+
+
+class PushError(Exception):
+    """PushError -- a message could not be written to a channel"""
+
+
+def _base64url(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+class FirebaseChannel(object):
+    """Push through the Firebase Realtime Database. A client signs in with
+    a custom token for its client id, signed by the app's service account,
+    and listens to channels/<client id>, which the database rules let only
+    that client read."""
+
+    def createToken(self, clientId, minutes):
+        account = app_identity.get_service_account_name()
+        now = int(time.time())
+        header = _base64url(json.dumps({'alg': 'RS256', 'typ': 'JWT'}))
+        claims = _base64url(json.dumps({
+            'iss': account, 'sub': account, 'aud': FIREBASE_TOKEN_AUDIENCE,
+            'iat': now, 'exp': now + FIREBASE_TOKEN_SECONDS,
+            'uid': clientId}))
+        _, signature = app_identity.sign_blob('%s.%s' % (header, claims))
+        return '%s.%s.%s' % (header, claims, _base64url(signature))
+
+    def send(self, clientId, message):
+        token, _ = app_identity.get_access_token(FIREBASE_SCOPES)
+        url = '%s/channels/%s.json' % (
+            FIREBASE_URL or 'https://%s.firebaseio.com' %
+            app_identity.get_application_id(), clientId)
+        resp = urlfetch.fetch(url, payload=message, method=urlfetch.PUT,
+                              deadline=10,
+                              headers={'Authorization': 'Bearer %s' % token})
+        if resp.status_code != 200:
+            raise PushError('Failed to send to %s: %s %s' % (
+                clientId, resp.status_code, resp.content))
+
+
+class LocalChannel(object):
+    """Keep the messages sent to each client in process, for tests."""
+
+    def __init__(self):
+        self.messages = defaultdict(list)
+
+    def createToken(self, clientId, minutes):
+        return 'local-%s' % clientId
+
+    def send(self, clientId, message):
+        self.messages[clientId].append(message)
+
+
+CHANNELS = {
+    'firebase': FirebaseChannel,
+    'local': LocalChannel,
+}
+
+_channel = CHANNELS[PUSH_CHANNEL]()
+
+
+def getChannel():
+    """Return the channel messages are pushed through."""
+    return _channel
+
+
+def setChannel(channel):
+    """Push through channel, e.g. a LocalChannel in tests."""
+    global _channel
+    _channel = channel
+
+
+def _countSubscription(scope):
+    """Count a new subscription of a conference or a user; return the
+    subscriptions taken in the current and the previous token lifetime,
+    None if memcache is unavailable."""
+    window = int(time.time()) // (PUSH_TOKEN_MINUTES * 60)
+    key = MEMCACHE_SUBSCRIPTIONS_KEY % (scope, window)
+    memcache.add(key, 0, time=2 * PUSH_TOKEN_MINUTES * 60)
+    taken = memcache.incr(key)
+    if taken is None:
+        return None
+    return taken + (memcache.get(MEMCACHE_SUBSCRIPTIONS_KEY %
+                                 (scope, window - 1)) or 0)
+
+
+def addSeatSubscription(wsck, userId):
+    """Subscribe a new client of a user to the seats of a conference;
+    return its channel token, None if the user has PUSH_USER_SUBSCRIPTIONS
+    or the conference PUSH_MAX_SUBSCRIBERS."""
+    for scope, limit in (('user:%s' % userId, PUSH_USER_SUBSCRIPTIONS),
+                         (wsck, PUSH_MAX_SUBSCRIBERS)):
+        taken = _countSubscription(scope)
+        if taken is not None and taken > limit:
+            return None
+    clientId = uuid.uuid4().hex
+    SeatSubscription(id=clientId, websafeConferenceKey=wsck).put()
+    return _channel.createToken(clientId, PUSH_TOKEN_MINUTES)
+
+
+def seatsMessage(conf, wsck):
+    """Return the message pushed for the seats of a conference."""
+    return json.dumps({'websafeConferenceKey': wsck,
+                       'seatsAvailable': conf.seatsAvailable,
+                       'maxAttendees': conf.maxAttendees})
+
+
+def publishSeats(wsck):
+    """Queue the sends of the current seats of a conference to its
+    subscribers, PUSH_SEND_BATCH subscribers per task; the 'seats'
+    recompute. The subscriptions of a deleted conference are dropped.
+    Return the number of subscribers sent to."""
+    conf = conferenceKey(wsck).get()
+    message = conf and seatsMessage(conf, wsck)
+    query = SeatSubscription.query(
+        SeatSubscription.websafeConferenceKey == wsck)
+    tasks, subscribers = [], 0
+    cursor, more = None, True
+    while more:
+        keys, cursor, more = query.fetch_page(
+            PUSH_SEND_BATCH, start_cursor=cursor, keys_only=True)
+        if not keys:
+            break
+        if not conf:
+            ndb.delete_multi(keys)
+            continue
+        subscribers += len(keys)
+        tasks.append(taskqueue.Task(
+            url=PUSH_SEND_URL,
+            params={'message': message,
+                    'client': [key.id() for key in keys]}))
+    queue = taskqueue.Queue(PUSH_QUEUE)
+    for i in range(0, len(tasks), TASK_BATCH_SIZE):
+        queue.add(tasks[i:i + TASK_BATCH_SIZE])
+    return subscribers
+
+
+def sendSeats(clientIds, message):
+    """Send a seats message to a batch of subscribers still subscribed,
+    dropping the subscriptions whose token has expired; their pages get
+    EXPIRED_MESSAGE instead. Return the number of seats messages sent."""
+    subs = filter(None, ndb.get_multi([ndb.Key(SeatSubscription, clientId)
+                                       for clientId in clientIds]))
+    expired = datetime.utcnow() - timedelta(minutes=PUSH_TOKEN_MINUTES)
+    live = [sub for sub in subs if sub.created > expired]
+    stale = [sub.key for sub in subs if sub.created <= expired]
+    for key in stale:
+        _channel.send(key.id(), EXPIRED_MESSAGE)
+    ndb.delete_multi(stale)
+    for sub in live:
+        _channel.send(sub.key.id(), message)
+    return len(live)
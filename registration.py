@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+"""registration.py
+
+Asynchronous registration for conferences in async registration mode. A
+registration request records a RegistrationIntent, which is the user's
+ticket, and adds a pull task tagged with the conference key. Settle tasks
+lease the intents of a conference in batches, in the order they were
+accepted, and take their seats in one transaction. A flash sale then
+commits to the conference entity group once per batch instead of once per
+attendee. A per-conference token bucket in memcache throttles how fast
+intents are accepted.
+
+"""
+
+import hashlib
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
+from models import ConferenceSeat
+from models import ConferenceStats
+from models import Profile
+from models import RegistrationIntent
+from rehome import conferenceKey
+from settings import REGISTRATION_RATE_PER_SECOND
+from settings import REGISTRATION_BATCH_SIZE
+from stats import statsKey, countAttendee
+from trends import recordActivity
+
+
+REGISTRATION_QUEUE = 'registration'
+SETTLE_URL = '/tasks/settle_registrations'
+APPLY_URL = '/tasks/apply_registrations'
+LEASE_SECONDS = 60
+SETTLE_DELAY_SECONDS = 1
+MEMCACHE_TOKENS_KEY = 'REGISTRATION TOKENS %s %d'
+MEMCACHE_SETTLE_KEY = 'REGISTRATION SETTLE %s %d'
+
+
+def intentKey(wsck, user_id):
+    """Return the key of a user's registration intent for a conference."""
+    return ndb.Key(RegistrationIntent, '%s:%s' % (wsck, user_id))
+
+
+def ticketKey(ticket):
+    """Return the key of the registration intent of a ticket, None if the
+    ticket is malformed."""
+    try:
+        key = ndb.Key(urlsafe=ticket)
+    except (ProtocolBufferDecodeError, TypeError, AttributeError):
+        # AttributeError: a ticket decoding to no reference at all
+        return None
+    if key.kind() != RegistrationIntent._get_kind():
+        return None
+    return key
+
+
+def _takeToken(wsck):
+    """Take a token from the bucket of a conference, which is refilled with
+    REGISTRATION_RATE_PER_SECOND tokens every second. Return False if it
+    is empty."""
+    key = MEMCACHE_TOKENS_KEY % (wsck, int(time.time()))
+    memcache.add(key, 0, time=2)
+    taken = memcache.incr(key)
+    if taken is None:
+        # memcache unavailable, the settle batches still bound the writes
+        return True
+    return taken <= REGISTRATION_RATE_PER_SECOND
+
+
+def _scheduleSettle(wsck):
+    """Add the settle task of a conference for the next second, unless
+    another request already did."""
+    slot = int(time.time())
+    key = MEMCACHE_SETTLE_KEY % (wsck, slot)
+    if not memcache.add(key, True, time=SETTLE_DELAY_SECONDS + 1):
+        return
+    try:
+        taskqueue.add(name='settle-%s-%d' % (hashlib.md5(wsck).hexdigest(),
+                                             slot),
+                      url=SETTLE_URL, params={'wsck': wsck},
+                      countdown=SETTLE_DELAY_SECONDS)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+    except taskqueue.Error:
+        # free the slot for the next request; drainRegistrations schedules
+        # the settle if no request comes
+        memcache.delete(key)
+        logging.warning('Could not schedule the settle of %s', wsck,
+                        exc_info=True)
+
+
+def recordIntent(wsck, user_id):
+    """Record the registration intent of a user and queue it for the next
+    settle task. Return the intent, or None if the token bucket of the
+    conference is empty."""
+    key = intentKey(wsck, user_id)
+    intent = key.get()
+    # already queued, keep the original place; the settle task of the
+    # first request may have been lost
+    if intent and intent.status == 'PENDING':
+        _scheduleSettle(wsck)
+        return intent
+    if not _takeToken(wsck):
+        return None
+    # the pull task first: one without a pending intent is dropped by the
+    # settle, a pending intent without one would never settle
+    taskqueue.Queue(REGISTRATION_QUEUE).add(
+        taskqueue.Task(payload=user_id, method='PULL', tag=wsck))
+    intent = RegistrationIntent(key=key, websafeConferenceKey=wsck,
+                                userId=user_id)
+    intent.put()
+    _scheduleSettle(wsck)
+    return intent
+
+
+def drainRegistrations():
+    """Schedule the settle task of each conference with pending intents,
+    for intents whose settle task was lost; the drain cron. Return the
+    number of conferences."""
+    q = RegistrationIntent.query(RegistrationIntent.status == 'PENDING')
+    drained, start = 0, None
+    while True:
+        # one key per conference: skip past its intents, keyed wsck:user
+        if start:
+            keys = q.filter(RegistrationIntent.key > start).order(
+                RegistrationIntent.key).fetch(1, keys_only=True)
+        else:
+            keys = q.order(RegistrationIntent.key).fetch(1, keys_only=True)
+        if not keys:
+            return drained
+        wsck = keys[0].id().split(':', 1)[0]
+        _scheduleSettle(wsck)
+        drained += 1
+        start = ndb.Key(RegistrationIntent, wsck + ';')
+
+
+@ndb.transactional(xg=True)
+def _settleBatch(wsck, userIds, sizes):
+    """Take the seats of a batch of users in one conference transaction,
+    count them by t-shirt size (from sizes, a dict of user id -> size) and
+    queue the update of their profiles and tickets. Return the number of
+    seats taken."""
+    c_key = conferenceKey(wsck)
+    seatKeys = [ndb.Key(ConferenceSeat, user_id, parent=c_key)
+                for user_id in userIds]
+    entities = ndb.get_multi([c_key, statsKey(c_key)] + seatKeys)
+    conf = entities[0]
+    stats = entities[1] or ConferenceStats(key=statsKey(c_key))
+    # seats taken by an earlier lease of the same intents, whose profile
+    # update is already queued
+    seated = set(seat.key.id() for seat in entities[2:] if seat)
+    userIds = [user_id for user_id in userIds if user_id not in seated]
+    if not userIds:
+        return 0
+
+    seats = max(0, conf.seatsAvailable) if conf else 0
+    registered, soldOut = userIds[:seats], userIds[seats:]
+    if registered:
+        conf.seatsAvailable -= len(registered)
+        for user_id in registered:
+            countAttendee(stats, sizes.get(user_id, 'NOT_SPECIFIED'), 1)
+        ndb.put_multi([conf, stats] +
+                      [ConferenceSeat(parent=c_key, id=user_id)
+                       for user_id in registered])
+    taskqueue.add(url=APPLY_URL, params={'wsck': wsck,
+                                         'registered': registered,
+                                         'sold_out': soldOut},
+                  transactional=True)
+    return len(registered)
+
+
+def settleRegistrations(wsck):
+    """Lease a batch of intents of a conference and settle their seats.
+    Return the number of seats taken."""
+    queue = taskqueue.Queue(REGISTRATION_QUEUE)
+    tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, REGISTRATION_BATCH_SIZE,
+                                     tag=wsck)
+    if not tasks:
+        return 0
+
+    # first come, first served; a user may have queued twice
+    userIds = []
+    for task in sorted(tasks, key=lambda t: t.eta):
+        if task.payload not in userIds:
+            userIds.append(task.payload)
+    # the tickets and the profiles (for the t-shirt sizes) in one batch
+    entities = ndb.get_multi([intentKey(wsck, user_id) for user_id in userIds]
+                             + [ndb.Key(Profile, user_id)
+                                for user_id in userIds])
+    intents, profiles = entities[:len(userIds)], entities[len(userIds):]
+    sizes = dict((prof.key.id(), prof.teeShirtSize)
+                 for prof in profiles if prof)
+    userIds = [intent.userId for intent in intents
+               if intent and intent.status == 'PENDING']
+
+    taken = _settleBatch(wsck, userIds, sizes) if userIds else 0
+    if taken:
+        recordActivity(wsck, 'registrations', taken)
+    queue.delete_tasks(tasks)
+    if len(tasks) == REGISTRATION_BATCH_SIZE:
+        # more intents may be waiting, keep draining
+        taskqueue.add(url=SETTLE_URL, params={'wsck': wsck})
+    return taken
+
+
+@ndb.transactional_tasklet(xg=True)
+def _applyRegistrationAsync(wsck, user_id):
+    """Add a conference to the profile of a user who got a seat, unless
+    they unregistered since."""
+    prof, intent, seat = yield ndb.get_multi_async([
+        ndb.Key(Profile, user_id), intentKey(wsck, user_id),
+        ndb.Key(ConferenceSeat, user_id, parent=conferenceKey(wsck))])
+    if not seat:
+        return
+    entities = []
+    if prof and wsck not in prof.conferenceKeysToAttend:
+        prof.conferenceKeysToAttend.append(wsck)
+        entities.append(prof)
+    if intent and intent.status != 'REGISTERED':
+        intent.status = 'REGISTERED'
+        entities.append(intent)
+    yield ndb.put_multi_async(entities)
+
+
+def applyRegistrations(wsck, registered, soldOut):
+    """Update the profiles and tickets of a settled batch."""
+    # one small transaction per user, all in flight together
+    futures = [_applyRegistrationAsync(wsck, user_id)
+               for user_id in registered]
+    intents = ndb.get_multi([intentKey(wsck, user_id) for user_id in soldOut])
+    intents = [intent for intent in intents
+               if intent and intent.status == 'PENDING']
+    for intent in intents:
+        intent.status = 'SOLD_OUT'
+    ndb.put_multi(intents)
+    for future in futures:
+        future.get_result()
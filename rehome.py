@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+"""rehome.py
+
+Conferences are root entities. Conferences created before that were
+children of their organizer's Profile, so all of an organizer's
+conferences and profile writes shared one entity group. The
+rehome_conferences mapper starts a move of each of them, recorded in a
+ConferenceMove and run by a chain of tasks. The children (sessions, seats,
+counters) are copied under a new root key in batches, outside any
+transaction. A small final transaction then moves the conference itself,
+catches up with the children changed meanwhile and leaves a
+ConferenceAlias behind, and the old children are deleted in batches. A
+failed step is recorded in the move, shown on /admin/mapper, and retried
+from the last checkpoint; running the mapper again resumes unfinished
+moves.
+
+A moved conference and its sessions keep their old websafe keys as their
+public keys (legacyKey), so the references stored in profiles, waitlists,
+tickets and speakers, and the keys clients hold, stay valid. Always turn a
+websafe key into a datastore key with conferenceKey or sessionKey, and an
+entity into a websafe key with websafeKey.
+
+"""
+
+import logging
+import time
+import traceback
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from models import Conference
+from models import ConferenceAlias
+from models import ConferenceMove
+from settings import MAPPER_TASK_SECONDS
+from settings import REHOME_BATCH_SIZE
+
+
+MEMCACHE_ALIAS_KEY = 'CONFERENCE ALIAS %s'
+# a conference not moved yet is looked up again after this long
+UNMOVED_SECONDS = 60
+MOVE_QUEUE = 'mapper'
+MOVE_URL = '/tasks/rehome'
+# children updated in place, not only added or deleted, so the switch to
+# the new key copies them again
+MUTABLE_KINDS = ('ConferenceStats', 'DailyActivity')
+
+# websafe key -> datastore key of the moved conferences, aliases never change
+_aliases = {}
+
+
+def _resolve(c_key):
+    """Return the datastore key of a conference key, which may have moved."""
+    if c_key.parent() is None:
+        return c_key
+    wsck = c_key.urlsafe()
+    if wsck in _aliases:
+        return _aliases[wsck]
+    moved = memcache.get(MEMCACHE_ALIAS_KEY % wsck)
+    if moved is None:
+        alias = ConferenceAlias.get_by_id(wsck)
+        moved = alias.newKey if alias else ''
+        # add, so a move setting the alias meanwhile isn't overwritten
+        memcache.add(MEMCACHE_ALIAS_KEY % wsck, moved,
+                     time=0 if moved else UNMOVED_SECONDS)
+    if not moved:
+        return c_key
+    _aliases[wsck] = ndb.Key(urlsafe=moved)
+    return _aliases[wsck]
+
+
+def conferenceKey(wsck):
+    """Return the datastore key of a conference from its websafe key."""
+    return _resolve(ndb.Key(urlsafe=wsck))
+
+
+def sessionKey(sk):
+    """Return the datastore key of a session from its websafe key."""
+    s_key = ndb.Key(urlsafe=sk)
+    c_key = _resolve(s_key.parent())
+    if c_key == s_key.parent():
+        return s_key
+    return ndb.Key(s_key.kind(), s_key.id(), parent=c_key)
+
+
+def websafeKey(entity):
+    """Return the websafe key of a conference or session."""
+    return entity.legacyKey or entity.key.urlsafe()
+
+
+def legacySessionKey(conf, s_key):
+    """Return the legacyKey of a new session of conf: a moved conference's
+    sessions are keyed under its old key, like the ones moved with it."""
+    if not conf.legacyKey:
+        return None
+    return ndb.Key(s_key.kind(), s_key.id(),
+                   parent=ndb.Key(urlsafe=conf.legacyKey)).urlsafe()
+
+
+def _movedKey(old_key, new_key, key):
+    """Return the key under new_key of an entity of the group of old_key."""
+    return ndb.Key(pairs=new_key.pairs() + key.pairs()[len(old_key.pairs()):])
+
+
+def _copies(entities, old_key, new_key):
+    """Re-key entities of the group of old_key under new_key; conferences
+    and sessions keep their old key in legacyKey."""
+    for entity in entities:
+        if hasattr(entity, 'legacyKey'):
+            entity.legacyKey = entity.key.urlsafe()
+        entity.key = _movedKey(old_key, new_key, entity.key)
+    return entities
+
+
+def _queueMove(wsck, transactional=False):
+    taskqueue.add(queue_name=MOVE_QUEUE, url=MOVE_URL, params={'wsck': wsck},
+                  transactional=transactional)
+
+
+@ndb.transactional
+def _recordMove(wsck, new_key):
+    move = ConferenceMove.get_by_id(wsck)
+    if move and move.status == 'DONE':
+        return None
+    if not move:
+        move = ConferenceMove(id=wsck, newKey=new_key.urlsafe())
+        move.put()
+    _queueMove(wsck, transactional=True)
+    return move
+
+
+def startMove(old_key):
+    """Record the move of a conference and queue its task, or queue an
+    unfinished move again; return the move, None once it is done."""
+    # ids can't be allocated in a transaction, an unused one is harmless
+    new_key = ndb.Key(Conference, Conference.allocate_ids(size=1)[0])
+    return _recordMove(old_key.urlsafe(), new_key)
+
+
+@ndb.transactional
+def _checkpoint(wsck, batch, **changes):
+    """Record a step of a move; return the move, or None if a duplicate
+    task recorded the step already."""
+    move = ConferenceMove.get_by_id(wsck)
+    if not move or move.batch != batch:
+        return None
+    move.batch += 1
+    move.populate(**changes)
+    move.put()
+    return move
+
+
+@ndb.transactional
+def _recordError(wsck, error):
+    move = ConferenceMove.get_by_id(wsck)
+    if move:
+        move.errors += 1
+        move.lastError = error
+        move.put()
+
+
+def _copyBatch(move, old_key, new_key):
+    """Copy the next batch of the children of a conference under new_key;
+    return the number copied, the cursor and whether more are left."""
+    cursor = Cursor(urlsafe=move.cursor) if move.cursor else None
+    entities, cursor, more = ndb.Query(ancestor=old_key).fetch_page(
+        REHOME_BATCH_SIZE, start_cursor=cursor)
+    children = [entity for entity in entities if entity.key != old_key]
+    ndb.put_multi(_copies(children, old_key, new_key))
+    return len(children), cursor, more and cursor is not None
+
+
+@ndb.transactional(xg=True)
+def _switchGroup(old_key, new_key):
+    """Move the conference itself, copy the children added or changed
+    since their batch was copied, drop the copies of those deleted and
+    record the alias. Return False if the conference was deleted."""
+    wsck = old_key.urlsafe()
+    if ConferenceAlias.get_by_id(wsck):
+        return True
+    conf = old_key.get()
+    if not conf:
+        return False
+    # keys only, the children themselves were copied in batches
+    oldKeys = ndb.Query(ancestor=old_key).fetch(keys_only=True)
+    newKeys = set(ndb.Query(ancestor=new_key).fetch(keys_only=True))
+    stale = [key for key in oldKeys if key != old_key and (
+        key.kind() in MUTABLE_KINDS or
+        _movedKey(old_key, new_key, key) not in newKeys)]
+    entities = [conf] + [entity for entity in ndb.get_multi(stale) if entity]
+    ndb.put_multi(_copies(entities, old_key, new_key))
+    kept = set(_movedKey(old_key, new_key, key) for key in oldKeys)
+    ndb.delete_multi([key for key in newKeys if key not in kept] + [old_key])
+    ConferenceAlias(id=wsck, newKey=new_key.urlsafe()).put()
+    return True
+
+
+def _deleteBatch(group_key):
+    """Delete a batch of an entity group; return True if more are left."""
+    keys = ndb.Query(ancestor=group_key).fetch(REHOME_BATCH_SIZE,
+                                                keys_only=True)
+    ndb.delete_multi(keys)
+    return len(keys) == REHOME_BATCH_SIZE
+
+
+def runMove(wsck):
+    """Run the steps of a conference move for up to MAPPER_TASK_SECONDS,
+    then chain the next task. A failing step is recorded in the move and
+    raised, so the task retries it from the last checkpoint."""
+    move = ConferenceMove.get_by_id(wsck)
+    if not move or move.status == 'DONE':
+        return
+    old_key, new_key = ndb.Key(urlsafe=wsck), ndb.Key(urlsafe=move.newKey)
+    deadline = time.time() + MAPPER_TASK_SECONDS
+    try:
+        while move and move.status != 'DONE':
+            if time.time() > deadline:
+                _queueMove(wsck)
+                return
+            if move.status == 'COPYING':
+                changes = {}
+                # a retry after the switch must not copy stale children
+                more = not ConferenceAlias.get_by_id(wsck)
+                if more:
+                    copied, cursor, more = _copyBatch(move, old_key, new_key)
+                    changes = {'copied': move.copied + copied,
+                               'cursor': cursor.urlsafe() if cursor else None}
+                if not more:
+                    moved = _switchGroup(old_key, new_key)
+                    if moved:
+                        memcache.set(MEMCACHE_ALIAS_KEY % wsck, move.newKey)
+                    # then delete the old children, or the copies of a
+                    # conference deleted during the move
+                    changes.update(status='CLEANUP', cursor=None,
+                                   cleanupKey=wsck if moved else move.newKey)
+            else:
+                more = _deleteBatch(ndb.Key(urlsafe=move.cleanupKey))
+                changes = {} if more else {'status': 'DONE'}
+            move = _checkpoint(wsck, move.batch, **changes)
+    except Exception:
+        logging.exception('Moving conference %s failed', wsck)
+        _recordError(wsck, traceback.format_exc()[-2000:])
+        raise
+
+
+def rehomeConference(conf):
+    """Start moving a conference still in its organizer's entity group, or
+    queue its unfinished move again; a map function."""
+    if conf.key.parent() is not None:
+        startMove(conf.key)
+    return False
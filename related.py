@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""related.py
+
+"Also wishlisted" session recommendations. For each session a
+RelatedSessions entity keeps the top RELATED_TOP_K sessions of the same
+conference found in the same wishlists. A nightly mapper queues a task per
+conference that rebuilds the exact entries of its sessions from the
+wishlists holding them; between rebuilds, wishlist changes update them
+incrementally, one transaction per entry, with the space-saving rule (a
+new neighbour replaces the least counted one when the list is full).
+
+"""
+
+import itertools
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from models import Profile
+from models import RelatedSessions
+from models import Session
+from rehome import conferenceKey, sessionKey, websafeKey
+
+
+RELATED_TOP_K = 10
+REBUILD_BATCH_SIZE = 500
+RELATED_UPDATE_URL = '/tasks/related_sessions'
+RELATED_REBUILD_URL = '/tasks/rebuild_related_sessions'
+
+
+def _neighbours(related):
+    """Return the neighbours of a RelatedSessions as a dict."""
+    return dict((sk, [name, count]) for sk, name, count in
+                zip(related.sessionKeys, related.names, related.counts))
+
+
+def _setNeighbours(related, neighbours):
+    """Store the top RELATED_TOP_K neighbours on a RelatedSessions."""
+    top = sorted(neighbours.items(), key=lambda n: -n[1][1])[:RELATED_TOP_K]
+    related.sessionKeys = [sk for sk, (name, count) in top]
+    related.names = [name for sk, (name, count) in top]
+    related.counts = [count for sk, (name, count) in top]
+
+
+def _addNeighbour(neighbours, sk, name, delta):
+    """Apply a co-occurrence change to a neighbour dict."""
+    if sk in neighbours:
+        neighbours[sk][1] += delta
+        if neighbours[sk][1] <= 0:
+            del neighbours[sk]
+    elif delta > 0:
+        if len(neighbours) < RELATED_TOP_K:
+            neighbours[sk] = [name, delta]
+        else:
+            # space-saving: replace the least counted neighbour
+            least = min(neighbours, key=lambda n: neighbours[n][1])
+            neighbours[sk] = [name, neighbours.pop(least)[1] + delta]
+
+
+def queueRelatedUpdate(sk, otherKeys, delta):
+    """Queue the update of the related sessions of sk and otherKeys, the
+    other sessions of the same conference in the wishlist."""
+    if otherKeys:
+        taskqueue.add(url=RELATED_UPDATE_URL,
+                      params={'sk': sk, 'other': otherKeys, 'delta': delta})
+
+
+@ndb.transactional_tasklet
+def _updateNeighboursAsync(r_key, changes, delta):
+    """Add delta to the co-occurrences of a session with others, given as
+    (websafe key, name) pairs."""
+    related = yield r_key.get_async()
+    related = related or RelatedSessions(key=r_key)
+    neighbours = _neighbours(related)
+    for b, name in changes:
+        _addNeighbour(neighbours, b, name, delta)
+    _setNeighbours(related, neighbours)
+    yield related.put_async()
+
+
+def updateRelatedSessions(sk, otherKeys, delta):
+    """Add delta to the co-occurrences of sk with each of otherKeys."""
+    sessionKeys = [sk] + otherKeys
+    sessions = ndb.get_multi([sessionKey(k) for k in sessionKeys])
+    names = dict((k, s.name) for k, s in zip(sessionKeys, sessions) if s)
+    others = [other for other in otherKeys if other in names]
+    if sk not in names or not others:
+        return
+
+    # one small transaction per entry, all in flight together, so
+    # concurrent wishlist tasks don't overwrite each other's counts
+    futures = [_updateNeighboursAsync(
+        ndb.Key(RelatedSessions, sk),
+        [(other, names[other]) for other in others], delta)]
+    futures.extend(_updateNeighboursAsync(
+        ndb.Key(RelatedSessions, other), [(sk, names[sk])], delta)
+        for other in others)
+    for future in futures:
+        future.get_result()
+
+
+def queueRelatedRebuild(conf):
+    """Queue the rebuild of the related sessions of a conference; a map
+    function."""
+    taskqueue.add(url=RELATED_REBUILD_URL, params={'wsck': websafeKey(conf)})
+    return False
+
+
+def rebuildRelatedSessions(wsck):
+    """Rebuild the related sessions of a conference from the wishlists of
+    its sessions."""
+    sessions = Session.query(ancestor=conferenceKey(wsck)).fetch()
+    names = dict((websafeKey(s), s.name) for s in sessions)
+
+    # sparse co-occurrence counts; a profile wishlisting several sessions
+    # of the conference is found by each of them but counted once
+    counts = dict((sk, {}) for sk in names)
+    seen = set()
+    for sk in names:
+        q = Profile.query(Profile.sessionWishlistKeys == sk)
+        for prof in q.iter(batch_size=REBUILD_BATCH_SIZE):
+            if prof.key in seen:
+                continue
+            seen.add(prof.key)
+            wishlisted = [k for k in prof.sessionWishlistKeys if k in names]
+            for a, b in itertools.permutations(wishlisted, 2):
+                counts[a][b] = counts[a].get(b, 0) + 1
+
+    # keep the top K per session; drop the entries of sessions nobody
+    # wishlists with another one anymore
+    entities, stale = [], []
+    for sk, row in counts.items():
+        key = ndb.Key(RelatedSessions, sk)
+        if not row:
+            stale.append(key)
+            continue
+        top = sorted(row.items(), key=lambda n: -n[1])[:RELATED_TOP_K]
+        entities.append(RelatedSessions(
+            key=key, sessionKeys=[b for b, c in top],
+            names=[names[b] for b, c in top], counts=[c for b, c in top]))
+    for i in range(0, len(entities), REBUILD_BATCH_SIZE):
+        ndb.put_multi(entities[i:i + REBUILD_BATCH_SIZE])
+    for i in range(0, len(stale), REBUILD_BATCH_SIZE):
+        ndb.delete_multi(stale[i:i + REBUILD_BATCH_SIZE])
@@ -14,3 +14,103 @@ created/forked from conference.py by wesc on 2014 may 24
 # Console or Cloud Console.
 WEB_CLIENT_ID = '597213165378-jbk7ub7i21j82urjnkfmgegbm4ujhg48.apps.googleusercontent.com'
 
+# Confirmation emails are sent from a pull queue by a cron job running every
+# minute; at most MAIL_RATE_PER_MINUTE emails are sent per minute and a
+# failed email is retried MAIL_MAX_RETRIES times with exponential backoff.
+MAIL_RATE_PER_MINUTE = 60
+MAIL_MAX_RETRIES = 5
+
+# Exports are written to this Cloud Storage bucket, None for the app's
+# default bucket, in chunks of EXPORT_BATCH_SIZE entities.
+EXPORT_BUCKET = None
+EXPORT_BATCH_SIZE = 500
+
+# Conferences in async registration mode accept at most
+# REGISTRATION_RATE_PER_SECOND registration requests per second and settle
+# them in batches of REGISTRATION_BATCH_SIZE seats per transaction.
+REGISTRATION_RATE_PER_SECOND = 100
+REGISTRATION_BATCH_SIZE = 200
+
+# Deleted conferences and sessions are cleaned up by chained tasks, each
+# handling DELETE_BATCH_SIZE entities.
+DELETE_BATCH_SIZE = 100
+
+# Mapper jobs split a kind into at most MAPPER_SHARDS key ranges. A shard
+# task maps batches of MAPPER_BATCH_SIZE entities for up to
+# MAPPER_TASK_SECONDS, then chains the next task.
+MAPPER_SHARDS = 16
+MAPPER_BATCH_SIZE = 200
+MAPPER_TASK_SECONDS = 60
+
+# A conference moved out of its organizer's entity group has its children
+# copied, then deleted, REHOME_BATCH_SIZE at a time.
+REHOME_BATCH_SIZE = 200
+
+# Derived values are cached in process for CACHE_LOCAL_SECONDS, and served
+# from memcache for up to CACHE_STALE_SECONDS past their ttl while one
+# request recomputes them. The announcement and featured speakers are
+# recomputed when they change and at the latest after their ttl.
+CACHE_LOCAL_SECONDS = 5
+CACHE_STALE_SECONDS = 24 * 3600
+ANNOUNCEMENT_CACHE_SECONDS = 3600
+FEATURED_SPEAKER_CACHE_SECONDS = 3600
+
+# getChanges returns pages of CHANGES_PAGE_SIZE entities, and stops
+# CHANGES_SKEW_SECONDS before the current time so that no recent write is
+# skipped. Deletions are kept for CHANGES_TOMBSTONE_DAYS; a client that
+# last synced before that gets everything again.
+CHANGES_PAGE_SIZE = 200
+CHANGES_SKEW_SECONDS = 10
+CHANGES_TOMBSTONE_DAYS = 30
+
+# A requestId sent to createConference, createSession or
+# registerForConference is remembered for IDEMPOTENCY_WINDOW_HOURS. A
+# request still running after IDEMPOTENCY_PENDING_SECONDS is assumed dead
+# and its ID may be claimed again.
+IDEMPOTENCY_WINDOW_HOURS = 24
+IDEMPOTENCY_PENDING_SECONDS = 60
+
+# A warmup request fills the caches of the WARMUP_CONFERENCES conferences
+# changed last and reads up to WARMUP_SPEAKERS of their speakers.
+WARMUP_CONFERENCES = 20
+WARMUP_SPEAKERS = 100
+
+# Speaker and conference names are indexed by word prefixes of up to
+# SUGGEST_PREFIX_LENGTH characters. A prefix returns up to SUGGEST_ENTRIES
+# names and keeps up to SUGGEST_STORED_ENTRIES, so names removed from it
+# are replaced by the next ones and longer queries have more to filter.
+# Prefixes of up to SUGGEST_HOT_LENGTH characters, read on the first
+# keystrokes of every search, are also kept in process for
+# SUGGEST_HOT_SECONDS.
+SUGGEST_PREFIX_LENGTH = 10
+SUGGEST_ENTRIES = 20
+SUGGEST_STORED_ENTRIES = 100
+SUGGEST_HOT_LENGTH = 2
+SUGGEST_HOT_SECONDS = 60
+
+# Each instance flushes its request metrics every METRICS_FLUSH_SECONDS;
+# the flushed snapshots are kept for METRICS_RETENTION_DAYS.
+METRICS_FLUSH_SECONDS = 300
+METRICS_RETENTION_DAYS = 14
+
+# Activity events of a conference are spread over ACTIVITY_SHARDS entity
+# groups. getConferenceTrends returns TRENDS_DEFAULT_DAYS days unless asked
+# for a range, of at most TRENDS_MAX_DAYS days.
+ACTIVITY_SHARDS = 10
+TRENDS_DEFAULT_DAYS = 30
+TRENDS_MAX_DAYS = 366
+
+# Conference detail pages get the seats of their conference pushed through
+# PUSH_CHANNEL ('firebase' or 'local', the in-process stand-in for tests),
+# at most once per SEATS_PUSH_SECONDS. The Firebase channel writes to the
+# Realtime Database at FIREBASE_URL, None for the app's default database.
+# A subscription lasts PUSH_TOKEN_MINUTES. A push task sends to
+# PUSH_SEND_BATCH subscribers; a user takes at most PUSH_USER_SUBSCRIPTIONS
+# and a conference PUSH_MAX_SUBSCRIBERS subscriptions per lifetime.
+PUSH_CHANNEL = 'firebase'
+FIREBASE_URL = None
+SEATS_PUSH_SECONDS = 1
+PUSH_TOKEN_MINUTES = 120
+PUSH_SEND_BATCH = 100
+PUSH_USER_SUBSCRIPTIONS = 20
+PUSH_MAX_SUBSCRIBERS = 5000
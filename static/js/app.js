@@ -76,6 +76,22 @@ app.constant('HTTP_ERRORS', {
 });
 
 
+/**
+ * @ngdoc constant
+ * @name FIREBASE_CONFIG
+ *
+ * @description
+ * The web configuration of the Firebase project the seats are pushed through, from the Firebase console.
+ * Live seats stay off while apiKey is empty.
+ *
+ */
+app.constant('FIREBASE_CONFIG', {
+    apiKey: '',
+    authDomain: 'scalable-conf.firebaseapp.com',
+    databaseURL: 'https://scalable-conf.firebaseio.com'
+});
+
+
 /**
  * @ngdoc service
  * @name oauth2Provider
@@ -130,3 +146,155 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+
+/**
+ * @ngdoc service
+ * @name syncCache
+ *
+ * @description
+ * Keeps the conferences, sessions and speakers in localStorage and brings them up to date with the
+ * changes returned by conference.getChanges, so a returning visitor only downloads what changed.
+ *
+ */
+app.factory('syncCache', function ($log) {
+    var STORAGE_KEY = 'conferenceSync';
+
+    var empty = function () {
+        return {timestamp: null, conferences: {}, sessions: {}, speakers: {}};
+    };
+
+    var load = function () {
+        try {
+            return angular.fromJson(window.localStorage.getItem(STORAGE_KEY)) || empty();
+        } catch (e) {
+            return empty();
+        }
+    };
+
+    var syncCache = {
+        data: load()
+    };
+
+    /**
+     * Callbacks waiting for the sync in progress, null when none is.
+     */
+    var waiting = null;
+
+    var save = function () {
+        try {
+            window.localStorage.setItem(STORAGE_KEY, angular.toJson(syncCache.data));
+        } catch (e) {
+            $log.warn('Failed to store the conferences : ' + e);
+        }
+    };
+
+    /**
+     * Applies a page of changes to the cached data.
+     */
+    var merge = function (changes) {
+        var data = syncCache.data;
+        angular.forEach(changes.conferences || [], function (conference) {
+            data.conferences[conference.websafeKey] = conference;
+        });
+        angular.forEach(changes.sessions || [], function (session) {
+            data.sessions[session.sessionKey] = session;
+        });
+        angular.forEach(changes.speakers || [], function (speaker) {
+            data.speakers[speaker.speakerKey] = speaker;
+        });
+        angular.forEach(changes.deletedKeys || [], function (key) {
+            delete data.conferences[key];
+            delete data.sessions[key];
+            // the sessions of a deleted conference go with it
+            angular.forEach(data.sessions, function (session, sessionKey) {
+                if (session.websafeConferenceKey == key) {
+                    delete data.sessions[sessionKey];
+                }
+            });
+        });
+    };
+
+    var done = function (error) {
+        var callbacks = waiting;
+        waiting = null;
+        angular.forEach(callbacks, function (callback) {
+            callback(error);
+        });
+    };
+
+    /**
+     * Fetches the changes since the last sync, page by page, and stores them. The callback is invoked with
+     * the error, if any, once the cache is up to date.
+     */
+    syncCache.sync = function (callback) {
+        if (waiting) {
+            waiting.push(callback);
+            return;
+        }
+        waiting = [callback];
+        var since = syncCache.data.timestamp;
+        var fetchPage = function (cursor) {
+            var params = {};
+            if (since) {
+                params.since = since;
+            }
+            if (cursor) {
+                params.cursor = cursor;
+            }
+            gapi.client.conference.getChanges(params).execute(function (resp) {
+                if (resp.error) {
+                    $log.error('Failed to get the changes : ' + (resp.error.message || ''));
+                    done(resp.error);
+                    return;
+                }
+                if (resp.reset && !cursor) {
+                    // the changes are too old, everything is sent again
+                    syncCache.data = empty();
+                }
+                merge(resp);
+                if (resp.cursor) {
+                    fetchPage(resp.cursor);
+                    return;
+                }
+                syncCache.data.timestamp = resp.timestamp;
+                save();
+                done(null);
+            });
+        };
+        fetchPage(null);
+    };
+
+    /**
+     * Returns the cached conferences sorted by name.
+     */
+    syncCache.conferences = function () {
+        var conferences = [];
+        angular.forEach(syncCache.data.conferences, function (conference) {
+            conferences.push(conference);
+        });
+        conferences.sort(function (a, b) {
+            return a.name < b.name ? -1 : a.name > b.name ? 1 : 0;
+        });
+        return conferences;
+    };
+
+    /**
+     * Returns the cached sessions of a conference sorted by date and start time.
+     */
+    syncCache.sessionsOf = function (websafeConferenceKey) {
+        var sessions = [];
+        angular.forEach(syncCache.data.sessions, function (session) {
+            if (session.websafeConferenceKey == websafeConferenceKey) {
+                sessions.push(session);
+            }
+        });
+        sessions.sort(function (a, b) {
+            var x = [a.date, Number(a.start_time)], y = [b.date, Number(b.start_time)];
+            return x[0] < y[0] ? -1 : x[0] > y[0] ? 1 : x[1] - y[1];
+        });
+        return sessions;
+    };
+
+    return syncCache;
+});
@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, syncCache, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -424,7 +424,32 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Shows all the conferences from the local cache, then brings the cache up to date with
+     * the conference.getChanges API.
+     */
+    $scope.syncConferences = function () {
+        $scope.conferences = syncCache.conferences();
+        $scope.loading = true;
+        syncCache.sync(function (error) {
+            $scope.$apply(function () {
+                $scope.loading = false;
+                if (error) {
+                    // The request has failed.
+                    $scope.messages = 'Failed to update the conferences : ' + (error.message || '');
+                    $scope.alertStatus = 'warning';
+                } else {
+                    // The request has succeeded.
+                    $scope.messages = 'Query succeeded : All conferences';
+                    $scope.alertStatus = 'success';
+                    $scope.conferences = syncCache.conferences();
+                }
+                $scope.submitted = true;
+            });
+        });
+    };
+
+    /**
+     * Invokes the conference.queryConferences API, or shows the cached conferences when there are no filters.
      */
     $scope.queryConferencesAll = function () {
         var sendFilters = {
@@ -440,6 +465,10 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                 });
             }
         }
+        if (!sendFilters.filters.length) {
+            $scope.syncConferences();
+            return;
+        }
         $scope.loading = true;
         gapi.client.conference.queryConferences(sendFilters).
             execute(function (resp) {
@@ -547,19 +576,25 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
-    $scope.conference = {};
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, $timeout, syncCache, HTTP_ERRORS, FIREBASE_CONFIG) {
+    // render the cached conference and schedule until the page arrives
+    $scope.conference = syncCache.data.conferences[$routeParams.websafeConferenceKey] || {};
 
     $scope.isUserAttending = false;
 
+    $scope.sessions = syncCache.sessionsOf($routeParams.websafeConferenceKey);
+
+    $scope.wishlistSessionKeys = [];
+
     /**
      * Initializes the conference detail page.
-     * Invokes the conference.getConference method and sets the returned conference in the $scope.
+     * Invokes the conference.getConferencePage method, which returns the conference, the user's registration
+     * and wishlist state, the sessions, the featured speaker and the announcement in one call.
      *
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        gapi.client.conference.getConferencePage({
             websafeConferenceKey: $routeParams.websafeConferenceKey
         }).execute(function (resp) {
             $scope.$apply(function () {
@@ -567,45 +602,106 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                 if (resp.error) {
                     // The request has failed.
                     var errorMessage = resp.error.message || '';
-                    $scope.messages = 'Failed to get the conference : ' + $routeParams.websafeKey
+                    $scope.messages = 'Failed to get the conference : ' + $routeParams.websafeConferenceKey
                         + ' ' + errorMessage;
                     $scope.alertStatus = 'warning';
                     $log.error($scope.messages);
                 } else {
                     // The request has succeeded.
+                    var page = resp.result;
                     $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
+                    $scope.conference = page.conference;
+                    $scope.sessions = page.sessions || [];
+                    $scope.wishlistSessionKeys = page.wishlistSessionKeys || [];
+                    $scope.featuredSpeaker = page.featuredSpeaker;
+                    $scope.announcement = page.announcement;
+                    if (page.isAttending) {
+                        // The user is attending the conference.
+                        $scope.alertStatus = 'info';
+                        $scope.messages = 'You are attending this conference';
+                        $scope.isUserAttending = true;
+                    } else if (page.onWaitlist) {
+                        $scope.alertStatus = 'info';
+                        $scope.messages = 'You are on the waitlist for this conference';
+                    }
+                    $scope.subscribeSeats();
                 }
             });
         });
+    };
 
-        $scope.loading = true;
-        // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
-            $scope.$apply(function () {
-                $scope.loading = false;
-                if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
-                            // The user is attending the conference.
-                            $scope.alertStatus = 'info';
-                            $scope.messages = 'You are attending this conference';
-                            $scope.isUserAttending = true;
-                        }
-                    }
+    /**
+     * Invokes the conference.subscribeSeats method, signs in to Firebase with the returned token and listens to
+     * the channel of the page, which gets the seats available of the conference as they change.
+     */
+    $scope.subscribeSeats = function () {
+        if ($scope.channel || !window.firebase || !FIREBASE_CONFIG.apiKey) {
+            return;
+        }
+        gapi.client.conference.subscribeSeats({
+            websafeConferenceKey: $routeParams.websafeConferenceKey
+        }).execute(function (resp) {
+            if (resp.error) {
+                $log.error('Failed to subscribe to the seats : ' + (resp.error.message || ''));
+                return;
+            }
+            if ($scope.closed) {
+                return;
+            }
+            if (!firebase.apps.length) {
+                firebase.initializeApp(FIREBASE_CONFIG);
+            }
+            firebase.auth().signInWithCustomToken(resp.result.data).then(function (credential) {
+                if ($scope.closed) {
+                    return;
                 }
+                $scope.channel = firebase.database().ref('channels/' + credential.user.uid);
+                $scope.channel.on('value', function (snapshot) {
+                    var seats = snapshot.val();
+                    if (!seats) {
+                        return;
+                    }
+                    // the subscription expired, subscribe again
+                    if (seats.expired) {
+                        $scope.channel.off();
+                        $scope.channel = null;
+                        $scope.subscribeSeats();
+                        return;
+                    }
+                    $scope.$apply(function () {
+                        $scope.conference.seatsAvailable = seats.seatsAvailable;
+                        $scope.conference.maxAttendees = seats.maxAttendees;
+                    });
+                });
+            }, function (error) {
+                $log.error('Failed to open the seats channel : ' + error.message);
             });
         });
     };
 
+    $scope.$on('$destroy', function () {
+        $scope.closed = true;
+        if ($scope.channel) {
+            $scope.channel.off();
+        }
+    });
+
+    /**
+     * Returns true if the session is in the user's wishlist.
+     */
+    $scope.isInWishlist = function (session) {
+        return $scope.wishlistSessionKeys.indexOf(session.sessionKey) >= 0;
+    };
+
 
     /**
      * Invokes the conference.registerForConference method.
      */
     $scope.registerForConference = function () {
+        if ($scope.conference.asyncRegistration) {
+            $scope.requestRegistration();
+            return;
+        }
         $scope.loading = true;
         gapi.client.conference.registerForConference({
             websafeConferenceKey: $routeParams.websafeConferenceKey
@@ -639,6 +735,102 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
         });
     };
 
+    /**
+     * Updates the page from a registration ticket, polling
+     * conference.getRegistrationStatus until it is settled.
+     */
+    var settleTicket = function (ticket) {
+        if (ticket.status == 'REGISTERED') {
+            $scope.loading = false;
+            $scope.messages = 'Registered for the conference';
+            $scope.alertStatus = 'success';
+            $scope.isUserAttending = true;
+            $scope.conference.seatsAvailable = $scope.conference.seatsAvailable - 1;
+        } else if (ticket.status == 'SOLD_OUT') {
+            $scope.loading = false;
+            $scope.messages = 'There are no seats left, join the waitlist';
+            $scope.alertStatus = 'warning';
+            $scope.conference.seatsAvailable = 0;
+        } else if (ticket.status == 'THROTTLED') {
+            // too many requests right now, try again
+            $timeout($scope.requestRegistration, 1000 * (ticket.retryAfter || 1));
+        } else {
+            $scope.messages = 'Your registration is being processed';
+            $scope.alertStatus = 'info';
+            $timeout(function () {
+                gapi.client.conference.getRegistrationStatus({
+                    ticket: ticket.ticket
+                }).execute(function (resp) {
+                    $scope.$apply(function () {
+                        if (resp.error) {
+                            $scope.loading = false;
+                            $scope.messages = 'Failed to register for the conference : ' + (resp.error.message || '');
+                            $scope.alertStatus = 'warning';
+                            $log.error($scope.messages);
+                        } else {
+                            settleTicket(resp.result);
+                        }
+                    });
+                });
+            }, 1000);
+        }
+    };
+
+    /**
+     * Invokes the conference.requestRegistration method, for conferences in
+     * async registration mode.
+     */
+    $scope.requestRegistration = function () {
+        $scope.loading = true;
+        gapi.client.conference.requestRegistration({
+            websafeConferenceKey: $routeParams.websafeConferenceKey
+        }).execute(function (resp) {
+            $scope.$apply(function () {
+                if (resp.error) {
+                    // The request has failed.
+                    $scope.loading = false;
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to register for the conference : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages);
+                } else {
+                    settleTicket(resp.result);
+                }
+            });
+        });
+    };
+
+    /**
+     * Invokes the conference.joinWaitlist method.
+     */
+    $scope.joinWaitlist = function () {
+        $scope.loading = true;
+        gapi.client.conference.joinWaitlist({
+            websafeConferenceKey: $routeParams.websafeConferenceKey
+        }).execute(function (resp) {
+            $scope.$apply(function () {
+                $scope.loading = false;
+                if (resp.error) {
+                    // The request has failed.
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to join the waitlist : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages);
+
+                    if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                        oauth2Provider.showLoginModal();
+                        return;
+                    }
+                } else {
+                    // Joined the waitlist, the user is emailed when a seat frees up.
+                    $scope.messages = 'You are on the waitlist, we will email you when you get a seat';
+                    $scope.alertStatus = 'info';
+                    $log.info($scope.messages);
+                }
+            });
+        });
+    };
+
     /**
      * Invokes the conference.unregisterForConference method.
      */
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""stats.py
+
+Per-conference attendee counters. A ConferenceStats entity is a child of
+its conference, so the registration transactions update it along with the
+seats, and getConferenceStats serves it with a single get.
+
+"""
+
+from google.appengine.ext import ndb
+from models import ConferenceStats
+from models import Profile
+from rehome import conferenceKey, websafeKey
+
+
+STATS_ID = 'stats'
+
+
+def statsKey(c_key):
+    """Return the key of the ConferenceStats of a conference."""
+    return ndb.Key(ConferenceStats, STATS_ID, parent=c_key)
+
+
+def countAttendee(stats, teeShirtSize, delta):
+    """Add delta registrations of an attendee of a t-shirt size."""
+    stats.registrations += delta
+    if teeShirtSize in stats.teeShirtSizes:
+        i = stats.teeShirtSizes.index(teeShirtSize)
+        stats.teeShirtCounts[i] += delta
+    else:
+        stats.teeShirtSizes.append(teeShirtSize)
+        stats.teeShirtCounts.append(delta)
+
+
+@ndb.transactional(xg=True)
+def _moveAttendeeSize(p_key, statsKeys, teeShirtSize):
+    """Set the t-shirt size of a profile and move it between the counters
+    of statsKeys, all in one transaction. Return the previous size, None
+    if it didn't change."""
+    entities = ndb.get_multi([p_key] + statsKeys)
+    prof = entities[0]
+    old = prof.teeShirtSize
+    if old == teeShirtSize:
+        return None
+    prof.teeShirtSize = teeShirtSize
+    changed = [prof]
+    for stats in entities[1:]:
+        if stats:
+            countAttendee(stats, old, -1)
+            countAttendee(stats, teeShirtSize, 1)
+            changed.append(stats)
+    ndb.put_multi(changed)
+    return old
+
+
+def changeTeeShirtSize(prof, teeShirtSize):
+    """Change the t-shirt size of a profile and adjust the counters of the
+    conferences it attends. A transaction holds at most 25 entity groups,
+    so the counters of a profile attending more conferences are moved in
+    several transactions."""
+    statsKeys = [statsKey(conferenceKey(wsck))
+                 for wsck in prof.conferenceKeysToAttend]
+    first, rest = statsKeys[:24], statsKeys[24:]
+    old = _moveAttendeeSize(prof.key, first, teeShirtSize)
+    if old is not None:
+        for i in range(0, len(rest), 25):
+            _moveCounters(rest[i:i + 25], old, teeShirtSize)
+    prof.teeShirtSize = teeShirtSize
+
+
+@ndb.transactional(xg=True)
+def _moveCounters(statsKeys, old, new):
+    """Move one attendee between two t-shirt sizes in statsKeys."""
+    changed = []
+    for stats in ndb.get_multi(statsKeys):
+        if stats:
+            countAttendee(stats, old, -1)
+            countAttendee(stats, new, 1)
+            changed.append(stats)
+    ndb.put_multi(changed)
+
+
+def rebuildStats(conf):
+    """Recount the attendees of a conference; a map function."""
+    stats = ConferenceStats(key=statsKey(conf.key))
+    query = Profile.query(
+        Profile.conferenceKeysToAttend == websafeKey(conf))
+    for prof in query.iter(batch_size=500):
+        countAttendee(stats, prof.teeShirtSize, 1)
+    stats.put()
+    return False
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""suggest.py
+
+Name autocomplete for speakers and conferences. Names are normalized
+(accents and punctuation dropped, lower case) and indexed by the prefixes,
+up to SUGGEST_PREFIX_LENGTH characters, of the name from each word on. A
+NamePrefix entity per kind and prefix keeps the first
+SUGGEST_STORED_ENTRIES names in name order, so a suggestion is a single
+get whatever the number of names. A suggestion returns the first
+SUGGEST_ENTRIES; the others replace names renamed or deleted, and longer
+queries read the longest prefix and filter it. A prefix with names left
+out that drops below SUGGEST_ENTRIES is refilled from the speakers or
+conferences.
+
+Creating, renaming and deleting a speaker or conference queues a task
+updating its prefixes. The prefixes of up to SUGGEST_HOT_LENGTH
+characters, read by every search, are kept in process.
+
+"""
+
+import re
+import time
+import unicodedata
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from models import Conference
+from models import NamePrefix
+from models import Speaker
+from rehome import websafeKey
+from settings import SUGGEST_ENTRIES
+from settings import SUGGEST_HOT_LENGTH
+from settings import SUGGEST_HOT_SECONDS
+from settings import SUGGEST_PREFIX_LENGTH
+from settings import SUGGEST_STORED_ENTRIES
+
+
+SUGGEST_URL = '/tasks/suggest'
+KINDS = ('speaker', 'conference')
+MODELS = {'speaker': Speaker, 'conference': Conference}
+# the in-process prefixes are dropped when they grow past this many keys
+HOT_MAX_KEYS = 5000
+
+# NamePrefix id -> (names, keys, expires)
+_hot = {}
+
+
+def normalize(name):
+    """Return a name lower cased, without accents and punctuation."""
+    name = unicodedata.normalize('NFKD', unicode(name))
+    name = u''.join(c for c in name if not unicodedata.combining(c))
+    return u' '.join(w for w in re.split(r'\W+', name.lower(), flags=re.U)
+                     if w)
+
+
+def prefixes(name):
+    """Return the indexed prefixes of a name."""
+    words = normalize(name or '').split(' ')
+    found = set()
+    for i in range(len(words)):
+        rest = u' '.join(words[i:])[:SUGGEST_PREFIX_LENGTH]
+        found.update(rest[:n] for n in range(1, len(rest) + 1)
+                     if not rest[:n].endswith(' '))
+    return found
+
+
+def _matches(name, query):
+    """Return True if a word of name starts the query."""
+    words = normalize(name).split(' ')
+    return any(u' '.join(words[i:]).startswith(query)
+               for i in range(len(words)))
+
+
+def _prefixId(kind, prefix):
+    return u'%s:%s' % (kind, prefix)
+
+
+def queueSuggestionUpdate(kind, key, name=None, oldName=None,
+                          transactional=False):
+    """Queue the update of the prefixes of a speaker or conference (kind)
+    with the websafe key key, named name (None once deleted), formerly
+    oldName."""
+    params = {'kind': kind, 'key': key}
+    if name:
+        params['name'] = name.encode('utf-8')
+    if oldName:
+        params['old_name'] = oldName.encode('utf-8')
+    taskqueue.add(url=SUGGEST_URL, params=params, transactional=transactional)
+
+
+def _store(entry, entries, truncated=False):
+    """Set the names of a prefix to the first SUGGEST_STORED_ENTRIES of
+    entries, (name, key) pairs."""
+    entries = sorted(entries, key=lambda e: normalize(e[0]))
+    entry.truncated = truncated or len(entries) > SUGGEST_STORED_ENTRIES
+    entries = entries[:SUGGEST_STORED_ENTRIES]
+    entry.names = [n for n, k in entries]
+    entry.keys = [k for n, k in entries]
+
+
+@ndb.transactional_tasklet
+def _updatePrefixAsync(p_key, key, name):
+    """Drop key from a prefix, then add it under name unless name is
+    None."""
+    entry = yield p_key.get_async()
+    entry = entry or NamePrefix(key=p_key)
+    entries = [(n, k) for n, k in zip(entry.names, entry.keys) if k != key]
+    if name:
+        entries.append((name, key))
+    if entries or entry.truncated:
+        _store(entry, entries, entry.truncated)
+        yield entry.put_async()
+        # names were left out of a prefix now short of a full suggestion
+        if entry.truncated and len(entries) < SUGGEST_ENTRIES:
+            kind, prefix = p_key.id().split(':', 1)
+            taskqueue.add(url=SUGGEST_URL, params={
+                'kind': kind, 'refill': prefix.encode('utf-8')},
+                transactional=True)
+    elif entry.names:
+        yield p_key.delete_async()
+
+
+def _entry(entity):
+    """Return the (name, websafe key) of a speaker or conference."""
+    if entity.key.kind() == 'Conference':
+        return entity.name, websafeKey(entity)
+    return entity.name, entity.key.urlsafe()
+
+
+@ndb.transactional
+def _refillPrefix(p_key, entries):
+    entry = p_key.get() or NamePrefix(key=p_key)
+    # keep the names added while the kind was read; a name removed
+    # meanwhile may come back until it is renamed or deleted again
+    found = dict((k, n) for n, k in entries)
+    found.update((k, n) for n, k in zip(entry.names, entry.keys))
+    _store(entry, [(n, k) for k, n in found.items()])
+    entry.put()
+
+
+def refillPrefix(kind, prefix):
+    """Rebuild a prefix of a kind from all its speakers or conferences;
+    the refill task."""
+    if kind not in KINDS:
+        return
+    entries = []
+    for entity in MODELS[kind].query().iter(batch_size=500):
+        if entity.name and _matches(entity.name, prefix):
+            entries.append(_entry(entity))
+    p_id = _prefixId(kind, prefix)
+    _hot.pop(p_id, None)
+    _refillPrefix(ndb.Key(NamePrefix, p_id), entries)
+
+
+def updateSuggestions(kind, key, name=None, oldName=None):
+    """Move a speaker or conference from the prefixes of oldName to those
+    of name; the suggestion task."""
+    if kind not in KINDS:
+        return
+    newPrefixes = prefixes(name)
+    futures = []
+    for prefix in newPrefixes | prefixes(oldName):
+        p_id = _prefixId(kind, prefix)
+        _hot.pop(p_id, None)
+        futures.append(_updatePrefixAsync(
+            ndb.Key(NamePrefix, p_id), key,
+            name if prefix in newPrefixes else None))
+    for future in futures:
+        future.get_result()
+
+
+def indexName(entity):
+    """Queue the indexing of a speaker or conference name; a map
+    function."""
+    name, key = _entry(entity)
+    queueSuggestionUpdate(entity.key.kind().lower(), key, name)
+    return False
+
+
+def suggest(query, kinds=KINDS, limit=SUGGEST_ENTRIES):
+    """Return the first limit (kind, name, websafe key) of the speakers
+    and conferences (kinds) with a word starting the query, in name
+    order."""
+    query = normalize(query)
+    if not query:
+        return []
+    prefix = query[:SUGGEST_PREFIX_LENGTH].rstrip()
+    ids = [_prefixId(kind, prefix) for kind in kinds]
+
+    now = time.time()
+    entries = dict((p_id, _hot[p_id]) for p_id in ids
+                   if p_id in _hot and _hot[p_id][2] > now)
+    missing = [p_id for p_id in ids if p_id not in entries]
+    for p_id, entry in zip(missing, ndb.get_multi(
+            [ndb.Key(NamePrefix, p_id) for p_id in missing])):
+        entries[p_id] = (entry.names, entry.keys, 0) if entry else ([], [], 0)
+        if len(prefix) <= SUGGEST_HOT_LENGTH:
+            if len(_hot) >= HOT_MAX_KEYS:
+                _hot.clear()
+            _hot[p_id] = entries[p_id][:2] + (now + SUGGEST_HOT_SECONDS,)
+
+    found = []
+    for kind, p_id in zip(kinds, ids):
+        names, keys, expires = entries[p_id]
+        found.extend((kind, name, key) for name, key in zip(names, keys)
+                     if len(query) <= len(prefix) or _matches(name, query))
+    return sorted(found, key=lambda f: normalize(f[1]))[:limit]
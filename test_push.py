@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""test_push.py
+
+Tests of the seats pushed to conference detail pages: a burst of seat
+changes is coalesced into one recompute, the recompute fans the sends out
+over push tasks, the tasks send every live subscriber one message through
+a LocalChannel and subscriptions are bounded per user and conference.
+
+Run from the project root with the App Engine SDK and its endpoints
+library on the python path:
+
+    python test_push.py
+
+"""
+
+import base64
+import json
+import os
+import unittest
+import urlparse
+from datetime import datetime, timedelta
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import coalescer
+import push
+from models import Conference
+from models import SeatSubscription
+from rehome import websafeKey
+
+
+class PushSeatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(
+            root_path=os.path.dirname(os.path.abspath(__file__)))
+        ndb.get_context().set_cache_policy(False)
+        self.taskqueue = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        self.channel = push.LocalChannel()
+        self.previous = push.getChannel()
+        push.setChannel(self.channel)
+        conf = Conference(name='C', organizerUserId='org',
+                          maxAttendees=10, seatsAvailable=10)
+        conf.put()
+        self.wsck = websafeKey(conf)
+
+    def tearDown(self):
+        push.setChannel(self.previous)
+        self.testbed.deactivate()
+
+    def _subscribe(self, n):
+        return [push.addSeatSubscription(self.wsck, 'user%d' % i)[
+            len('local-'):] for i in range(n)]
+
+    def _runTasks(self, queue, url):
+        """Run the tasks of a queue posted to url; return their params."""
+        done = []
+        for task in self.taskqueue.GetTasks(queue):
+            if task['url'] == url:
+                self.taskqueue.DeleteTask(queue, task['name'])
+                done.append(urlparse.parse_qs(base64.b64decode(task['body'])))
+        return done
+
+    def testBurstIsCoalesced(self):
+        added = [coalescer.markDirty('seats', self.wsck) for _ in range(5)]
+        self.assertEqual([True, False, False, False, False], added)
+        recomputes = self._runTasks('default',
+                                    coalescer.RECOMPUTE_URL % 'seats')
+        self.assertEqual([[self.wsck]], [p['scope'] for p in recomputes])
+
+    def testBurstIsScheduledWithoutMemcache(self):
+        # memcache down, within one time slot
+        add, get = coalescer.memcache.add, coalescer.memcache.get
+        now = coalescer.time.time
+        coalescer.memcache.add = lambda *args, **kwargs: False
+        coalescer.memcache.get = lambda *args, **kwargs: None
+        coalescer.time.time = lambda: 1000.0
+        try:
+            added = [coalescer.markDirty('seats', self.wsck)
+                     for _ in range(3)]
+        finally:
+            coalescer.memcache.add, coalescer.memcache.get = add, get
+            coalescer.time.time = now
+        self.assertEqual(1, added.count(True))
+        self.assertEqual(1, len(self._runTasks(
+            'default', coalescer.RECOMPUTE_URL % 'seats')))
+
+    def testPublishFansOutSends(self):
+        clients = self._subscribe(push.PUSH_SEND_BATCH + 5)
+        self.assertEqual(len(clients), push.publishSeats(self.wsck))
+        self.assertEqual({}, dict(self.channel.messages))
+
+        sends = self._runTasks(push.PUSH_QUEUE, push.PUSH_SEND_URL)
+        self.assertEqual([push.PUSH_SEND_BATCH, 5],
+                         sorted([len(p['client']) for p in sends],
+                                reverse=True))
+        for params in sends:
+            push.sendSeats(params['client'], params['message'][0])
+        self.assertEqual(sorted(clients), sorted(self.channel.messages))
+        for messages in self.channel.messages.values():
+            self.assertEqual(1, len(messages))
+            self.assertEqual(10, json.loads(messages[0])['seatsAvailable'])
+
+    def testExpiredSubscriptionsAreDropped(self):
+        live, stale = self._subscribe(2)
+        sub = ndb.Key(SeatSubscription, stale).get()
+        sub.created = datetime.utcnow() - timedelta(
+            minutes=push.PUSH_TOKEN_MINUTES + 1)
+        sub.put()
+        self.assertEqual(1, push.sendSeats([live, stale], '{}'))
+        self.assertEqual({live: ['{}'], stale: [push.EXPIRED_MESSAGE]},
+                         dict(self.channel.messages))
+        self.assertIsNone(ndb.Key(SeatSubscription, stale).get())
+
+    def testSubscriptionsAreBounded(self):
+        push.PUSH_MAX_SUBSCRIBERS, limit = 3, push.PUSH_MAX_SUBSCRIBERS
+        try:
+            tokens = [push.addSeatSubscription(self.wsck, 'user%d' % i)
+                      for i in range(4)]
+        finally:
+            push.PUSH_MAX_SUBSCRIBERS = limit
+        self.assertIsNone(tokens[-1])
+        self.assertEqual(3, SeatSubscription.query().count())
+
+    def testUserSubscriptionsAreBounded(self):
+        tokens = [push.addSeatSubscription(self.wsck, 'user')
+                  for _ in range(push.PUSH_USER_SUBSCRIPTIONS + 1)]
+        self.assertIsNone(tokens[-1])
+        self.assertIsNotNone(push.addSeatSubscription(self.wsck, 'other'))
+
+    def testFirebaseToken(self):
+        self.testbed.init_app_identity_stub()
+        token = push.FirebaseChannel().createToken('client', 10)
+        claims = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(
+            claims + '=' * (-len(claims) % 4)))
+        self.assertEqual('client', claims['uid'])
+        self.assertEqual(push.FIREBASE_TOKEN_AUDIENCE, claims['aud'])
+
+    def testDeletedConferenceDropsSubscriptions(self):
+        self._subscribe(2)
+        ndb.Key(urlsafe=self.wsck).delete()
+        self.assertEqual(0, push.publishSeats(self.wsck))
+        self.assertEqual(0, SeatSubscription.query().count())
+        self.assertEqual([], self.taskqueue.GetTasks(push.PUSH_QUEUE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""trends.py
+
+Day by day activity of conferences. Registrations, cancellations, wishlist
+changes and new sessions append a small ActivityEvent once the write that
+makes them succeeded; the events are best effort, a failed put is logged
+and doesn't fail the request. Events are children of one of ACTIVITY_SHARDS log keys per
+conference rather than of the conference, so the request paths don't add
+writes to its entity group. An hourly cron rolls the events up into a
+DailyActivity bucket per conference and day, a child of the conference,
+and deletes them in the same transaction. getConferenceTrends reads a
+range of buckets with a single get_multi.
+
+"""
+
+import logging
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from google.appengine.ext import ndb
+from models import ActivityEvent
+from models import DailyActivity
+from rehome import conferenceKey
+from settings import ACTIVITY_SHARDS
+
+
+LOG_KIND = 'ActivityLog'
+# the DailyActivity counters, an event's kind is one of them
+ACTIVITY_KINDS = ('registrations', 'cancellations', 'wishlistAdds',
+                  'wishlistRemovals', 'sessions')
+ROLLUP_BATCH_SIZE = 500
+# a rollup run stops after this long, the next run picks up the rest
+ROLLUP_SECONDS = 300
+
+
+def activityEvent(wsck, kind, count=1):
+    """Return the event of count activities of a kind in a conference."""
+    log_key = ndb.Key(LOG_KIND, '%s|%d' % (
+        wsck, random.randint(0, ACTIVITY_SHARDS - 1)))
+    return ActivityEvent(parent=log_key, kind=kind, count=count)
+
+
+def recordActivity(wsck, kind, count=1):
+    """Put the event of count activities of a kind in a conference, after
+    the write making them; outside of its transaction, so the log shards
+    don't contend with it. A failed put is only logged."""
+    try:
+        activityEvent(wsck, kind, count).put()
+    except Exception:
+        logging.warning('Could not record %d %s of %s', count, kind, wsck,
+                        exc_info=True)
+
+
+def dayKey(c_key, day):
+    """Return the key of the DailyActivity of a conference for a date."""
+    return ndb.Key(DailyActivity, day.isoformat(), parent=c_key)
+
+
+@ndb.transactional(xg=True)
+def _rollupLog(c_key, eventKeys):
+    """Add the events of a log shard to the daily buckets of a conference
+    and delete them; return the number rolled up."""
+    events = [e for e in ndb.get_multi(eventKeys) if e]
+    if not events:
+        return 0
+    byDay = defaultdict(list)
+    for event in events:
+        byDay[event.created.date()].append(event)
+    days = sorted(byDay)
+    entities = ndb.get_multi([c_key] + [dayKey(c_key, day) for day in days])
+    # the activity of a deleted conference is dropped
+    if entities[0]:
+        buckets = []
+        for day, bucket in zip(days, entities[1:]):
+            bucket = bucket or DailyActivity(key=dayKey(c_key, day))
+            for event in byDay[day]:
+                if event.kind in ACTIVITY_KINDS:
+                    setattr(bucket, event.kind,
+                            getattr(bucket, event.kind) + event.count)
+            buckets.append(bucket)
+        ndb.put_multi(buckets)
+    ndb.delete_multi([event.key for event in events])
+    return len(events)
+
+
+def rollupActivity():
+    """Roll the pending events up into the daily buckets, for up to
+    ROLLUP_SECONDS; return the number of events rolled up."""
+    deadline = time.time() + ROLLUP_SECONDS
+    rolled = 0
+    while time.time() < deadline:
+        keys = ActivityEvent.query().fetch(ROLLUP_BATCH_SIZE, keys_only=True)
+        byLog = defaultdict(list)
+        for key in keys:
+            byLog[key.parent()].append(key)
+        done = 0
+        for log_key, eventKeys in byLog.items():
+            wsck = log_key.id().rsplit('|', 1)[0]
+            done += _rollupLog(conferenceKey(wsck), eventKeys)
+        rolled += done
+        # stop on the last batch, or when the query only returned events
+        # deleted already but still in its index
+        if len(keys) < ROLLUP_BATCH_SIZE or not done:
+            break
+    return rolled
+
+
+def getDailyActivity(c_key, start, end):
+    """Return (date, DailyActivity or None) for each day from start to end
+    included."""
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    return zip(days, ndb.get_multi([dayKey(c_key, day) for day in days]))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""warmup.py
+
+Warmup requests are sent to a new instance before it gets user traffic.
+warmup() loads the modules of the API, fills the caches the first requests
+read (announcement, featured speakers, the speakers of active
+conferences, the certificates used to check auth tokens) and opens the
+memcache and datastore connections, so the first user request of the
+instance doesn't pay for them. Each step is timed and logged.
+
+"""
+
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from models import Conference
+from models import Session
+from settings import WARMUP_CONFERENCES
+from settings import WARMUP_SPEAKERS
+
+
+def _loadModules():
+    """Import the API and the modules its requests load lazily."""
+    import conference
+    import endpoints.users_id_token
+    return conference
+
+
+def _activeConferences():
+    """Return the conferences changed last, e.g. by registrations, those
+    most read now."""
+    return Conference.query().order(-Conference.modified).fetch(
+        WARMUP_CONFERENCES)
+
+
+def _warmCaches(api, confs):
+    """Fill the cached announcement and featured speakers."""
+    from rehome import websafeKey
+    futures = [api._getAnnouncementAsync()] + [
+        api._getFeaturedSpeakerAsync(websafeKey(conf)) for conf in confs]
+    for future in futures:
+        future.get_result()
+
+
+def _warmSpeakers(confs):
+    """Read the speakers of the sessions of confs, which also puts them
+    in memcache for the speaker endpoints."""
+    queries = [Session.query(ancestor=conf.key).fetch_async()
+               for conf in confs]
+    speakerKeys = []
+    for query in queries:
+        for session in query.get_result():
+            speakerKeys.extend(sk for sk in session.speakerKeys
+                               if sk not in speakerKeys)
+    ndb.get_multi([ndb.Key(urlsafe=sk)
+                   for sk in speakerKeys[:WARMUP_SPEAKERS]])
+
+
+def _warmAuth():
+    """Fetch the certificates that signed ID tokens are checked against,
+    unless another instance cached them already."""
+    from endpoints import users_id_token
+    users_id_token._get_cached_certs(users_id_token._DEFAULT_CERT_URI,
+                                     memcache)
+
+
+def warmup():
+    """Warm up a new instance; return the milliseconds each step took."""
+    timings = []
+
+    def timed(name, func, *args):
+        started = time.time()
+        try:
+            return func(*args)
+        except Exception:
+            # a cold cache is slower, not broken; keep warming the rest
+            logging.exception('Warmup step %s failed', name)
+        finally:
+            timings.append((name, int((time.time() - started) * 1000)))
+
+    conference = timed('modules', _loadModules)
+    confs = timed('conferences', _activeConferences) or []
+    if conference:
+        timed('caches', _warmCaches, conference.ConferenceApi, confs)
+    timed('speakers', _warmSpeakers, confs)
+    timed('auth', _warmAuth)
+    logging.info('Warmup took %d ms: %s', sum(ms for _, ms in timings),
+                 ', '.join('%s %d ms' % step for step in timings))
+    return timings